@@ -0,0 +1,13 @@
+"""
+Benchmarks of PyLoopKit's throughput and latency
+
+Run "python -m benchmarks run --output results.json" to time the example
+issue reports (and each stage of the Loop algorithm on them), and
+"python -m benchmarks compare baseline.json results.json" to check the new
+results for regressions. Add "--synthetic 100,1000,10000" to also time
+synthetic inputs of those sizes (see synthetic_data.py).
+
+Run "python -m benchmarks trace report.json --output trace.json" (or
+"--synthetic 10000" instead of a report) to save the nested spans of one run
+as Chrome trace events, which open in chrome://tracing or ui.perfetto.dev.
+"""
@@ -0,0 +1,286 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Run the benchmarks, save them as JSON baselines, and compare results to a
+baseline
+
+A result file looks like
+{
+    "python": "3.11.7", "numpy": "1.26.4", "created": "2026-...",
+    "benchmarks": {
+        "example_issue_report_1/update": {"min": ..., "median": ..., ...},
+        "example_issue_report_1/stages/momentum": {...},
+        ...
+    }
+}
+with the times in seconds per call.
+"""
+import argparse
+from datetime import datetime
+import json
+import os
+import platform
+import statistics
+import timeit
+import warnings
+import numpy
+
+from benchmarks.stages import loop_stages
+from benchmarks.synthetic_data import scaled_synthetic_input
+from pyloopkit.instrumentation import Tracer
+from pyloopkit.loop_data_manager import update
+from pyloopkit.pyloop_parser import (find_report_paths, parse_report,
+                                     parse_report_and_run_with_name)
+
+EXAMPLE_FILES = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+    "pyloopkit", "example_files"
+)
+
+
+def example_report_paths():
+    """ The example issue reports in pyloopkit/example_files """
+    return [
+        path for path in find_report_paths(
+            os.path.join(EXAMPLE_FILES, "example_issue_report_*.json")
+        )
+        if not path.endswith("-output.json")
+    ]
+
+
+def time_call(function, repeat=5, min_time=0.05):
+    """ Time a function
+
+    Arguments:
+    function -- function that takes no arguments
+    repeat -- the number of times to time it
+    min_time -- each timing calls the function enough times to take at
+                least this long (seconds)
+
+    Output:
+    Dictionary with the "min", "median" and "max" time of a call
+    (seconds), and the number of calls each timing made ("number")
+    """
+    timer = timeit.Timer(function)
+    number = 1
+    while timer.timeit(number) < min_time and number < 1000000:
+        number *= 10
+
+    times = [time_ / number for time_ in timer.repeat(repeat, number)]
+
+    return {
+        "min": min(times),
+        "median": statistics.median(times),
+        "max": max(times),
+        "number": number
+    }
+
+
+def benchmark_input(name, input_dict, report_path=None, repeat=5):
+    """ Time a full run of update, and each stage of it, on an input
+        dictionary
+
+    Arguments:
+    name -- the prefix of the benchmark names
+    input_dict -- dictionary in the format update takes
+    report_path -- the issue report the input dictionary was parsed from,
+                   if any; the full run then includes parsing it
+    repeat -- the number of times to time each benchmark
+
+    Output:
+    Dictionary of benchmark name to timing (see time_call)
+    """
+    results = {}
+    if report_path is not None:
+        results[name + "/parse_report_and_run"] = time_call(
+            lambda: parse_report_and_run_with_name(report_path), repeat
+        )
+    results[name + "/update"] = time_call(lambda: update(input_dict), repeat)
+
+    for (stage, function) in loop_stages(input_dict, report_path):
+        results[name + "/stages/" + stage] = time_call(function, repeat)
+
+    return results
+
+
+def run_benchmarks(report_paths=None, repeat=5, synthetic_sizes=()):
+    """ Run the benchmarks on issue reports and synthetic inputs
+
+    Arguments:
+    report_paths -- the paths of the issue reports (the example reports if
+                    None)
+    repeat -- the number of times to time each benchmark
+    synthetic_sizes -- sizes of synthetic inputs to also run
+                       (see scaled_synthetic_input)
+
+    Output:
+    Result dictionary (see the module docstring)
+    """
+    if report_paths is None:
+        report_paths = example_report_paths()
+
+    benchmarks = {}
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        for path in report_paths:
+            name = os.path.splitext(os.path.basename(path))[0]
+            benchmarks.update(benchmark_input(
+                name, parse_report(path), path, repeat
+            ))
+
+        for size in synthetic_sizes:
+            benchmarks.update(benchmark_input(
+                "synthetic_" + str(size), scaled_synthetic_input(size),
+                repeat=repeat
+            ))
+
+    return {
+        "python": platform.python_version(),
+        "numpy": numpy.__version__,
+        "created": datetime.now().isoformat(),
+        "benchmarks": benchmarks
+    }
+
+
+def compare_results(baseline, results, threshold=0.2):
+    """ Find the benchmarks that got slower than a baseline
+
+        Benchmarks are compared by their fastest time, which is the least
+        affected by other work on the machine.
+
+    Arguments:
+    baseline -- result dictionary to compare to
+    results -- the new result dictionary
+    threshold -- the fraction a benchmark can get slower by before it's a
+                 regression
+
+    Output:
+    List of (benchmark name, baseline time, new time, ratio of the times)
+    tuples for the benchmarks that regressed, from the worst regression
+    """
+    regressions = []
+    for (name, timing) in results.get("benchmarks").items():
+        baseline_timing = baseline.get("benchmarks").get(name)
+        if baseline_timing is None:
+            continue
+
+        ratio = timing.get("min") / baseline_timing.get("min")
+        if ratio > 1 + threshold:
+            regressions.append(
+                (name, baseline_timing.get("min"), timing.get("min"), ratio)
+            )
+
+    return sorted(regressions, key=lambda regression: -regression[3])
+
+
+def trace_input(output_path, report_path=None, input_dict=None):
+    """ Trace one run of update and save it as Chrome trace events
+
+    Arguments:
+    output_path -- the JSON file to save the trace to
+    report_path -- the issue report to run (parsing it is also traced)
+    input_dict -- the input dictionary to run, if there's no report
+
+    Output:
+    The Tracer the run was recorded to
+    """
+    tracer = Tracer()
+    with warnings.catch_warnings():
+        warnings.simplefilter("ignore")
+        if report_path is not None:
+            with tracer.span("parse_report", {"report": report_path}):
+                input_dict = parse_report(report_path)
+        update(input_dict, instrumentation=tracer)
+
+    tracer.save_chrome_trace(output_path)
+    return tracer
+
+
+def main(argv=None):
+    """ Command line entry point
+
+    Output:
+    Exit code: 1 if "compare" found regressions, otherwise 0
+    """
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    commands = parser.add_subparsers(dest="command")
+    commands.required = True
+
+    run_parser = commands.add_parser("run", help="run the benchmarks")
+    run_parser.add_argument("reports", nargs="*",
+                            help="issue reports (default: the examples)")
+    run_parser.add_argument("--output", required=True,
+                            help="JSON file to save the results to")
+    run_parser.add_argument("--repeat", type=int, default=5)
+    run_parser.add_argument(
+        "--synthetic", default="",
+        help="comma-separated sizes of synthetic inputs to also run, "
+        + "like 10,100,1000"
+    )
+    run_parser.add_argument("--no-reports", action="store_true",
+                            help="only run the synthetic inputs")
+
+    compare_parser = commands.add_parser(
+        "compare", help="compare results to a baseline"
+    )
+    compare_parser.add_argument("baseline")
+    compare_parser.add_argument("results")
+    compare_parser.add_argument("--threshold", type=float, default=0.2,
+                                help="allowed slowdown (0.2 is 20%%)")
+
+    trace_parser = commands.add_parser(
+        "trace", help="trace one run as Chrome trace events"
+    )
+    trace_parser.add_argument("report", nargs="?",
+                              help="issue report to run")
+    trace_parser.add_argument("--synthetic", type=int,
+                              help="size of a synthetic input to run instead")
+    trace_parser.add_argument("--output", required=True,
+                              help="JSON file to save the trace to")
+
+    arguments = parser.parse_args(argv)
+
+    if arguments.command == "trace":
+        if (arguments.report is None) == (arguments.synthetic is None):
+            parser.error("trace takes either a report or --synthetic")
+        tracer = trace_input(
+            arguments.output,
+            report_path=arguments.report,
+            input_dict=(
+                scaled_synthetic_input(arguments.synthetic)
+                if arguments.synthetic is not None else None
+            )
+        )
+        for (name, seconds) in tracer.stages.items():
+            print("{:<60} {:>10.3f} ms".format(name, seconds * 1000))
+        print("Saved {} spans to {}".format(
+            len(tracer.spans), arguments.output
+        ))
+        return 0
+
+    if arguments.command == "run":
+        results = run_benchmarks(
+            [] if arguments.no_reports else arguments.reports or None,
+            arguments.repeat,
+            [int(size) for size in arguments.synthetic.split(",") if size]
+        )
+        with open(arguments.output, "w") as file:
+            json.dump(results, file, indent=4, sort_keys=True)
+        for (name, timing) in sorted(results.get("benchmarks").items()):
+            print("{:<60} {:>10.3f} ms".format(name, timing["min"] * 1000))
+        return 0
+
+    with open(arguments.baseline) as file:
+        baseline = json.load(file)
+    with open(arguments.results) as file:
+        results = json.load(file)
+
+    regressions = compare_results(baseline, results, arguments.threshold)
+    for (name, baseline_time, time_, ratio) in regressions:
+        print("{:<60} {:>10.3f} ms -> {:>10.3f} ms ({:+.0%})".format(
+            name, baseline_time * 1000, time_ * 1000, ratio - 1
+        ))
+    if not regressions:
+        print("No regressions beyond {:.0%}".format(arguments.threshold))
+
+    return 1 if regressions else 0
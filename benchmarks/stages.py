@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+The stages of a run of the Loop algorithm, each callable on its own
+
+The stages are run in order once (the way update runs them, starting from
+the 24 hours before the run time), and each one is given back as a function
+that repeats the stage with the same inputs.
+"""
+# pylint: disable=R0914
+from datetime import timedelta
+
+from pyloopkit.carb_store import get_carb_glucose_effects_and_carbs_on_board
+from pyloopkit.dose_math import recommended_temp_basal_and_bolus
+from pyloopkit.dose_store import get_glucose_effects
+from pyloopkit.glucose_store import (get_recent_momentum_effects,
+                                     get_counteraction_effects)
+from pyloopkit.input_validation_tools import is_loop_input_valid
+from pyloopkit.insulin_model import compile_insulin_model
+from pyloopkit.loop_data_manager import (
+    update_retrospective_glucose_effect, get_pending_insulin,
+    update_predicted_glucose_and_recommended_basal_and_bolus)
+from pyloopkit.loop_math import predict_glucose
+from pyloopkit.pyloop_parser import parse_report
+
+STAGE_NAMES = [
+    "parse", "validation", "momentum", "insulin_effects", "counteraction",
+    "carb_effects", "retrospective_correction", "prediction",
+    "recommendation"
+]
+
+
+def loop_stages(input_dict, report_path=None):
+    """ Get each stage of a run of the Loop algorithm on an input
+        dictionary
+
+    Arguments:
+    input_dict -- dictionary in the format update takes
+    report_path -- the issue report the input dictionary was parsed from,
+                   if any (otherwise there's no "parse" stage)
+
+    Output:
+    List of (stage name, function that runs the stage) tuples, in the
+    order of STAGE_NAMES
+    """
+    settings = input_dict.get("settings_dictionary")
+    now = input_dict.get("time_to_calculate_at")
+    glucose = (input_dict.get("glucose_dates"),
+               input_dict.get("glucose_values"))
+    doses = (input_dict.get("dose_types"), input_dict.get("dose_start_times"),
+             input_dict.get("dose_end_times"), input_dict.get("dose_values"))
+    carbs = (input_dict.get("carb_dates"), input_dict.get("carb_values"),
+             input_dict.get("carb_absorption_times"))
+    sensitivities = (input_dict.get("sensitivity_ratio_start_times"),
+                     input_dict.get("sensitivity_ratio_end_times"),
+                     input_dict.get("sensitivity_ratio_values"))
+    carb_ratios = (input_dict.get("carb_ratio_start_times"),
+                   input_dict.get("carb_ratio_values"))
+    basal_rates = (input_dict.get("basal_rate_start_times"),
+                   input_dict.get("basal_rate_values"),
+                   input_dict.get("basal_rate_minutes"))
+    target_ranges = (input_dict.get("target_range_start_times"),
+                     input_dict.get("target_range_end_times"),
+                     input_dict.get("target_range_minimum_values") or [],
+                     input_dict.get("target_range_maximum_values"))
+    last_temp_basal = input_dict.get("last_temporary_basal")
+
+    model = compile_insulin_model(settings.get("model"))
+    start = now - timedelta(hours=24)
+    retrospective_start = glucose[0][-1] - timedelta(
+        minutes=settings.get(
+            "retrospective_correction_integration_interval") or 30
+    )
+
+    stages = []
+    if report_path is not None:
+        stages.append(("parse", lambda: parse_report(report_path)))
+
+    def run_stage(name, function):
+        stages.append((name, function))
+        return function()
+
+    run_stage("validation", lambda: is_loop_input_valid(input_dict))
+
+    momentum_effects = run_stage(
+        "momentum",
+        lambda: get_recent_momentum_effects(
+            *glucose, start, now,
+            settings.get("momentum_data_interval") or 15, 5
+        )
+    )
+
+    (insulin_effects, future_insulin_effects) = run_stage(
+        "insulin_effects",
+        lambda: [
+            get_glucose_effects(
+                *doses, date, *basal_rates, *sensitivities, model,
+                delay=settings.get("insulin_delay") or 10,
+                engine=settings.get("insulin_effect_engine") or "iterative"
+            )
+            for date in [start, now]
+        ]
+    )
+
+    counteraction_effects = run_stage(
+        "counteraction",
+        lambda: get_counteraction_effects(*glucose, start, *insulin_effects)
+    )
+
+    (carb_effects, _) = run_stage(
+        "carb_effects",
+        lambda: get_carb_glucose_effects_and_carbs_on_board(
+            *carbs, retrospective_start, now,
+            *counteraction_effects if settings.get(
+                "dynamic_carb_absorption_enabled"
+            ) is not False else ([], [], []),
+            *carb_ratios, *sensitivities,
+            settings.get("default_absorption_times"),
+            delay=settings.get("carb_delay") or 10
+        )
+    )
+
+    retrospective_effects = run_stage(
+        "retrospective_correction",
+        lambda: update_retrospective_glucose_effect(
+            *glucose, *carb_effects, *counteraction_effects,
+            settings.get("recency_interval") or 15,
+            settings.get("retrospective_correction_grouping_interval") or 30,
+            now
+        )
+    ) if settings.get("retrospective_correction_enabled") else ([], [])
+
+    run_stage(
+        "prediction",
+        lambda: predict_glucose(
+            glucose[0][-1], glucose[1][-1],
+            *momentum_effects, *carb_effects, *future_insulin_effects,
+            *retrospective_effects
+        )
+    )
+
+    # recommend doses from the prediction update makes, which is extended
+    # to the insulin model's duration
+    recommendations = (
+        update_predicted_glucose_and_recommended_basal_and_bolus(
+            now, *glucose, *momentum_effects, *carb_effects,
+            *future_insulin_effects, *retrospective_effects,
+            *target_ranges, settings.get("suspend_threshold"),
+            *sensitivities, model, *basal_rates,
+            settings.get("max_basal_rate"), settings.get("max_bolus"),
+            last_temp_basal, rate_rounder=settings.get("rate_rounder")
+        )
+    )
+    pending_insulin = get_pending_insulin(now, *basal_rates, last_temp_basal)
+    run_stage(
+        "recommendation",
+        lambda: recommended_temp_basal_and_bolus(
+            recommendations.get("predicted_glucose_dates"),
+            recommendations.get("predicted_glucose_values"),
+            *target_ranges, now, settings.get("suspend_threshold"),
+            *sensitivities, model, *basal_rates,
+            settings.get("max_basal_rate"), last_temp_basal,
+            pending_insulin, settings.get("max_bolus"),
+            30, 11,
+            settings.get("rate_rounder"), settings.get("rate_rounder")
+        )
+    )
+
+    return stages
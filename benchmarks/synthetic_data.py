@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Synthetic patient data, for benchmarking how the Loop algorithm scales
+
+The inputs are made up (glucose follows a random walk, and doses and carbs
+are at random times), but they pass the checks in input_validation_tools,
+and the same seed always gives the same input dictionary.
+"""
+# pylint: disable=R0913, R0914
+from datetime import datetime, time, timedelta, timezone
+import numpy
+
+from pyloopkit.dose import DoseType
+
+DEFAULT_DATE = datetime(2019, 8, 1, 12, 0, tzinfo=timezone.utc)
+
+
+def synthetic_input(
+        seed=0, hours=24,
+        glucose_count=288, temp_basal_count=48, bolus_count=12,
+        carb_count=4, time_to_calculate_at=DEFAULT_DATE):
+    """ Generate an input dictionary for update
+
+    Arguments:
+    seed -- the seed of the random numbers
+    hours -- the length of the history the samples are spread over (hours)
+    glucose_count -- the number of glucose samples, evenly spaced over the
+                     history (288 is 24 hours at a 5-minute cadence)
+    temp_basal_count -- the number of back-to-back temp basals covering the
+                        history
+    bolus_count -- the number of boluses, at random times
+    carb_count -- the number of carb entries, at random times (which can
+                  overlap)
+    time_to_calculate_at -- the time the run is at; the history ends here
+
+    Output:
+    Dictionary in the format update takes
+    """
+    random = numpy.random.RandomState(seed)
+    history_start = time_to_calculate_at - timedelta(hours=hours)
+    history_seconds = hours * 60 * 60
+
+    # glucose wanders around 140 mg/dL, ending a minute before the run
+    glucose_offsets = numpy.linspace(
+        0, history_seconds - 60, glucose_count
+    )
+    glucose_values = []
+    glucose = 140.0
+    for step in random.normal(0, 3, glucose_count).tolist():
+        glucose = min(400.0, max(40.0, 140 + 0.98 * (glucose - 140) + step))
+        glucose_values.append(glucose)
+
+    temp_basal_edges = numpy.linspace(
+        0, history_seconds, temp_basal_count + 1
+    )
+    temp_basal_rates = numpy.round(
+        random.uniform(0, 3, temp_basal_count) / 0.05
+    ) * 0.05
+
+    bolus_offsets = numpy.sort(random.uniform(
+        0, history_seconds, bolus_count
+    ))
+    bolus_values = numpy.round(
+        random.uniform(0.05, 2, bolus_count) / 0.05
+    ) * 0.05
+
+    carb_offsets = numpy.sort(random.uniform(
+        0, history_seconds, carb_count
+    ))
+    carb_values = numpy.round(random.uniform(5, 80, carb_count))
+    carb_absorptions = random.choice([120.0, 180.0, 240.0], carb_count)
+
+    def dates(offsets):
+        return [
+            history_start + timedelta(seconds=offset)
+            for offset in offsets.tolist()
+        ]
+
+    doses = sorted(
+        [
+            [DoseType.tempbasal, start, end, rate] for (start, end, rate)
+            in zip(dates(temp_basal_edges[:-1]), dates(temp_basal_edges[1:]),
+                   temp_basal_rates.tolist())
+        ]
+        + [
+            [DoseType.bolus, date, date, value] for (date, value)
+            in zip(dates(bolus_offsets), bolus_values.tolist())
+        ],
+        key=lambda dose: dose[1]
+    )
+
+    temp_basals = [dose for dose in doses if dose[0] == DoseType.tempbasal]
+
+    return {
+        "time_to_calculate_at": time_to_calculate_at,
+
+        "glucose_dates": dates(glucose_offsets),
+        "glucose_values": glucose_values,
+        "glucose_units": "mg/dL",
+
+        "dose_types": [dose[0] for dose in doses],
+        "dose_start_times": [dose[1] for dose in doses],
+        "dose_end_times": [dose[2] for dose in doses],
+        "dose_values": [dose[3] for dose in doses],
+        "dose_value_units": "U or U/hr",
+
+        "carb_dates": dates(carb_offsets),
+        "carb_values": carb_values.tolist(),
+        "carb_absorption_times": carb_absorptions.tolist(),
+        "carb_value_units": "g",
+
+        "settings_dictionary": {
+            "model": [360.0, 75],
+            "momentum_data_interval": 15.0,
+            "suspend_threshold": 70.0,
+            "dynamic_carb_absorption_enabled": True,
+            "retrospective_correction_integration_interval": 30,
+            "recency_interval": 15,
+            "retrospective_correction_grouping_interval": 30,
+            "rate_rounder": 0.05,
+            "insulin_delay": 10,
+            "carb_delay": 10,
+            "default_absorption_times": [120.0, 180.0, 240.0],
+            "max_basal_rate": 5.0,
+            "max_bolus": 10.0,
+            "retrospective_correction_enabled": True
+        },
+
+        "sensitivity_ratio_start_times": [time(0, 0), time(10, 30),
+                                          time(18, 0)],
+        "sensitivity_ratio_end_times": [time(10, 30), time(18, 0),
+                                        time(0, 0)],
+        "sensitivity_ratio_values": [50.0, 40.0, 45.0],
+        "sensitivity_ratio_value_units": "mg/dL/U",
+
+        "carb_ratio_start_times": [time(0, 0), time(11, 30), time(17, 0)],
+        "carb_ratio_values": [15.0, 10.0, 11.0],
+        "carb_ratio_value_units": "g/U",
+
+        "basal_rate_start_times": [time(0, 0), time(5, 30), time(12, 30)],
+        "basal_rate_minutes": [330.0, 420.0, 690.0],
+        "basal_rate_values": [0.65, 0.9, 0.7],
+        "basal_rate_units": "U/hr",
+
+        "target_range_start_times": [time(0, 0), time(13, 30)],
+        "target_range_end_times": [time(13, 30), time(0, 0)],
+        "target_range_minimum_values": [100.0, 90.0],
+        "target_range_maximum_values": [110.0, 100.0],
+        "target_range_value_units": "mg/dL",
+
+        "last_temporary_basal": list(temp_basals[-1]) if temp_basals else []
+    }
+
+
+def scaled_synthetic_input(size, seed=0):
+    """ Generate a day of synthetic data with about size samples of each
+        kind: size glucose samples and boluses (so 1440 is a sample every
+        minute), size / 4 temp basals, and size / 20 carb entries
+    """
+    return synthetic_input(
+        seed=seed,
+        glucose_count=max(2, size),
+        temp_basal_count=max(1, size // 4),
+        bolus_count=size,
+        carb_count=max(1, size // 20)
+    )
@@ -8,17 +8,13 @@ Created on Sun Aug 11 13:03:07 2019
 # pylint: disable=C0103
 import json
 import datetime
-import pandas as pd
-import numpy as np
-import plotly.graph_objs as go
-from plotly.offline import plot
 
-from pyloopkit.dose import DoseType
 from pyloopkit.generate_graphs import plot_graph, plot_loop_inspired_glucose_graph
 #from .loop_kit_tests import find_root_path
 from pyloopkit.loop_math import predict_glucose
 from pyloopkit.pyloop_parser import (
-    parse_report_and_run, parse_dictionary_from_previous_run
+    parse_report_and_run, parse_dictionary_from_previous_run,
+    convert_times_and_types
 )
 
 # %% find the path to the file in the repo
@@ -84,16 +80,6 @@ else:
 
 
 # save dictionary as json file
-def convert_times_and_types(obj):
-    """ Convert dates and dose types into strings when saving as a json """
-    if isinstance(obj, datetime.datetime):
-        return obj.isoformat()
-    if isinstance(obj, datetime.time):
-        return obj.isoformat()
-    if isinstance(obj, DoseType):
-        return str(obj.name)
-
-
 with open(name.split(".")[0] + "-output.json", "w") as f:
     json.dump(
         recommendations,
@@ -188,6 +174,12 @@ plot_loop_inspired_glucose_graph(
     )
 
 # %% visualize inputs as a Tidepool daily view
+# pandas and plotly are only needed for this view, so they're imported here
+import pandas as pd  # pylint: disable=C0413
+import numpy as np  # pylint: disable=C0413
+import plotly.graph_objs as go  # pylint: disable=C0413
+from plotly.offline import plot  # pylint: disable=C0413
+
 current_time = inputs.get("time_to_calculate_at")
 
 # blood glucose data
@@ -442,3 +434,15 @@ layout = go.Layout(
 
 fig = go.Figure(data=data, layout=layout)
 plot(fig, filename=name.split(".")[0] + '-output.html')
+
+# %% to run a whole directory of issue reports at once (one line of
+# output-file.jsonl per report), use
+# summary = parse_reports_and_run("path/to/reports", "output-file.jsonl")
+
+# %% to save the predicted glucose graphs of many runs without displaying
+# them, use
+# paths = list(render_loop_inspired_glucose_graphs(
+#     loop_inspired_glucose_graph_arguments(output, "graph-%d" % i)
+#     for (i, output) in enumerate(outputs)
+# ))
+# (both are in pyloopkit.generate_graphs)
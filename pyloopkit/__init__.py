@@ -1,4 +1,4 @@
 name = "pyloopkit"
 
 from pyloopkit.loop_math import predict_glucose
-from pyloopkit.loop_data_manager import update
+from pyloopkit.loop_data_manager import update, update_many
@@ -11,13 +11,18 @@ https://github.com/tidepool-org/LoopKit/blob/
 import sys
 from datetime import timedelta
 
-from pyloopkit.insulin_math import find_ratio_at_time
+from pyloopkit.loop_math import windowed_sums
+from pyloopkit.schedule import compiled_schedule
 from pyloopkit.date import (time_interval_since,
                             date_floored_to_time_interval,
-                            date_ceiled_to_time_interval)
-from pyloopkit import carb_status
+                            date_ceiled_to_time_interval,
+                            timeline_dates,
+                            timestamp_since_reference_date,
+                            MICROSECONDS_PER_SECOND)
+from pyloopkit import carb_status, instrumentation
 
 
+@instrumentation.traced
 def map_(
         carb_entry_starts, carb_entry_quantities, carb_entry_absorptions,
         effect_starts, effect_ends, effect_values,
@@ -109,21 +114,19 @@ def map_(
         return ([], [], [])
 
     builder_entry_indexes = list(range(0, len(carb_entry_starts)))
+    instrumentation.count("carb_builders", len(builder_entry_indexes))
+
+    sensitivity_schedule = compiled_schedule(
+        sensitivity_starts, sensitivity_ends, sensitivity_values
+        )
+    carb_ratio_schedule = compiled_schedule(
+        carb_ratio_starts, [], carb_ratios
+        )
 
     # CSF is in mg/dL/g
     builder_carb_sensitivities = [
-        find_ratio_at_time(
-            sensitivity_starts,
-            sensitivity_ends,
-            sensitivity_values,
-            carb_entry_starts[i]
-            ) /
-        find_ratio_at_time(
-            carb_ratio_starts,
-            [],
-            carb_ratios,
-            carb_entry_starts[i]
-            )
+        sensitivity_schedule.value_at(carb_entry_starts[i]) /
+        carb_ratio_schedule.value_at(carb_entry_starts[i])
         for i in builder_entry_indexes
         ]
 
@@ -527,6 +530,7 @@ def simulation_date_range(
     return (start_date, end_date)
 
 
+@instrumentation.traced
 def carbs_on_board(
         carb_starts, carb_quantities, carb_absorptions,
         default_absorption_time,
@@ -570,8 +574,7 @@ def carbs_on_board(
         end=end
         )
 
-    date = start
-    cob_start_dates = []
+    cob_start_dates = timeline_dates(start, end, delta)
     cob_values = []
 
     def find_partial_effect(i):
@@ -584,14 +587,12 @@ def carbs_on_board(
             carb_absorptions[i]
             )
 
-    while date <= end:
+    for date in cob_start_dates:
         cob_sum = 0
         for i in range(0, len(carb_starts)):
             cob_sum += find_partial_effect(i)
 
-        cob_start_dates.append(date)
         cob_values.append(cob_sum)
-        date += timedelta(minutes=delta)
 
     assert len(cob_start_dates) == len(cob_values),\
         "expected output shapes to match"
@@ -640,6 +641,7 @@ def carbs_on_board_helper(
     return value
 
 
+@instrumentation.traced
 def dynamic_carbs_on_board(
         carb_starts, carb_quantities, carb_absorptions,
         absorptions, timelines,
@@ -696,8 +698,7 @@ def dynamic_carbs_on_board(
         scaler=scaler
         )
 
-    date = start
-    cob_dates = []
+    cob_dates = timeline_dates(start, end, delta)
     cob_values = []
 
     def find_partial_cob(i):
@@ -713,20 +714,19 @@ def dynamic_carbs_on_board(
             carb_absorptions[i]
             )
 
-    while date <= end:
+    for date in cob_dates:
         cob_sum = 0
         for i in range(0, len(carb_starts)):
             cob_sum += find_partial_cob(i)
 
-        cob_dates.append(date)
         cob_values.append(cob_sum)
-        date += timedelta(minutes=delta)
 
     assert len(cob_dates) == len(cob_values),\
         "expected output shapes to match"
     return (cob_dates, cob_values)
 
 
+@instrumentation.traced
 def carb_glucose_effects(
         carb_starts, carb_quantities, carb_absorptions,
         carb_ratio_starts, carb_ratios,
@@ -794,42 +794,51 @@ def carb_glucose_effects(
         scaler=scaler
         )
 
-    date = start
-    effect_start_dates = []
-    effect_values = []
+    effect_start_dates = timeline_dates(start, end, delta)
 
-    def find_partial_effect(i):
-        insulin_sensitivity = find_ratio_at_time(
-            sensitivity_starts,
-            sensitivity_ends,
-            sensitivity_values,
-            carb_starts[i]
-            )
-        carb_ratio = find_ratio_at_time(
-            carb_ratio_starts,
-            [],
-            carb_ratios,
-            carb_starts[i]
-            )
-        return carb_glucose_effect(
-            carb_starts[i],
-            carb_quantities[i],
-            date,
-            carb_ratio,
-            insulin_sensitivity,
-            default_absorption_time,
-            delay,
-            carb_absorptions[i]
-            )
+    # the ratios for each carb entry don't depend on the date
+    sensitivity_schedule = compiled_schedule(
+        sensitivity_starts, sensitivity_ends, sensitivity_values
+        )
+    carb_ratio_schedule = compiled_schedule(
+        carb_ratio_starts, [], carb_ratios
+        )
+    insulin_sensitivities = [
+        sensitivity_schedule.value_at(carb_start) for carb_start in carb_starts
+        ]
+    carb_ratio_values = [
+        carb_ratio_schedule.value_at(carb_start) for carb_start in carb_starts
+        ]
 
-    while date <= end:
-        effect_sum = 0
-        for i in range(0, len(carb_starts)):
-            effect_sum += find_partial_effect(i)
+    # the timeline is evaluated on timestamps (see carb_glucose_effect)
+    entry_starts = [
+        timestamp_since_reference_date(carb_start) for carb_start in carb_starts
+        ]
 
-        effect_start_dates.append(date)
-        effect_values.append(effect_sum)
-        date += timedelta(minutes=delta)
+    def find_partial_effect(i, timestamp):
+        time = (timestamp - entry_starts[i]) / MICROSECONDS_PER_SECOND / 60
+        return insulin_sensitivities[i] / carb_ratio_values[i]\
+            * parabolic_absorbed_carbs(
+                carb_quantities[i],
+                time - delay,
+                carb_absorptions[i] or default_absorption_time
+                )
+
+    # an entry has no effect before it's eaten, and once it's absorbed its
+    # effect stays the same
+    effect_values = windowed_sums(
+        [timestamp_since_reference_date(date) for date in effect_start_dates],
+        entry_starts,
+        [
+            timestamp_since_reference_date(carb_starts[i] + timedelta(
+                minutes=delay
+                + (carb_absorptions[i] or default_absorption_time)
+                ))
+            for i in range(0, len(carb_starts))
+        ],
+        find_partial_effect,
+        count_name="carb_effect_evaluations"
+        )
 
     assert len(effect_start_dates) == len(effect_values),\
         "expected output shapes to match"
@@ -876,6 +885,7 @@ def carb_glucose_effect(
         )
 
 
+@instrumentation.traced
 def dynamic_glucose_effects(
         carb_starts, carb_quantities, carb_absorptions,
         absorptions, timelines,
@@ -955,24 +965,23 @@ def dynamic_glucose_effects(
         scaler=scaler
         )
 
-    date = start
-    effect_start_dates = []
-    effect_values = []
+    effect_start_dates = timeline_dates(start, end, delta)
 
-    def find_partial_effect(i):
-        insulin_sensitivity = find_ratio_at_time(
-            sensitivity_starts,
-            sensitivity_ends,
-            sensitivity_values,
-            carb_starts[i]
-            )
-        carb_ratio = find_ratio_at_time(
-            carb_ratio_starts,
-            [],
-            carb_ratios,
-            carb_starts[i]
-            )
-        csf = insulin_sensitivity / carb_ratio
+    # the CSF for each carb entry doesn't depend on the date
+    sensitivity_schedule = compiled_schedule(
+        sensitivity_starts, sensitivity_ends, sensitivity_values
+        )
+    carb_ratio_schedule = compiled_schedule(
+        carb_ratio_starts, [], carb_ratios
+        )
+    carb_sensitivities = [
+        sensitivity_schedule.value_at(carb_start)
+        / carb_ratio_schedule.value_at(carb_start)
+        for carb_start in carb_starts
+        ]
+
+    def find_partial_effect(i, date):
+        csf = carb_sensitivities[i]
         partial_carbs_absorbed = carb_status.dynamic_absorbed_carbs(
             carb_starts[i],
             carb_quantities[i],
@@ -986,14 +995,23 @@ def dynamic_glucose_effects(
 
         return csf * partial_carbs_absorbed
 
-    while date <= end:
-        effect_sum = 0
-        for i in range(0, len(carb_starts)):
-            effect_sum += find_partial_effect(i)
-
-        effect_start_dates.append(date)
-        effect_values.append(effect_sum)
-        date += timedelta(minutes=delta)
+    effect_values = windowed_sums(
+        effect_start_dates,
+        carb_starts,
+        [
+            carb_status.dynamic_absorption_end_date(
+                carb_starts[i],
+                absorptions[i],
+                timelines[i],
+                carb_absorptions[i] or default_absorption_time,
+                delay,
+                delta
+                )
+            for i in range(0, len(carb_starts))
+        ],
+        find_partial_effect,
+        count_name="carb_effect_evaluations"
+        )
 
     assert len(effect_start_dates) == len(effect_values),\
         "expected output shapes to match"
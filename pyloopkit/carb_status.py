@@ -216,3 +216,65 @@ def dynamic_absorbed_carbs(
         sum_,
         absorption_dict[0]
         )
+
+
+def dynamic_absorption_end_date(
+        carb_start,
+        absorption_dict,
+        observed_timeline,
+        carb_absorption_time,
+        delay,
+        delta
+        ):
+    """
+    Find a date after which the carbs dynamic_absorbed_carbs finds for a
+    carb entry don't change
+
+    Arguments:
+    carb_start -- time of carb entry (datetime objects)
+
+    absorption_dict -- list of absorption information
+                       (computed via map_)
+    observed_timeline -- list of carb absorption info at various times
+                         (computed via map_)
+
+    carb_absorption_time -- time carbs will take to absorb (mins)
+
+    delay -- the time to delay the carb effect
+    delta -- the differential between timeline entries
+
+    Output:
+    Datetime the absorbed carbs have stopped changing by; this is a delta
+    later than strictly needed, so rounding at the boundary can't matter
+    """
+    # Absorbed with the parabolic model
+    if not absorption_dict:
+        return carb_start + timedelta(
+            minutes=delay + carb_absorption_time + delta
+            )
+
+    # Absorbed linearly at the minimum absorption rate
+    if observed_timeline and None in observed_timeline[0]:
+        estimated_date_duration = (
+            time_interval_since(
+                absorption_dict[5],
+                absorption_dict[4]
+                ) / 60
+            + absorption_dict[6]
+        )
+        return carb_start + timedelta(
+            minutes=delay + estimated_date_duration + delta
+            )
+
+    # Absorbed linearly after the observed absorption
+    end_date = absorption_dict[5] + timedelta(
+        minutes=absorption_dict[6] + delta
+        )
+    if observed_timeline and observed_timeline[len(observed_timeline) - 1]:
+        end_date = max(
+            end_date,
+            observed_timeline[len(observed_timeline) - 1][1]
+            + timedelta(minutes=delta)
+            )
+
+    return end_date
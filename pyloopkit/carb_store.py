@@ -11,11 +11,13 @@ Github URL: https://github.com/tidepool-org/LoopKit/blob/
 # pylint: disable=R0913, R0914
 from datetime import timedelta
 
+from pyloopkit import instrumentation
 from pyloopkit.carb_math import (filter_date_range_for_carbs, map_, carb_glucose_effects,
                        dynamic_glucose_effects, dynamic_carbs_on_board,
                        carbs_on_board)
 
 
+@instrumentation.traced
 def get_carb_glucose_effects(
         carb_dates, carb_values, absorption_times,
         at_date,
@@ -26,7 +28,8 @@ def get_carb_glucose_effects(
         absorption_time_overrun=1.5,
         delay=10,
         delta=5,
-        end_date=None
+        end_date=None,
+        absorption=None
         ):
     """ Retrieve a timeline of effect on blood glucose from carbohydrates
 
@@ -61,6 +64,9 @@ def get_carb_glucose_effects(
 
     end_date -- date to end calculation of glucose effects
 
+    absorption -- (absorption_results, absorption_timelines) from map_, if
+                  they have already been found for the filtered carbs
+
     Output:
     An array of effects in chronological order
     """
@@ -90,7 +96,7 @@ def get_carb_glucose_effects(
     if effect_starts and effect_starts[0]:
         (absorption_results,
          timelines
-         ) = map_(
+         ) = absorption or map_(
              *filtered_carbs,
              effect_starts, effect_ends, effect_values,
              carb_ratio_starts, carb_ratios,
@@ -131,6 +137,7 @@ def get_carb_glucose_effects(
     return effects
 
 
+@instrumentation.traced
 def get_carbs_on_board(
         carb_dates, carb_values, absorption_times,
         at_date,
@@ -141,7 +148,8 @@ def get_carbs_on_board(
         absorption_time_overrun=1.5,
         delay=10,
         delta=5,
-        end_date=None
+        end_date=None,
+        absorption=None
         ):
     """ Retrieves the COB at a time, or a timeline of COB
 
@@ -176,6 +184,9 @@ def get_carbs_on_board(
 
     end_date -- date to end calculation of COB
 
+    absorption -- (absorption_results, absorption_timelines) from map_, if
+                  they have already been found for the filtered carbs
+
     Output:
     COB timeline
     """
@@ -211,7 +222,7 @@ def get_carbs_on_board(
        ):
         (absorption_results,
          timelines
-         ) = map_(
+         ) = absorption or map_(
              *filtered_carbs,
              effect_starts, effect_ends, effect_values,
              carb_ratio_starts, carb_ratios,
@@ -244,3 +255,131 @@ def get_carbs_on_board(
             )
 
     return cob_data
+
+
+@instrumentation.traced
+def get_carb_glucose_effects_and_carbs_on_board(
+        carb_dates, carb_values, absorption_times,
+        effect_date,
+        cob_date,
+        effect_starts, effect_ends, effect_values,
+        carb_ratio_starts, carb_ratios,
+        sensitivity_starts, sensitivity_ends, sensitivity_values,
+        default_absorption_times,
+        absorption_time_overrun=1.5,
+        delay=10,
+        delta=5,
+        end_date=None
+        ):
+    """ Retrieve a timeline of effect on blood glucose from carbohydrates
+        and a timeline of COB, mapping the observed carb absorption only once
+
+        The results match get_carb_glucose_effects and get_carbs_on_board.
+        The absorption of each carb entry depends on the entries eaten before
+        it, so it is only shared when both timelines use the same entries
+        (which they do unless an entry was eaten between the earliest dates
+        either one fetches carbs from).
+
+    Arguments:
+    carb_dates -- list of times of carb entry (datetime objects)
+    carb_values -- list of grams of carbs eaten
+    absorption_times -- list of lengths of absorption times (mins)
+
+    effect_date -- the time to calculate the effect at (datetime object)
+    cob_date -- the time to calculate the COB at (datetime object)
+
+    effect_starts -- list of start times of carb effect (datetime objects)
+    effect_ends -- list of end times of carb effect (datetime objects)
+    effect_values -- list of glucose velocities (mg/dL)
+
+    carb_ratio_starts -- list of start times of carb ratios (time objects)
+    carb_ratios -- list of carb ratios (g/U)
+
+    sensitivity_starts -- list of time objects of start times of
+                          given insulin sensitivity values
+    sensitivity_ends -- list of time objects of start times of
+                        given insulin sensitivity values
+    sensitivity_values -- list of sensitivities (mg/dL/U)
+
+    default_absorption_times -- list absorption times to use for unspecified
+                               carb entries in format [fast, medium, slow]
+
+    absorption_time_overrun -- multiplier to determine absorption time
+                               from the specified absorption time
+
+    delay -- the time to delay the carb effect and COB
+    delta -- time interval between glucose values
+
+    end_date -- date to end calculation of glucose effects and COB
+
+    Output:
+    Tuple in format ((effect_dates, effect_values), (cob_dates, cob_values))
+    """
+    assert len(carb_dates) == len(carb_values) == len(absorption_times),\
+        "expected input shapes to match"
+
+    assert len(effect_starts) == len(effect_ends) == len(effect_values),\
+        "expected input shapes to match"
+
+    if not carb_dates:
+        return (([], []), ([], []))
+
+    maximum_absorption_time_interval = default_absorption_times[2] * 2
+
+    # these are the carbs get_carb_glucose_effects and get_carbs_on_board
+    # fetch
+    (effect_carbs,
+     cob_carbs
+     ) = [
+         filter_date_range_for_carbs(
+             carb_dates, carb_values, absorption_times,
+             food_start - timedelta(minutes=maximum_absorption_time_interval),
+             end_date
+             )
+         for food_start in [effect_date, cob_date - timedelta(minutes=delta)]
+     ]
+
+    absorption = None
+    if (effect_starts and effect_starts[0]
+            and effect_carbs == cob_carbs
+       ):
+        absorption = map_(
+            *effect_carbs,
+            effect_starts, effect_ends, effect_values,
+            carb_ratio_starts, carb_ratios,
+            sensitivity_starts, sensitivity_ends, sensitivity_values,
+            absorption_time_overrun,
+            default_absorption_times[1],
+            delay,
+            delta
+            )[0:2]
+
+    effects = get_carb_glucose_effects(
+        carb_dates, carb_values, absorption_times,
+        effect_date,
+        effect_starts, effect_ends, effect_values,
+        carb_ratio_starts, carb_ratios,
+        sensitivity_starts, sensitivity_ends, sensitivity_values,
+        default_absorption_times,
+        absorption_time_overrun=absorption_time_overrun,
+        delay=delay,
+        delta=delta,
+        end_date=end_date,
+        absorption=absorption
+        )
+
+    cob_data = get_carbs_on_board(
+        carb_dates, carb_values, absorption_times,
+        cob_date,
+        effect_starts, effect_ends, effect_values,
+        carb_ratio_starts, carb_ratios,
+        sensitivity_starts, sensitivity_ends, sensitivity_values,
+        default_absorption_times,
+        absorption_time_overrun=absorption_time_overrun,
+        delay=delay,
+        delta=delta,
+        end_date=end_date,
+        absorption=absorption
+        )
+
+    return (effects, cob_data)
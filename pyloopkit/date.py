@@ -9,13 +9,15 @@ Github URL: https://github.com/tidepool-org/LoopKit/blob/
 57a9f2ba65ae3765ef7baafe66b883e654e08391/LoopKit/Extensions/Date.swift
 """
 import datetime
-import math
+import numpy
 
 REF_TIME = datetime.datetime.fromisoformat("2001-01-01T00:00:00")
 TIMEZONE_REF_TIME = datetime.datetime.strptime(
     "2001-01-01 00:00:00 +0000",
     "%Y-%m-%d %H:%M:%S %z"
     )
+MICROSECONDS_PER_SECOND = 1000000
+ONE_MICROSECOND = datetime.timedelta(microseconds=1)
 
 
 def time_interval_since_reference_date(actual_time):
@@ -62,13 +64,16 @@ def date_floored_to_time_interval(time_, interval):
     if interval == 0:
         return time_
 
-    floored_delta = (math.floor(time_interval_since_reference_date(time_) /
-                                interval / 60) * interval * 60)
+    interval_microseconds = interval * 60 * MICROSECONDS_PER_SECOND
+    floored_delta = datetime.timedelta(microseconds=(
+        abs(timestamp_since_reference_date(time_)) // interval_microseconds
+        * interval_microseconds
+    ))
 
     if time_.tzinfo:
-        return TIMEZONE_REF_TIME + datetime.timedelta(seconds=floored_delta)
+        return TIMEZONE_REF_TIME + floored_delta
 
-    return REF_TIME + datetime.timedelta(seconds=floored_delta)
+    return REF_TIME + floored_delta
 
 
 def date_ceiled_to_time_interval(time, interval):
@@ -87,10 +92,99 @@ def date_ceiled_to_time_interval(time, interval):
     if interval == 0:
         return time
 
-    ceiled_delta = (math.ceil(time_interval_since_reference_date(time) /
-                              interval / 60) * interval * 60)
+    interval_microseconds = interval * 60 * MICROSECONDS_PER_SECOND
+    ceiled_delta = datetime.timedelta(microseconds=(
+        -(-abs(timestamp_since_reference_date(time)) // interval_microseconds)
+        * interval_microseconds
+    ))
 
     if time.tzinfo:
-        return TIMEZONE_REF_TIME + datetime.timedelta(seconds=ceiled_delta)
+        return TIMEZONE_REF_TIME + ceiled_delta
 
-    return REF_TIME + datetime.timedelta(seconds=ceiled_delta)
+    return REF_TIME + ceiled_delta
+
+
+def timestamp_since_reference_date(actual_time):
+    """ Convert a datetime to whole microseconds since January, 1st, 2001 @
+        12:00 AM (in UTC, if the datetime has a timezone)
+
+        Timestamps are plain ints, so date math in loops can be done on them
+        instead of datetimes; the seconds between two timestamps,
+        (timestamp_1 - timestamp_2) / MICROSECONDS_PER_SECOND, are exactly
+        what time_interval_since gives for the datetimes.
+
+    Arguments:
+    actual_time -- datetime object to convert
+
+    Output:
+    Microseconds since Jan 1st, 2001 @ 12:00 AM (with a sign)
+    """
+    if actual_time.tzinfo:
+        return (actual_time - TIMEZONE_REF_TIME) // ONE_MICROSECOND
+
+    return (actual_time - REF_TIME) // ONE_MICROSECOND
+
+
+def timestamps_since_reference_date(dates):
+    """ Convert a list of datetimes to a NumPy array of timestamps
+        (see timestamp_since_reference_date)
+
+    Arguments:
+    dates -- list of datetime objects to convert
+
+    Output:
+    int64 numpy array of microseconds since Jan 1st, 2001 @ 12:00 AM
+    """
+    return numpy.array(
+        [timestamp_since_reference_date(date) for date in dates],
+        dtype=numpy.int64
+    )
+
+
+def timeline_dates(start, end, delta):
+    """ Create the dates of a timeline, from start to end (inclusive) in steps
+        of delta
+
+        The number of dates is found from the timestamps of start and end,
+        rather than by stepping a datetime forward until it passes end.
+
+    Arguments:
+    start -- datetime of the first date
+    end -- datetime the timeline can't go past
+    delta -- the differential between timeline entries (minutes)
+
+    Output:
+    List of datetime objects
+    """
+    step = datetime.timedelta(minutes=delta)
+    if end < start:
+        return []
+
+    count = (end - start) // step + 1
+    return [start + step * i for i in range(0, count)]
+
+
+def date_from_timestamp(timestamp, tzinfo=None):
+    """ Convert a timestamp (see timestamp_since_reference_date) back to a
+        datetime
+
+    Arguments:
+    timestamp -- microseconds since Jan 1st, 2001 @ 12:00 AM
+    tzinfo -- timezone to give the datetime, or None for a naive datetime
+
+    Output:
+    datetime object
+    """
+    delta = datetime.timedelta(microseconds=int(timestamp))
+
+    if tzinfo:
+        return (TIMEZONE_REF_TIME + delta).astimezone(tzinfo)
+
+    return REF_TIME + delta
+
+
+def dates_from_timestamps(timestamps, tzinfo=None):
+    """ Convert timestamps back to a list of datetimes
+        (see date_from_timestamp)
+    """
+    return [date_from_timestamp(timestamp, tzinfo) for timestamp in timestamps]
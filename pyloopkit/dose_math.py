@@ -13,11 +13,17 @@ from datetime import timedelta
 from enum import Enum
 import sys
 
+from pyloopkit import instrumentation
 from pyloopkit.insulin_math import is_time_between, find_ratio_at_time
 from pyloopkit.date import time_interval_since
 from pyloopkit.dose import DoseType
-from pyloopkit.walsh_insulin_model import walsh_percent_effect_remaining
-from pyloopkit.exponential_insulin_model import percent_effect_remaining
+from pyloopkit.insulin_model import tabulated_insulin_model
+from pyloopkit.schedule import compiled_schedule
+
+
+# the default correction of the recommendation functions, which tells them
+# to find it (None is a correction insulin_correction can return)
+_UNSET = object()
 
 
 class Correction(Enum):
@@ -252,26 +258,27 @@ def insulin_correction(
      min_correction_units
      ) = ([], None, None, None)
 
+    # predictions are on a 5 minute grid, and corrections are modeled as
+    # being delivered without a delay
+    model = tabulated_insulin_model(model, 0, 5)
+
     # only calculate a correction if the prediction is between
     # "now" and now + DIA
-    if len(model) == 1:  # if Walsh model
-        date_range = [at_date,
-                      at_date + timedelta(hours=model[0])
-                      ]
-    else:
-        date_range = [at_date,
-                      at_date + timedelta(minutes=model[0])
-                      ]
+    date_range = [at_date,
+                  at_date + timedelta(minutes=model.effect_duration)
+                  ]
+
+    target_min_schedule = compiled_schedule(
+        target_starts, target_ends, target_mins
+        )
+    target_max_schedule = compiled_schedule(
+        target_starts, target_ends, target_maxes
+        )
 
     # if we don't know the suspend threshold, it defaults to the lower
     # bound of the correction range at the time the "loop" is being run at
     if not suspend_threshold_value:
-        suspend_threshold_value = find_ratio_at_time(
-            target_starts,
-            target_ends,
-            target_mins,
-            at_date
-            )
+        suspend_threshold_value = target_min_schedule.value_at(at_date)
 
     # For each prediction above target, determine the amount of insulin
     # necessary to correct glucose based on the modeled effectiveness of
@@ -301,44 +308,19 @@ def insulin_correction(
             ) / 60
 
         average_target = (
-            find_ratio_at_time(
-                target_starts,
-                target_ends,
-                target_maxes,
-                prediction_dates[i]
-                ) +
-            find_ratio_at_time(
-                target_starts,
-                target_ends,
-                target_mins,
-                prediction_dates[i]
-                )
+            target_max_schedule.value_at(prediction_dates[i]) +
+            target_min_schedule.value_at(prediction_dates[i])
             ) / 2
         # Compute the target value as a function of time since the dose started
         target_value = target_glucose_value(
-            (time /
-             (
-                 (60 * model[0]) if len(model) == 1
-                 else model[0]
-             )
-            ),
+            time / model.effect_duration,
             suspend_threshold_value,
             average_target
         )
 
         # Compute the dose required to bring this prediction to target:
         # dose = (Glucose delta) / (% effect × sensitivity)
-        if len(model) == 1:  # if Walsh model
-            percent_effected = 1 - walsh_percent_effect_remaining(
-                time,
-                model[0]
-            )
-        else:
-            percent_effected = 1 - percent_effect_remaining(
-                time,
-                model[0],
-                model[1]
-            )
+        percent_effected = 1 - model.percent_effect_remaining(time)
         effected_sensitivity = percent_effected * sensitivity_value
 
         # calculate the Units needed to correct that predicted glucose value
@@ -364,32 +346,12 @@ def insulin_correction(
 
     # Choose either the minimum glucose or eventual glucose as correction delta
     min_glucose_targets = [
-        find_ratio_at_time(
-            target_starts,
-            target_ends,
-            target_mins,
-            min_glucose[0]
-        ),
-        find_ratio_at_time(
-            target_starts,
-            target_ends,
-            target_maxes,
-            min_glucose[0]
-        )
+        target_min_schedule.value_at(min_glucose[0]),
+        target_max_schedule.value_at(min_glucose[0])
     ]
     eventual_glucose_targets = [
-        find_ratio_at_time(
-            target_starts,
-            target_ends,
-            target_mins,
-            eventual_glucose[0]
-            ),
-        find_ratio_at_time(
-            target_starts,
-            target_ends,
-            target_maxes,
-            eventual_glucose[0]
-        )
+        target_min_schedule.value_at(eventual_glucose[0]),
+        target_max_schedule.value_at(eventual_glucose[0])
     ]
 
     # Treat the mininum glucose when both are below range
@@ -400,16 +362,10 @@ def insulin_correction(
         # For time = 0, assume a small amount effected.
         # This will result in large (negative) unit recommendation
         # rather than no recommendation at all.
-        if len(model) == 1:
-            percent_effected = max(
-                sys.float_info.epsilon,
-                1 - walsh_percent_effect_remaining(time, model[0])
-                )
-        else:
-            percent_effected = max(
-                sys.float_info.epsilon,
-                1 - percent_effect_remaining(time, model[0], model[1])
-                )
+        percent_effected = max(
+            sys.float_info.epsilon,
+            1 - model.percent_effect_remaining(time)
+            )
 
         units = insulin_correction_units(
             min_glucose[1],
@@ -552,7 +508,8 @@ def recommended_temp_basal(
         last_temp_basal,
         duration=30,
         continuation_interval=11,
-        rate_rounder=None
+        rate_rounder=None,
+        correction=_UNSET
         ):
     """ Recommends a temporary basal rate to conform a glucose prediction
     timeline to a correction range
@@ -593,6 +550,8 @@ def recommended_temp_basal(
                              should be continued with a new command (mins)
     rate_rounder -- the smallest fraction of a unit supported in basal
                     delivery; if None, no rounding is performed
+    correction -- the result of insulin_correction for the prediction
+                  (which can be None), if it has already been found
 
     Output:
     The recommended temporary basal in the format [rate, duration]
@@ -616,19 +575,15 @@ def recommended_temp_basal(
        ):
         return None
 
-    sensitivity_value = find_ratio_at_time(
-        sensitivity_starts, sensitivity_ends, sensitivity_values,
-        at_date
-        )
-
-    correction = insulin_correction(
-        glucose_dates, glucose_values,
-        target_starts, target_ends, target_mins, target_maxes,
-        at_date,
-        suspend_threshold,
-        sensitivity_value,
-        model
-        )
+    if correction is _UNSET:
+        correction = prediction_insulin_correction(
+            glucose_dates, glucose_values,
+            target_starts, target_ends, target_mins, target_maxes,
+            at_date,
+            suspend_threshold,
+            sensitivity_starts, sensitivity_ends, sensitivity_values,
+            model
+            )
 
     scheduled_basal_rate = find_ratio_at_time(
         basal_starts, [], basal_rates,
@@ -671,7 +626,8 @@ def recommended_bolus(
         model,
         pending_insulin,
         max_bolus,
-        volume_rounder=None
+        volume_rounder=None,
+        correction=_UNSET
         ):
     """ Recommends a temporary basal rate to conform a glucose prediction
     timeline to a correction range
@@ -705,6 +661,8 @@ def recommended_bolus(
     max_bolus -- the maximum allowable bolus value in Units
     volume_rounder -- the smallest fraction of a unit supported in insulin
                       delivery; if None, no rounding is performed
+    correction -- the result of insulin_correction for the prediction
+                  (which can be None), if it has already been found
 
     Output:
     A bolus recommendation
@@ -724,12 +682,70 @@ def recommended_bolus(
        ):
         return [0, 0, None]
 
+    if correction is _UNSET:
+        correction = prediction_insulin_correction(
+            glucose_dates, glucose_values,
+            target_starts, target_ends, target_mins, target_maxes,
+            at_date,
+            suspend_threshold,
+            sensitivity_starts, sensitivity_ends, sensitivity_values,
+            model
+            )
+
+    bolus = as_bolus(
+        correction,
+        pending_insulin,
+        max_bolus,
+        volume_rounder
+        )
+
+    if bolus[0] < 0:
+        bolus = 0
+
+    return bolus
+
+
+def prediction_insulin_correction(
+        glucose_dates, glucose_values,
+        target_starts, target_ends, target_mins, target_maxes,
+        at_date,
+        suspend_threshold,
+        sensitivity_starts, sensitivity_ends, sensitivity_values,
+        model
+        ):
+    """ Finds the insulin correction for a glucose prediction, using the
+        insulin sensitivity at at_date
+
+    Arguments:
+    glucose_dates -- dates of glucose values (datetime)
+    glucose_values -- glucose values (in mg/dL)
+
+    target_starts -- start times for given target ranges (datetime)
+    target_ends -- stop times for given target ranges (datetime)
+    target_mins -- the lower bounds of target ranges (mg/dL)
+    target_maxes -- the upper bounds of target ranges (mg/dL)
+
+    at_date -- date to calculate the correction at
+    suspend_threshold -- value to suspend all insulin delivery at (mg/dL)
+
+    sensitivity_starts -- list of time objects of start times of
+                          given insulin sensitivity values
+    sensitivity_ends -- list of time objects of start times of
+                        given insulin sensitivity values
+    sensitivity_values -- list of sensitivities (mg/dL/U)
+
+    model -- list of insulin model parameters in format [DIA, peak_time] if
+             exponential model, or [DIA] if Walsh model
+
+    Output:
+    The insulin correction (see insulin_correction)
+    """
     sensitivity_value = find_ratio_at_time(
         sensitivity_starts, sensitivity_ends, sensitivity_values,
         at_date
         )
 
-    correction = insulin_correction(
+    return insulin_correction(
         glucose_dates, glucose_values,
         target_starts, target_ends, target_mins, target_maxes,
         at_date,
@@ -738,14 +754,123 @@ def recommended_bolus(
         model
         )
 
-    bolus = as_bolus(
-        correction,
+
+@instrumentation.traced
+def recommended_temp_basal_and_bolus(
+        glucose_dates, glucose_values,
+        target_starts, target_ends, target_mins, target_maxes,
+        at_date,
+        suspend_threshold,
+        sensitivity_starts, sensitivity_ends, sensitivity_values,
+        model,
+        basal_starts, basal_rates, basal_minutes,
+        max_basal_rate,
+        last_temp_basal,
         pending_insulin,
         max_bolus,
-        volume_rounder
+        duration=30,
+        continuation_interval=11,
+        rate_rounder=None,
+        volume_rounder=None
+        ):
+    """ Recommends a temporary basal rate and a bolus to conform a glucose
+    prediction timeline to a correction range, finding the insulin correction
+    for the prediction only once
+
+    Arguments:
+    glucose_dates -- dates of glucose values (datetime)
+    glucose_values -- glucose values (in mg/dL)
+
+    target_starts -- start times for given target ranges (datetime)
+    target_ends -- stop times for given target ranges (datetime)
+    target_mins -- the lower bounds of target ranges (mg/dL)
+    target_maxes -- the upper bounds of target ranges (mg/dL)
+
+    at_date -- date to calculate the recommendations at
+    suspend_threshold -- value to suspend all insulin delivery at (mg/dL)
+
+    sensitivity_starts -- list of time objects of start times of
+                          given insulin sensitivity values
+    sensitivity_ends -- list of time objects of start times of
+                        given insulin sensitivity values
+    sensitivity_values -- list of sensitivities (mg/dL/U)
+
+    model -- list of insulin model parameters in format [DIA, peak_time] if
+             exponential model, or [DIA] if Walsh model
+
+    basal_starts -- list of times the basal rates start at
+    basal_rates -- list of basal rates(U/hr)
+    basal_minutes -- list of basal lengths (in mins)
+
+    max_basal_rate -- max basal rate that Loop can give (U/hr)
+    last_temp_basal -- list of last temporary basal information in format
+                       [type, start time, end time, basal rate]
+
+    pending_insulin -- number of units expected to be delivered, but not yet
+                       reflected in the correction
+    max_bolus -- the maximum allowable bolus value in Units
+
+    duration -- length of the temp basal (mins)
+    continuation_interval -- length of time before an ongoing temp basal
+                             should be continued with a new command (mins)
+    rate_rounder -- the smallest fraction of a unit supported in basal
+                    delivery; if None, no rounding is performed
+    volume_rounder -- the smallest fraction of a unit supported in insulin
+                      delivery; if None, no rounding is performed
+
+    Output:
+    Tuple in format (recommended temp basal (see recommended_temp_basal),
+                     recommended bolus (see recommended_bolus),
+                     insulin correction (see insulin_correction), or None if
+                     there wasn't enough data to find it)
+    """
+    assert len(glucose_dates) == len(glucose_values),\
+        "expected input shapes to match"
+
+    assert len(target_starts) == len(target_ends) == len(target_mins)\
+        == len(target_maxes), "expected input shapes to match"
+
+    assert len(sensitivity_starts) == len(sensitivity_ends)\
+        == len(sensitivity_values), "expected input shapes to match"
+
+    correction = None
+    if glucose_dates and target_starts and sensitivity_starts:
+        correction = prediction_insulin_correction(
+            glucose_dates, glucose_values,
+            target_starts, target_ends, target_mins, target_maxes,
+            at_date,
+            suspend_threshold,
+            sensitivity_starts, sensitivity_ends, sensitivity_values,
+            model
+            )
+
+    temp_basal = recommended_temp_basal(
+        glucose_dates, glucose_values,
+        target_starts, target_ends, target_mins, target_maxes,
+        at_date,
+        suspend_threshold,
+        sensitivity_starts, sensitivity_ends, sensitivity_values,
+        model,
+        basal_starts, basal_rates, basal_minutes,
+        max_basal_rate,
+        last_temp_basal,
+        duration,
+        continuation_interval,
+        rate_rounder,
+        correction=correction
         )
 
-    if bolus[0] < 0:
-        bolus = 0
+    bolus = recommended_bolus(
+        glucose_dates, glucose_values,
+        target_starts, target_ends, target_mins, target_maxes,
+        at_date,
+        suspend_threshold,
+        sensitivity_starts, sensitivity_ends, sensitivity_values,
+        model,
+        pending_insulin,
+        max_bolus,
+        volume_rounder,
+        correction=correction
+        )
 
-    return bolus
+    return (temp_basal, bolus, correction)
@@ -11,11 +11,15 @@ Github URL: https://github.com/tidepool-org/LoopKit/blob/
 # pylint: disable=R0913, R0914, C0200
 from datetime import timedelta
 
+from pyloopkit import instrumentation
 from pyloopkit.dose_math import filter_date_range_for_doses
-from pyloopkit.insulin_math import (annotated, trim, glucose_effects, reconciled)
+from pyloopkit.insulin_math import (annotated, trim, glucose_effects,
+                                    reconciled)
+from pyloopkit.insulin_model import compile_insulin_model
 from pyloopkit.loop_math import filter_date_range, sort_dose_lists
 
 
+@instrumentation.traced
 def get_glucose_effects(
         types, starts, ends, values,
         start_date,
@@ -23,7 +27,9 @@ def get_glucose_effects(
         sensitivity_starts, sensitivity_ends, sensitivity_values,
         insulin_model,
         delay=10,
-        end_date=None
+        end_date=None,
+        engine="iterative",
+        history_start=None
         ):
     """ Get the glucose effects at a particular time, given a list of
     doses and a time interval
@@ -52,26 +58,101 @@ def get_glucose_effects(
 
     end_date -- date to stop calculating glucose effects
 
+    engine -- the glucose_effects engine to use ("iterative", "vectorized"
+              or "convolution")
+    history_start -- the date to prepare the doses from, if it's earlier
+                     than start_date; the effects then match the ones from
+                     history_start on (at the dates from start_date on)
+
     Output:
     Glucose effects in the format (effect_date, effect_value)
     """
     assert len(types) == len(starts) == len(ends) == len(values),\
         "expected input shapes to match"
 
+    insulin_model = compile_insulin_model(insulin_model)
+
+    (a_types,
+     a_starts,
+     a_ends,
+     a_values,
+     a_scheduled_rates
+     ) = get_prepared_doses(
+         types, starts, ends, values,
+         min(start_date, history_start or start_date),
+         basal_starts, basal_rates, basal_minutes,
+         insulin_model,
+         end_date=end_date
+         )
+
+    # get the glucose effects using the prepared dose data
+    glucose_effect = glucose_effects(
+        a_types, a_starts, a_ends, a_values, a_scheduled_rates,
+        insulin_model,
+        sensitivity_starts, sensitivity_ends, sensitivity_values,
+        delay=delay,
+        start=start_date,
+        end=end_date,
+        engine=engine
+        )
+
+    # don't return effects that are less than the start date or greater than
+    # the end date (if there is one)
+    (filtered_starts,
+     ends,
+     filtered_effect_values) = filter_date_range(
+         glucose_effect[0],
+         [],
+         glucose_effect[1],
+         start_date,
+         end_date
+         )
+
+    return (filtered_starts, filtered_effect_values)
+
+
+@instrumentation.traced
+def get_prepared_doses(
+        types, starts, ends, values,
+        start_date,
+        basal_starts, basal_rates, basal_minutes,
+        insulin_model,
+        end_date=None
+        ):
+    """ Filter, reconcile, sort and annotate doses, and trim them to start
+        no earlier than one insulin duration before start_date, so they are
+        ready to calculate glucose effects from start_date on
+
+    Arguments:
+    types -- list of types of dose (basal, bolus, etc)
+    starts -- start dates of the doses (datetime obj)
+    ends -- end dates of the doses (datetime obj)
+    values -- actual basal rates of doses in U/hr (if a basal)
+             or the value of the boluses if in U
+
+    start_date -- date effects will be calculated from
+
+    basal_starts -- list of times the basal rates start at
+    basal_rates -- list of basal rates(U/hr)
+    basal_minutes -- list of basal lengths (in mins)
+
+    insulin_model -- list in format [DIA (in hours)] if Walsh model, or
+                     [DIA (minutes), peak (minutes)] if exponential model
+
+    end_date -- date to stop calculating glucose effects
+
+    Output:
+    Prepared doses in format (types, starts, ends, values,
+                              scheduled_basal_rates)
+    """
     # to properly know glucose effects at start_date,
     # we need to go back another DIA hours
-    if len(insulin_model) == 1:  # if using Walsh model
-        dose_start = (start_date
-                      - timedelta(
-                          hours=insulin_model[0]
-                          )
-                      )
-    else:
-        dose_start = (start_date
-                      - timedelta(
-                          minutes=insulin_model[0]
-                          )
+    insulin_model = compile_insulin_model(insulin_model)
+    dose_start = (start_date
+                  - timedelta(
+                      minutes=insulin_model.effect_duration
                       )
+                  )
 
     filtered_doses = filter_date_range_for_doses(
         types, starts, ends, values,
@@ -87,6 +168,7 @@ def get_glucose_effects(
     # sort the lists because they could be slightly out of order due to
     # basals and suspends
     sorted_reconciled_doses = sort_dose_lists(*reconciled_doses)[0:4]
+    instrumentation.count("reconciled_doses", len(sorted_reconciled_doses[0]))
 
     # annotate the doses with scheduled basal rate
     (a_types,
@@ -111,26 +193,4 @@ def get_glucose_effects(
         a_starts[i] = result[1]
         a_ends[i] = result[2]
 
-    # get the glucose effects using the prepared dose data
-    glucose_effect = glucose_effects(
-        a_types, a_starts, a_ends, a_values, a_scheduled_rates,
-        insulin_model,
-        sensitivity_starts, sensitivity_ends, sensitivity_values,
-        delay=delay,
-        start=start_date,
-        end=end_date
-        )
-
-    # don't return effects that are less than the start date or greater than
-    # the end date (if there is one)
-    (filtered_starts,
-     ends,
-     filtered_effect_values) = filter_date_range(
-         glucose_effect[0],
-         [],
-         glucose_effect[1],
-         start_date,
-         end_date
-         )
-
-    return (filtered_starts, filtered_effect_values)
+    return (a_types, a_starts, a_ends, a_values, a_scheduled_rates)
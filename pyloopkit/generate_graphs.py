@@ -4,15 +4,30 @@
 Created on Fri Jun 21 13:11:40 2019
 
 @author: annaquinlan, plot style from Ed Nykaza
+
+matplotlib is imported by the plotting functions when they're called, so this
+module can be imported (for correction_ranges_between, or to set up a batch
+of graphs) without it.
 """
-from collections import OrderedDict
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta, datetime
-import matplotlib.pyplot as plt
-from matplotlib import collections as mc
+import os
 
 from pyloopkit.date import time_interval_since
 from pyloopkit.insulin_math import schedule_offset
 
+FONT = {
+    'family': 'DejaVu Sans',
+    'weight': 'bold',
+    'size': 15
+}
+FIGURE_SIZE_INCHES = (15, 7)
+
+# the figure each process draws its batch of graphs on (see
+# render_loop_inspired_glucose_graphs)
+_batch_figure = None
+
 
 def plot_graph(
         dates, values,
@@ -51,15 +66,11 @@ def plot_graph(
             hours += 24
         relative_dates.append(hours)
 
-    font = {
-        'family': 'DejaVu Sans',
-        'weight': 'bold',
-        'size': 15
-    }
-    plt.rc('font', **font)
+    import matplotlib.pyplot as plt
+
+    plt.rc('font', **FONT)
 
-    figure_size_inches = (15, 7)
-    fig, ax = plt.subplots(figsize=figure_size_inches)
+    fig, ax = plt.subplots(figsize=FIGURE_SIZE_INCHES)
 
     coord_color = "#c0c0c0"
     ax.spines['bottom'].set_color(coord_color)
@@ -144,15 +155,11 @@ def plot_relative_graph(
             time_interval_since(date, dates[0]) / 3600
         )
 
-    font = {
-        'family': 'DejaVu Sans',
-        'weight': 'bold',
-        'size': 15
-    }
-    plt.rc('font', **font)
+    import matplotlib.pyplot as plt
+
+    plt.rc('font', **FONT)
 
-    figure_size_inches = (15, 7)
-    fig, ax = plt.subplots(figsize=figure_size_inches)
+    fig, ax = plt.subplots(figsize=FIGURE_SIZE_INCHES)
 
     coord_color = "#c0c0c0"
     ax.spines['bottom'].set_color(coord_color)
@@ -232,15 +239,11 @@ def plot_multiple_relative_graphs(
     """
     assert len(dates) == len(values)
 
-    font = {
-        'family': 'DejaVu Sans',
-        'weight': 'bold',
-        'size': 15
-    }
-    plt.rc('font', **font)
+    import matplotlib.pyplot as plt
 
-    figure_size_inches = (15, 7)
-    fig, ax = plt.subplots(figsize=figure_size_inches)
+    plt.rc('font', **FONT)
+
+    fig, ax = plt.subplots(figsize=FIGURE_SIZE_INCHES)
 
     coord_color = "#c0c0c0"
     ax.spines['bottom'].set_color(coord_color)
@@ -339,6 +342,63 @@ def plot_loop_inspired_glucose_graph(
         correction_range_mins -- the lower bounds of target ranges (mg/dL)
         correction_range_maxes -- the upper bounds of target ranges (mg/dL)
     """
+    import matplotlib.pyplot as plt
+
+    plt.rc('font', **FONT)
+    fig, ax = plt.subplots(figsize=FIGURE_SIZE_INCHES)
+
+    draw_loop_inspired_glucose_graph(
+        ax,
+        overall_dates, overall_values,
+        momentum_dates, momentum_values,
+        insulin_dates, insulin_values,
+        carb_dates, carb_values,
+        retrospective_dates, retrospective_values,
+        previous_glucose_dates, previous_glucose_values,
+        x_label, y_label, title,
+        line_color, grid,
+        line_style, target_min, target_max,
+        correction_range_starts, correction_range_ends,
+        correction_range_mins, correction_range_maxes
+    )
+
+    # save the output graph
+    if file_name:
+        fig.savefig(file_name + ".png")
+
+    # display the eventual BG
+    ax.text(
+        max(ax.get_xlim()),
+        max(ax.get_ylim()) + 4,
+        "Eventually %d mg/dL" % overall_values[-1],
+        horizontalalignment="right",
+        size=15,
+        color="#a6a5a2"
+    )
+
+    plt.show()
+
+
+def draw_loop_inspired_glucose_graph(
+        ax,
+        overall_dates, overall_values,
+        momentum_dates=None, momentum_values=None,
+        insulin_dates=None, insulin_values=None,
+        carb_dates=None, carb_values=None,
+        retrospective_dates=None, retrospective_values=None,
+        previous_glucose_dates=None, previous_glucose_values=None,
+        x_label=None, y_label=None, title=None,
+        line_color=None, grid=False,
+        line_style="-", target_min=None, target_max=None,
+        correction_range_starts=None, correction_range_ends=None,
+        correction_range_mins=None, correction_range_maxes=None):
+    """ Draw a Loop-inspired prediction line graph on a matplotlib Axes,
+        without the eventual BG (see plot_loop_inspired_glucose_graph for
+        the other arguments)
+
+    ax -- the Axes to draw on
+    """
+    from matplotlib.collections import LineCollection
 
     def plot_line(
             absolute_dates, values,
@@ -362,16 +422,6 @@ def plot_loop_inspired_glucose_graph(
             ls=style, lw=thickness, label=label
         )
 
-    font = {
-        'family': 'DejaVu Sans',
-        'weight': 'bold',
-        'size': 15
-    }
-    plt.rc('font', **font)
-
-    figure_size_inches = (15, 7)
-    fig, ax = plt.subplots(figsize=figure_size_inches)
-
     coord_color = "#c0c0c0"
     ax.spines['bottom'].set_color(coord_color)
     ax.spines['top'].set_color(coord_color)
@@ -401,7 +451,8 @@ def plot_loop_inspired_glucose_graph(
             if x_ticks[i-1] > x_ticks[i]:
                 x_ticks[i] = x_ticks[i] + 24
 
-    plt.xticks(x_ticks, labels)
+    ax.set_xticks(x_ticks)
+    ax.set_xticklabels(labels)
 
     # if there is a specified target range, it's assumed it will be for the
     # whole duration of the graph
@@ -421,14 +472,14 @@ def plot_loop_inspired_glucose_graph(
                 facecolor='#B5E7FF',
                 lw=0
             )
-            plt.plot(
+            ax.plot(
                 [], [],
                 color='#B5E7FF',
                 lw=10,
                 label="Target Range: %d-%d" % (target_min, target_max)
             )
         else:
-            plt.axhline(
+            ax.axhline(
                 y=target_min,
                 color='#B5E7FF',
                 lw=3,
@@ -480,7 +531,7 @@ def plot_loop_inspired_glucose_graph(
                     facecolor='#B5E7FF',
                     lw=0
                 )
-                plt.plot(
+                ax.plot(
                     [], [],
                     color='#B5E7FF',
                     lw=10,
@@ -493,7 +544,7 @@ def plot_loop_inspired_glucose_graph(
                         (fill_length[1], range_mins[i])
                     ]
                 ]
-                lc = mc.LineCollection(line, colors='#B5E7FF', linewidths=3)
+                lc = LineCollection(line, colors='#B5E7FF', linewidths=3)
                 ax.add_collection(lc)
 
     # set labels and title
@@ -502,7 +553,7 @@ def plot_loop_inspired_glucose_graph(
     if y_label:
         ax.set_ylabel(y_label)
     if title:
-        plt.title(title, loc="left", fontweight='bold')
+        ax.set_title(title, loc="left", fontweight='bold')
 
     scatter_dates = []
     line_dates = []
@@ -572,28 +623,138 @@ def plot_loop_inspired_glucose_graph(
         )
 
     # add a legend
-    leg = plt.legend(numpoints=1)
+    leg = ax.legend(numpoints=1)
     for text in leg.get_texts():
         text.set_color('#606060')
         text.set_weight('normal')
 
     # add a grid
-    plt.grid(grid)
-    # save the output graph
-    if file_name:
-        plt.savefig(file_name + ".png")
+    ax.grid(grid)
 
-    # display the eventual BG
-    ax.text(
-        max(ax.get_xlim()),
-        max(ax.get_ylim()) + 4,
-        "Eventually %d mg/dL" % overall_values[-1],
-        horizontalalignment="right",
-        size=15,
-        color="#a6a5a2"
-    )
 
-    plt.show()
+def loop_inspired_glucose_graph_arguments(
+        output, file_name=None, previous_glucose_count=15):
+    """ Get the arguments to plot_loop_inspired_glucose_graph that graph
+        the predicted glucose of a run, along with the CGM points before it
+        and the correction ranges
+
+    Arguments:
+    output -- the output of update
+    file_name -- name to save the graph as
+    previous_glucose_count -- the number of CGM points to graph
+
+    Output:
+    Dictionary of keyword arguments to plot_loop_inspired_glucose_graph
+    """
+    inputs = output.get("input_data")
+
+    return {
+        "overall_dates": output.get("predicted_glucose_dates"),
+        "overall_values": output.get("predicted_glucose_values"),
+        "title": "Predicted Glucose",
+        "line_color": "#5ac6fa",
+        "grid": True,
+        "previous_glucose_dates":
+            inputs.get("glucose_dates")[-previous_glucose_count:],
+        "previous_glucose_values":
+            inputs.get("glucose_values")[-previous_glucose_count:],
+        "correction_range_starts": inputs.get("target_range_start_times"),
+        "correction_range_ends": inputs.get("target_range_end_times"),
+        "correction_range_mins": inputs.get("target_range_minimum_values"),
+        "correction_range_maxes": inputs.get("target_range_maximum_values"),
+        "file_name": file_name
+    }
+
+
+def render_loop_inspired_glucose_graphs(graphs, workers=None, chunksize=8):
+    """ Save many Loop-inspired prediction graphs in a pool of worker
+        processes, without displaying them
+
+        Each process draws all of its graphs on one figure, which is cleared
+        between graphs, and saves them with the Agg backend (whichever
+        backend pyplot is using), so no window is needed.
+
+    Arguments:
+    graphs -- iterable of dictionaries of keyword arguments to
+              plot_loop_inspired_glucose_graph, each with a "file_name"
+              (see loop_inspired_glucose_graph_arguments)
+    workers -- the number of worker processes; if 0, the graphs are saved
+               in this process (None uses one worker per CPU)
+    chunksize -- the number of graphs sent to a worker at a time
+
+    Output:
+    Generator of the path each graph was saved to, in the same order as the
+    graphs; if saving a graph raised an exception, that exception is given
+    in its place instead of stopping the other graphs
+    """
+    assert chunksize >= 1, "expected a chunk size of at least 1"
+
+    chunks = _graph_chunks(graphs, chunksize)
+
+    if workers == 0:
+        for chunk in chunks:
+            yield from _render_chunk(chunk)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # keep a bounded number of chunks in flight, so the paths can be
+        # streamed without setting up every graph first
+        in_flight = 2 * workers
+        futures = deque()
+        for chunk in chunks:
+            futures.append(executor.submit(_render_chunk, chunk))
+            if len(futures) >= in_flight:
+                yield from futures.popleft().result()
+
+        while futures:
+            yield from futures.popleft().result()
+
+
+def _graph_chunks(graphs, chunksize):
+    """ Group graphs into lists of chunksize graphs """
+    chunk = []
+    for graph in graphs:
+        chunk.append(graph)
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def _render_chunk(chunk):
+    """ Save each graph in a chunk on this process's figure, catching any
+        exceptions
+    """
+    global _batch_figure  # pylint: disable=W0603
+    from matplotlib import rc_context
+    from matplotlib.backends.backend_agg import FigureCanvasAgg
+    from matplotlib.figure import Figure
+
+    if _batch_figure is None:
+        _batch_figure = Figure(figsize=FIGURE_SIZE_INCHES)
+        FigureCanvasAgg(_batch_figure)
+
+    paths = []
+    # the font has to be set while the graph is drawn
+    with rc_context({"font." + key: value for (key, value) in FONT.items()}):
+        for graph in chunk:
+            try:
+                arguments = dict(graph)
+                path = arguments.pop("file_name") + ".png"
+
+                _batch_figure.clear()
+                draw_loop_inspired_glucose_graph(
+                    _batch_figure.add_subplot(111), **arguments
+                )
+                _batch_figure.savefig(path)
+                paths.append(path)
+            except Exception as error:  # pylint: disable=W0703
+                paths.append(error)
+
+    return paths
 
 
 def correction_ranges_between(
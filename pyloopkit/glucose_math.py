@@ -11,9 +11,8 @@ Github URL: https://github.com/tidepool-org/LoopKit/blob/
 # pylint: disable=C0103, R0913, R0914
 # disable pylint errors for too many arguments/variables
 import math
-from datetime import timedelta
 
-from pyloopkit.date import time_interval_since
+from pyloopkit.date import time_interval_since, timeline_dates
 from pyloopkit.loop_math import simulation_date_range_for_samples
 
 
@@ -158,15 +157,11 @@ def linear_momentum_effect(
     if math.isnan(slope) or math.isinf(slope):
         return ([], [])
 
-    date = start_date
-    momentum_effect_dates = []
-    momentum_effect_values = []
-
-    while date <= end_date:
-        value = (max(0, time_interval_since(date, last_time)) * slope)
-        momentum_effect_dates.append(date)
-        momentum_effect_values.append(value)
-        date += timedelta(minutes=delta)
+    momentum_effect_dates = timeline_dates(start_date, end_date, delta)
+    momentum_effect_values = [
+        max(0, time_interval_since(date, last_time)) * slope
+        for date in momentum_effect_dates
+    ]
 
     assert len(momentum_effect_dates) == len(momentum_effect_values),\
         "expected output shape to match"
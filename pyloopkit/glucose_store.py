@@ -11,10 +11,12 @@ Github URL: https://github.com/tidepool-org/LoopKit/blob/
 # pylint: disable=R0913, W0612
 from datetime import timedelta
 
+from pyloopkit import instrumentation
 from pyloopkit.loop_math import filter_date_range
 from pyloopkit.glucose_math import linear_momentum_effect, counteraction_effects
 
 
+@instrumentation.traced
 def get_recent_momentum_effects(
         glucose_starts, glucose_values,
         start_date,
@@ -72,6 +74,7 @@ def get_recent_momentum_effects(
     return effects
 
 
+@instrumentation.traced
 def get_counteraction_effects(
         glucose_starts, glucose_values,
         start_date,
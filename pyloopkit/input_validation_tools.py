@@ -227,3 +227,47 @@ def are_correction_ranges_valid(
         return False
 
     return True
+
+
+def is_loop_input_valid(input_dict):
+    """ Checks all of the inputs update takes (see update in
+        loop_data_manager.py for the keys of input_dict)
+    """
+    return (
+        are_settings_valid(input_dict.get("settings_dictionary"))
+        and are_glucose_readings_valid(
+            input_dict.get("glucose_dates"),
+            input_dict.get("glucose_values")
+        )
+        and are_carb_readings_valid(
+            input_dict.get("carb_dates"),
+            input_dict.get("carb_values"),
+            input_dict.get("carb_absorption_times")
+        )
+        and are_insulin_doses_valid(
+            input_dict.get("dose_types"),
+            input_dict.get("dose_start_times"),
+            input_dict.get("dose_end_times"),
+            input_dict.get("dose_values")
+        )
+        and is_insulin_sensitivity_schedule_valid(
+            input_dict.get("sensitivity_ratio_start_times"),
+            input_dict.get("sensitivity_ratio_end_times"),
+            input_dict.get("sensitivity_ratio_values")
+        )
+        and are_carb_ratios_valid(
+            input_dict.get("carb_ratio_start_times"),
+            input_dict.get("carb_ratio_values")
+        )
+        and are_basal_rates_valid(
+            input_dict.get("basal_rate_start_times"),
+            input_dict.get("basal_rate_values"),
+            input_dict.get("basal_rate_minutes")
+        )
+        and are_correction_ranges_valid(
+            input_dict.get("target_range_start_times"),
+            input_dict.get("target_range_end_times"),
+            input_dict.get("target_range_minimum_values") or [],
+            input_dict.get("target_range_maximum_values")
+        )
+    )
@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Opt-in timing, counters and tracing for runs of the Loop algorithm
+
+While an Instrumentation is active (see instrumenting), the stages of a run
+record how long they took, and the math functions record counts like the
+number of doses left after reconciliation or the number of insulin effect
+dates. When none is active, stage and count do nothing, so a run that isn't
+instrumented only pays for a few function calls.
+
+A Tracer also records a span for each call of the functions marked with
+traced (and each stage), nested the way the calls were, and can export them
+as Chrome trace events to open in a trace viewer (like chrome://tracing or
+https://ui.perfetto.dev, which both work offline).
+
+The active Instrumentation is kept per thread.
+"""
+from contextlib import contextmanager
+import functools
+import json
+import os
+import threading
+import time
+
+_state = threading.local()
+
+
+class Instrumentation:
+    """ Records the wall time of each stage of a run, and counts
+
+        A stage (or count) recorded more than once is summed, so one
+        Instrumentation can collect the totals of several runs.
+    """
+    def __init__(self):
+        # stage name -> seconds, and count name -> count, in the order
+        # they were first recorded
+        self.stages = {}
+        self.counts = {}
+
+    @contextmanager
+    def stage(self, name):
+        """ Time the code run in a with block as the stage name """
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.stages[name] = (
+                self.stages.get(name, 0) + time.perf_counter() - start
+            )
+
+    def count(self, name, value=1):
+        """ Add value to the count name """
+        self.counts[name] = self.counts.get(name, 0) + value
+
+    def span(self, name, metadata=None):  # pylint: disable=W0613, R0201
+        """ Record the code run in a with block as a span (only a Tracer
+            records spans)
+        """
+        return _NO_STAGE
+
+    def as_dict(self):
+        """ The recorded stages and counts
+
+        Output:
+        Dictionary in the format {"stages": {name: seconds},
+                                  "counts": {name: count}}
+        """
+        return {"stages": dict(self.stages), "counts": dict(self.counts)}
+
+
+class _NoStage:
+    """ A stage that records nothing, for when no Instrumentation is
+        active
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        return False
+
+
+_NO_STAGE = _NoStage()
+
+
+class Tracer(Instrumentation):
+    """ Records nested spans as well as the timing and counts of an
+        Instrumentation
+
+        Each span has its name, start and duration, and metadata: what it was
+        given when it started plus the counts recorded while it was the
+        innermost span.
+    """
+    def __init__(self):
+        super().__init__()
+        self.origin = time.perf_counter()
+        # completed spans, in the order they ended, as dictionaries with
+        # "name", "start" and "duration" (microseconds since the Tracer was
+        # made), "depth" and "metadata"
+        self.spans = []
+        self._open_spans = []
+
+    @contextmanager
+    def span(self, name, metadata=None):
+        span = {
+            "name": name,
+            "start": (time.perf_counter() - self.origin) * 1000000,
+            "depth": len(self._open_spans),
+            "metadata": dict(metadata or {})
+        }
+        self._open_spans.append(span)
+        try:
+            yield span
+        finally:
+            self._open_spans.pop()
+            span["duration"] = (
+                (time.perf_counter() - self.origin) * 1000000 - span["start"]
+            )
+            self.spans.append(span)
+
+    @contextmanager
+    def stage(self, name):
+        with super().stage(name), self.span(name):
+            yield
+
+    def count(self, name, value=1):
+        super().count(name, value)
+        if self._open_spans:
+            metadata = self._open_spans[-1]["metadata"]
+            metadata[name] = metadata.get(name, 0) + value
+
+    def chrome_trace(self):
+        """ The spans as Chrome trace events
+
+        Output:
+        Dictionary in the Trace Event Format, with a complete ("X") event
+        for each span, sorted by start
+        """
+        process_id = os.getpid()
+        thread_id = threading.get_ident()
+        return {
+            "traceEvents": [
+                {
+                    "name": span["name"],
+                    "cat": "pyloopkit",
+                    "ph": "X",
+                    "ts": round(span["start"], 3),
+                    "dur": round(span["duration"], 3),
+                    "pid": process_id,
+                    "tid": thread_id,
+                    "args": span["metadata"]
+                }
+                for span in sorted(
+                    self.spans,
+                    key=lambda span: (span["start"], span["depth"])
+                )
+            ],
+            "displayTimeUnit": "ms",
+            "otherData": {"counts": dict(self.counts)}
+        }
+
+    def save_chrome_trace(self, path):
+        """ Write the spans to a Chrome trace event JSON file
+
+        Arguments:
+        path -- the path of the file to write
+        """
+        with open(path, "w") as file:
+            json.dump(self.chrome_trace(), file, default=str)
+
+
+def current_instrumentation():
+    """ The active Instrumentation, or None """
+    return getattr(_state, "instrumentation", None)
+
+
+@contextmanager
+def instrumenting(instrumentation):
+    """ Make instrumentation the active Instrumentation in a with block
+
+    Arguments:
+    instrumentation -- the Instrumentation to record to (or None to stop
+                       recording)
+    """
+    previous = current_instrumentation()
+    _state.instrumentation = instrumentation
+    try:
+        yield instrumentation
+    finally:
+        _state.instrumentation = previous
+
+
+def stage(name):
+    """ Time a with block as the stage name, if an Instrumentation is
+        active
+    """
+    instrumentation = getattr(_state, "instrumentation", None)
+    if instrumentation is None:
+        return _NO_STAGE
+
+    return instrumentation.stage(name)
+
+
+def span(name, **metadata):
+    """ Record a with block as a span with metadata, if a Tracer is
+        active
+    """
+    instrumentation = getattr(_state, "instrumentation", None)
+    if instrumentation is None:
+        return _NO_STAGE
+
+    return instrumentation.span(name, metadata)
+
+
+def traced(function):
+    """ Decorate function so each call is recorded as a span named after
+        it, if a Tracer is active
+    """
+    name = function.__name__
+
+    @functools.wraps(function)
+    def traced_function(*arguments, **keywords):
+        instrumentation = getattr(_state, "instrumentation", None)
+        if instrumentation is None:
+            return function(*arguments, **keywords)
+
+        with instrumentation.span(name):
+            return function(*arguments, **keywords)
+
+    return traced_function
+
+
+def count(name, value=1):
+    """ Add value to the count name, if an Instrumentation is active """
+    instrumentation = getattr(_state, "instrumentation", None)
+    if instrumentation is not None:
+        instrumentation.count(name, value)
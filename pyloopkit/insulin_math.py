@@ -9,16 +9,22 @@ Github URL: https://github.com/tidepool-org/LoopKit/blob/
 57a9f2ba65ae3765ef7baafe66b883e654e08391/LoopKit/InsulinKit/InsulinMath.swift
 """
 # pylint: disable=R0913, R0914, R0912, C0200, R0915, R1702, C0302, R0911
-from math import floor
+from math import ceil, floor
 from datetime import timedelta, datetime
 import sys
+import numpy
 
-from pyloopkit.date import time_interval_since, time_interval_since_reference_date
+from pyloopkit.date import (time_interval_since,
+                            timestamp_since_reference_date, timeline_dates,
+                            MICROSECONDS_PER_SECOND)
+from pyloopkit import instrumentation
 from pyloopkit.dose import DoseType
-from pyloopkit.loop_math import simulation_date_range_for_samples
+from pyloopkit.loop_math import (simulation_date_range_for_samples,
+                                 windowed_sums)
+from pyloopkit.schedule import compiled_schedule
 from pyloopkit.dose_entry import net_basal_units, total_units_given
-from pyloopkit.exponential_insulin_model import percent_effect_remaining
-from pyloopkit.walsh_insulin_model import walsh_percent_effect_remaining
+from pyloopkit.insulin_model import (
+    compile_insulin_model, tabulated_insulin_model)
 
 MAXIMUM_RESERVOIR_DROP_PER_MINUTE = 6.5
 DISTANT_PAST = datetime.fromisoformat("2001-01-01T00:00:00")
@@ -186,6 +192,7 @@ def is_continuous(reservoir_dates, unit_volumes, start, end,
     return True
 
 
+@instrumentation.traced
 def reconciled(dose_types, start_dates, end_dates, values):
     """ Maps a timeline of dose entries with overlapping start and end dates
         to a timeline of doses that represents actual insulin delivery.
@@ -311,6 +318,7 @@ def reconciled(dose_types, start_dates, end_dates, values):
             )
 
 
+@instrumentation.traced
 def annotated(
         dose_types, start_dates, end_dates, values,
         basal_start_times, basal_rates, basal_minutes,
@@ -604,14 +612,96 @@ def schedule_offset(date_to_offset, reference_time,
     Output:
     datetime timedelta object representing offset
     """
-    reference_time_seconds = (reference_time.hour * 3600
-                              + reference_time.minute * 60
-                              + reference_time.second)
-    interval = time_interval_since_reference_date(date_to_offset)
+    reference_time_microseconds = (reference_time.hour * 3600
+                                   + reference_time.minute * 60
+                                   + reference_time.second
+                                   ) * MICROSECONDS_PER_SECOND
+    timestamp = abs(timestamp_since_reference_date(date_to_offset))
 
-    return timedelta(seconds=(interval - reference_time_seconds)
-                     % (repeat_interval * 60 * 60)
-                     + reference_time_seconds)
+    return timedelta(microseconds=(timestamp - reference_time_microseconds)
+                     % (repeat_interval * 60 * 60 * MICROSECONDS_PER_SECOND)
+                     + reference_time_microseconds)
+
+
+def dose_effect_windows(start_dates, end_dates, model, delay=10, delta=5):
+    """ Finds the window each dose's effect changes in: a dose has no effect
+        (and no insulin on board) before it starts, and once all of it has
+        been delivered and is past the insulin delay and the duration of
+        the insulin curve, its effect stays the same
+
+    Arguments:
+    start_dates -- list of datetime objects representing the dates
+                   the doses started at
+    end_dates -- list of datetime objects representing the dates
+                 the doses ended at
+    model -- list of insulin model parameters, or a compiled InsulinModel
+    delay -- the time to delay the dose effect
+    delta -- the differential between timeline entries
+
+    Output:
+    Tuple in format (dates the windows start at, dates the effects settle
+                     at) (see windowed_sums)
+    """
+    assert len(start_dates) == len(end_dates),\
+        "expected input shapes to match"
+
+    # the last delivery segment can start up to a delta before the end of
+    # the dose, and the curve must be strictly past its end to be 0
+    settle_interval = timedelta(
+        minutes=delay + compile_insulin_model(model).effect_duration + delta
+    )
+
+    return (
+        list(start_dates),
+        [
+            max(start_dates[i], end_dates[i]) + settle_interval
+            for i in range(0, len(start_dates))
+        ]
+    )
+
+
+def dose_timestamps(
+        dose_types, start_dates, end_dates, values, scheduled_basal_rates
+    ):
+    """ Finds the properties of doses that glucose_effect and
+        insulin_on_board_calc use, on timestamps instead of datetimes
+
+    Arguments:
+    dose_types -- list of types of doses (basal, bolus, etc)
+    start_dates -- list of datetime objects representing the dates
+                   the doses started at
+    end_dates -- list of datetime objects representing the dates
+                 the doses ended at
+    values -- list of insulin values for doses
+    scheduled_basal_rates -- basal rates scheduled during the times of doses
+
+    Output:
+    Tuple in format (start timestamps (see timestamp_since_reference_date),
+                     durations (seconds),
+                     net units of insulin)
+    """
+    assert len(dose_types) == len(start_dates) == len(end_dates) ==\
+        len(values) == len(scheduled_basal_rates),\
+        "expected input shapes to match"
+
+    starts = [timestamp_since_reference_date(date) for date in start_dates]
+    durations = [
+        (timestamp_since_reference_date(end_dates[i]) - starts[i])
+        / MICROSECONDS_PER_SECOND
+        for i in range(0, len(start_dates))
+    ]
+    units = [
+        net_basal_units(
+            dose_types[i],
+            values[i],
+            start_dates[i],
+            end_dates[i],
+            scheduled_basal_rates[i]
+            )
+        for i in range(0, len(start_dates))
+    ]
+
+    return (starts, durations, units)
 
 
 def insulin_on_board(
@@ -620,7 +710,9 @@ def insulin_on_board(
         start=None,
         end=None,
         delay=10,
-        delta=5
+        delta=5,
+        closed_form=False,
+        engine="iterative"
     ):
     """ Calculates the timeline of insulin remaining for a collection of doses
 
@@ -635,11 +727,17 @@ def insulin_on_board(
                    the doses ended at
     values -- list of insulin values for doses
     scheduled_basal_rates -- basal rates scheduled during the times of doses
-    model -- list of insulin model parameters in format [DIA, peak_time]
+    model -- list of insulin model parameters in format [DIA, peak_time],
+             or a compiled InsulinModel (see compile_insulin_model)
     start -- datetime object of time to start calculating the IOB timeline
     end -- datetime object of time to end the IOB timeline
     delay -- the time to delay the dose effect
     delta -- the differential between timeline entries
+    closed_form -- whether to sum continuous doses in closed form
+                   (see summed_continuous_delivery)
+    engine -- "iterative" to sum the insulin remaining from each dose at each
+              date one at a time, or "convolution" to convolve the net
+              delivery with the insulin curve (see convolved_insulin_on_board)
 
     Output:
     Tuple in format (times_iob_was_calculated_at, iob_values (U of insulin))
@@ -651,54 +749,61 @@ def insulin_on_board(
     if not dose_types:
         return ([], [])
 
+    if engine == "convolution":
+        return convolved_insulin_on_board(
+            dose_types, start_dates, end_dates, values, scheduled_basal_rates,
+            model,
+            delay=delay,
+            delta=delta
+            )
+    if engine != "iterative":
+        raise ValueError("Unknown insulin on board engine: " + str(engine))
+
+    model = tabulated_insulin_model(model, delay, delta)
+
     try:
-        if len(model) == 1:
-            (start, end
-             ) = simulation_date_range_for_samples(
-                 start_times=start_dates,
-                 end_times=end_dates,
-                 duration=model[0]*60,
-                 delay=delay,
-                 delta=delta
-                 )
-        else:
-            (start, end
-             ) = simulation_date_range_for_samples(
-                 start_times=start_dates,
-                 end_times=end_dates,
-                 duration=model[0],
-                 delay=delay,
-                 delta=delta
-                 )
+        (start, end
+         ) = simulation_date_range_for_samples(
+             start_times=start_dates,
+             end_times=end_dates,
+             duration=model.effect_duration,
+             delay=delay,
+             delta=delta
+             )
     except IndexError:
         return ([], [])
 
-    date = start
-    iob_dates = []
-    iob_values = []
+    iob_dates = timeline_dates(start, end, delta)
 
-    def find_partial_iob(i):
-        return insulin_on_board_calc(
-            dose_types[i],
-            start_dates[i],
-            end_dates[i],
-            values[i],
-            scheduled_basal_rates[i],
-            date,
+    # the units and timing of each dose don't depend on the date, so they're
+    # found once, and the timeline is evaluated on timestamps
+    (dose_starts, dose_durations, dose_units) = dose_timestamps(
+        dose_types, start_dates, end_dates, values, scheduled_basal_rates
+    )
+
+    def find_partial_iob(i, timestamp):
+        time = (timestamp - dose_starts[i]) / MICROSECONDS_PER_SECOND
+        if dose_durations[i] < 0 or time < 0:
+            return 0
+
+        return dose_units[i] * dose_insulin_on_board(
+            time,
+            dose_durations[i],
             model,
             delay,
-            delta
+            delta,
+            closed_form
             )
 
-    while date <= end:
-
-        iob_sum = 0
-        for i in range(0, len(start_dates)):
-            iob_sum += find_partial_iob(i)
-
-        iob_dates.append(date)
-        iob_values.append(iob_sum)
-        date += timedelta(minutes=delta)
+    (window_starts, settled_dates) = dose_effect_windows(
+        start_dates, end_dates, model, delay, delta
+    )
+    iob_values = windowed_sums(
+        [timestamp_since_reference_date(date) for date in iob_dates],
+        [timestamp_since_reference_date(date) for date in window_starts],
+        [timestamp_since_reference_date(date) for date in settled_dates],
+        find_partial_iob
+    )
 
     assert len(iob_dates) == len(iob_values), "expected output shape to match"
 
@@ -710,7 +815,8 @@ def insulin_on_board_calc(
         date,
         model,
         delay,
-        delta
+        delta,
+        closed_form=False
     ):
     """ Calculates the insulin on board for a specific dose at a specific time
 
@@ -725,6 +831,9 @@ def insulin_on_board_calc(
     model -- list of insulin model parameters in format [DIA, peak_time]
     delay -- the time to delay the dose effect
     delta -- the differential between timeline entries
+    closed_form -- whether to sum the curve over the delivery segments of a
+                   continuous dose in closed form, rather than one segment
+                   at a time
 
     Output:
     IOB at date
@@ -734,61 +843,66 @@ def insulin_on_board_calc(
     if start_date > end_date or time < 0:
         return 0
 
-    if len(model) == 1:  # walsh model
-        if time_interval_since(end_date, start_date) <= 1.05 * delta * 60:
-            return net_basal_units(
-                type_,
-                value,
-                start_date,
-                end_date,
-                scheduled_basal_rate
-                ) * walsh_percent_effect_remaining(
-                    (time / 60 - delay),
-                    model[0]
-                    )
-        # This will normally be for basals
-        return net_basal_units(
-            type_,
-            value,
-            start_date,
-            end_date,
-            scheduled_basal_rate) * continuous_delivery_insulin_on_board(
-                start_date,
-                end_date,
-                date,
-                model,
-                delay,
-                delta
-                )
-
-    # Consider doses within the delta time window as momentary
-    # This will normally be for boluses or short temp basals
-    if time_interval_since(end_date, start_date) <= 1.05 * delta * 60:
-        return net_basal_units(
-            type_,
-            value,
-            start_date,
-            end_date,
-            scheduled_basal_rate
-            ) * percent_effect_remaining(
-                (time / 60 - delay),
-                model[0],
-                model[1]
-                )
-    # This will normally be for basals
     return net_basal_units(
         type_,
         value,
         start_date,
         end_date,
-        scheduled_basal_rate) * continuous_delivery_insulin_on_board(
-            start_date,
-            end_date,
-            date,
+        scheduled_basal_rate
+        ) * dose_insulin_on_board(
+            time,
+            time_interval_since(end_date, start_date),
             model,
             delay,
-            delta
+            delta,
+            closed_form
+            )
+
+
+def dose_insulin_on_board(
+        time,
+        dose_duration,
+        model,
+        delay,
+        delta,
+        closed_form=False
+    ):
+    """ Calculates the fraction of a dose that is still on board, from the
+        time since the dose started
+
+        This is insulin_on_board_calc on seconds instead of datetimes, so it
+        can be called in loops over timestamps
+        (see timestamp_since_reference_date).
+
+    Arguments:
+    time -- the time since the dose started (seconds, at least 0)
+    dose_duration -- the length of the dose (seconds, at least 0)
+    model -- list of insulin model parameters in format [DIA, peak_time]
+    delay -- the time to delay the dose effect
+    delta -- the differential between timeline entries
+    closed_form -- whether to sum the curve over the delivery segments of a
+                   continuous dose in closed form
+
+    Output:
+    Fraction of the dose on board at the time
+    """
+    model = tabulated_insulin_model(model, delay, delta)
+
+    # Consider doses within the delta time window as momentary
+    # This will normally be for boluses or short temp basals
+    if dose_duration <= 1.05 * delta * 60:
+        return model.percent_effect_remaining(
+            (time / 60 - delay)
             )
+    # This will normally be for basals
+    return continuous_delivery_insulin_on_board_at(
+        dose_duration,
+        time,
+        model,
+        delay,
+        delta,
+        closed_form
+        )
 
 
 def continuous_delivery_insulin_on_board(
@@ -797,7 +911,8 @@ def continuous_delivery_insulin_on_board(
         at_date,
         model,
         delay,
-        delta
+        delta,
+        closed_form=False
     ):
     """ Calculates the percent of original insulin that is still on board
          at a specific time for a dose given over a period greater than
@@ -810,18 +925,49 @@ def continuous_delivery_insulin_on_board(
     model -- list of insulin model parameters in format [DIA, peak_time]
     delay -- the time to delay the dose effect
     delta -- the differential between timeline entries
+    closed_form -- whether to sum the curve over the delivery segments in
+                   closed form (see summed_continuous_delivery)
 
     Output:
     Percentage of insulin remaining at the at_date
     """
-    dose_duration = time_interval_since(end_date, start_date)
+    return continuous_delivery_insulin_on_board_at(
+        time_interval_since(end_date, start_date),
+        time_interval_since(at_date, start_date),
+        model,
+        delay,
+        delta,
+        closed_form
+        )
+
+
+def continuous_delivery_insulin_on_board_at(
+        dose_duration,
+        time,
+        model,
+        delay,
+        delta,
+        closed_form=False
+    ):
+    """ continuous_delivery_insulin_on_board, on the length of the dose and
+        the time since it started (both in seconds) instead of datetimes
+
+    Output:
+    Percentage of insulin remaining at the time
+    """
     delay *= 60
     delta *= 60
 
     if dose_duration < 0:
         return 0
 
-    time = time_interval_since(at_date, start_date)
+    model = compile_insulin_model(model)
+
+    if closed_form and dose_duration > 0:
+        return summed_continuous_delivery(
+            dose_duration, time, model, delay, delta
+            )[1]
+
     iob = 0
     dose_date = 0
 
@@ -836,22 +982,15 @@ def continuous_delivery_insulin_on_board(
                 - dose_date) / dose_duration)
         else:
             segment = 1
-        if len(model) == 1:  # if walsh model
-            iob += segment * walsh_percent_effect_remaining(
-                (time - delay - dose_date) / 60,
-                model[0]
-                )
-        else:
-            iob += segment * percent_effect_remaining(
-                (time - delay - dose_date) / 60,
-                model[0],
-                model[1]
-                )
+        iob += segment * model.percent_effect_remaining(
+            (time - delay - dose_date) / 60
+            )
         dose_date += delta
 
     return iob
 
 
+@instrumentation.traced
 def glucose_effects(
         dose_types,
         dose_start_dates,
@@ -865,7 +1004,9 @@ def glucose_effects(
         delay=10,
         delta=5,
         start=None,
-        end=None
+        end=None,
+        engine="iterative",
+        closed_form=False
         ):
     """ Calculates the timeline of glucose effects for a collection of doses
 
@@ -879,7 +1020,8 @@ def glucose_effects(
     scheduled_basal_rates -- basal rates scheduled during the times of doses
 
     model -- list of insulin model parameters in format [DIA, peak_time] if
-             exponential model, or [DIA] if Walsh model
+             exponential model, or [DIA] if Walsh model, or a compiled
+             InsulinModel (see compile_insulin_model)
 
     sensitivity_start_times -- list of time objects of start times of
                                given insulin sensitivity values
@@ -893,6 +1035,14 @@ def glucose_effects(
     start -- datetime to start calculating the effects at
     end -- datetime to end calculation of effects
 
+    engine -- "iterative" to sum the effect of each dose at each date one at
+              a time, "vectorized" to evaluate every dose/date pair at once
+              with NumPy (see vectorized_glucose_effects), or "convolution"
+              to convolve the net delivery with the insulin curve
+              (see convolved_glucose_effects)
+    closed_form -- whether the iterative engine sums continuous doses in
+                   closed form (see summed_continuous_delivery)
+
     Output:
     Tuple in format (times_glucose_effect_was_calculated_at,
                      glucose_effect_values (mg/dL))
@@ -904,70 +1054,677 @@ def glucose_effects(
     if not dose_types and not (start is not None and end is not None):
         return ([], [])
 
-    if len(model) == 1:  # if using a Walsh model
-        start, end = simulation_date_range_for_samples(
-            start_times=dose_start_dates,
-            end_times=dose_end_dates,
-            duration=model[0] * 60,
+    if engine == "vectorized":
+        return vectorized_glucose_effects(
+            dose_types, dose_start_dates, dose_end_dates, dose_values,
+            scheduled_basal_rates,
+            model,
+            sensitivity_start_times, sensitivity_end_times, sensitivity_values,
             delay=delay,
             delta=delta,
             start=start,
             end=end
-        )
-    else:
-        start, end = simulation_date_range_for_samples(
-            start_times=dose_start_dates,
-            end_times=dose_end_dates,
-            duration=model[0],
+            )
+    if engine == "convolution":
+        return convolved_glucose_effects(
+            dose_types, dose_start_dates, dose_end_dates, dose_values,
+            scheduled_basal_rates,
+            model,
+            sensitivity_start_times, sensitivity_end_times, sensitivity_values,
             delay=delay,
             delta=delta,
             start=start,
             end=end
-        )
+            )
+    if engine != "iterative":
+        raise ValueError("Unknown insulin effect engine: " + str(engine))
+
+    model = tabulated_insulin_model(model, delay, delta)
+
+    start, end = simulation_date_range_for_samples(
+        start_times=dose_start_dates,
+        end_times=dose_end_dates,
+        duration=model.effect_duration,
+        delay=delay,
+        delta=delta,
+        start=start,
+        end=end
+    )
 
-    date = start
-    effect_dates = []
-    effect_values = []
+    effect_dates = timeline_dates(start, end, delta)
+    instrumentation.count("insulin_effect_dates", len(effect_dates))
 
-    def find_partial_effect(i):
-        sensitivity = find_ratio_at_time(
-            sensitivity_start_times,
-            sensitivity_end_times,
-            sensitivity_values,
-            dose_start_dates[i]
+    # the sensitivity for each dose doesn't depend on the date
+    sensitivity_schedule = compiled_schedule(
+        sensitivity_start_times,
+        sensitivity_end_times,
+        sensitivity_values
+    )
+    sensitivities = [
+        sensitivity_schedule.value_at(dose_start_date)
+        for dose_start_date in dose_start_dates
+    ]
+
+    # the units and timing of each dose don't depend on the date, so they're
+    # found once, and the timeline is evaluated on timestamps
+    (dose_starts, dose_durations, dose_units) = dose_timestamps(
+        dose_types, dose_start_dates, dose_end_dates, dose_values,
+        scheduled_basal_rates
+    )
+    scaled_units = [
+        dose_units[i] * -sensitivities[i] for i in range(0, len(dose_units))
+    ]
+
+    def find_partial_effect(i, timestamp):
+        time = (timestamp - dose_starts[i]) / MICROSECONDS_PER_SECOND
+        if time < 0:
+            return 0
+
+        return scaled_units[i] * dose_glucose_effect(
+            time,
+            dose_durations[i],
+            model,
+            delay,
+            delta,
+            closed_form
         )
-        return glucose_effect(
+
+    (window_starts, settled_dates) = dose_effect_windows(
+        dose_start_dates, dose_end_dates, model, delay, delta
+    )
+    effect_values = windowed_sums(
+        [timestamp_since_reference_date(date) for date in effect_dates],
+        [timestamp_since_reference_date(date) for date in window_starts],
+        [timestamp_since_reference_date(date) for date in settled_dates],
+        find_partial_effect,
+        count_name="insulin_model_evaluations"
+    )
+
+    assert len(effect_dates) == len(effect_values),\
+        "expected output shapes to match"
+    return (effect_dates, effect_values)
+
+
+def vectorized_glucose_effects(
+        dose_types,
+        dose_start_dates,
+        dose_end_dates,
+        dose_values,
+        scheduled_basal_rates,
+        model,
+        sensitivity_start_times,
+        sensitivity_end_times,
+        sensitivity_values,
+        delay=10,
+        delta=5,
+        start=None,
+        end=None,
+        chunk_size=256
+        ):
+    """ Calculates the same timeline as glucose_effects, but evaluates every
+        dose at every date in one NumPy broadcast instead of calling
+        glucose_effect once per dose per date
+
+    Arguments:
+    dose_types -- list of types of doses (basal, bolus, etc)
+    dose_start_dates -- list of datetime objects representing the dates
+                       the doses started at
+    dose_end_dates -- list of datetime objects representing the dates
+                       the doses ended at
+    dose_values -- list of insulin values for doses
+    scheduled_basal_rates -- basal rates scheduled during the times of doses
+
+    model -- list of insulin model parameters in format [DIA, peak_time] if
+             exponential model, or [DIA] if Walsh model
+
+    sensitivity_start_times -- list of time objects of start times of
+                               given insulin sensitivity values
+    sensitivity_end_times -- list of time objects of start times of
+                             given insulin sensitivity values
+    sensitivity_values -- list of sensitivities (mg/dL/U)
+
+    delay -- the time to delay the dose effect
+    delta -- the differential between timeline entries
+
+    start -- datetime to start calculating the effects at
+    end -- datetime to end calculation of effects
+
+    chunk_size -- the number of doses to broadcast against the date grid at
+                  a time (bounds the memory used for long histories)
+
+    Output:
+    Tuple in format (times_glucose_effect_was_calculated_at,
+                     glucose_effect_values (mg/dL))
+    """
+    assert len(dose_types) == len(dose_start_dates) == len(dose_end_dates)\
+        == len(dose_values) == len(scheduled_basal_rates),\
+        "expected input shapes to match"
+
+    if not dose_types and not (start is not None and end is not None):
+        return ([], [])
+
+    model = compile_insulin_model(model)
+
+    start, end = simulation_date_range_for_samples(
+        start_times=dose_start_dates,
+        end_times=dose_end_dates,
+        duration=model.effect_duration,
+        delay=delay,
+        delta=delta,
+        start=start,
+        end=end
+    )
+
+    effect_dates = timeline_dates(start, end, delta)
+
+    if not effect_dates:
+        return ([], [])
+    instrumentation.count("insulin_effect_dates", len(effect_dates))
+
+    delay_seconds = delay * 60
+    delta_seconds = delta * 60
+
+    # seconds since the first date of the timeline
+    grid = numpy.arange(len(effect_dates)) * delta_seconds
+
+    # per-dose properties only need to be found once, not once per date
+    offsets = numpy.array([
+        time_interval_since(date, start) for date in dose_start_dates
+    ], dtype=float)
+    durations = numpy.array([
+        time_interval_since(dose_end_dates[i], dose_start_dates[i])
+        for i in range(0, len(dose_start_dates))
+    ], dtype=float)
+    scaled_units = numpy.array([
+        net_basal_units(
             dose_types[i],
+            dose_values[i],
             dose_start_dates[i],
             dose_end_dates[i],
+            scheduled_basal_rates[i]
+            )
+        for i in range(0, len(dose_start_dates))
+    ], dtype=float) * -compiled_schedule(
+        sensitivity_start_times,
+        sensitivity_end_times,
+        sensitivity_values
+        ).values_at(dose_start_dates)
+
+    effect_values = numpy.zeros(len(effect_dates))
+
+    for chunk_start in range(0, len(dose_start_dates), chunk_size):
+        chunk = slice(chunk_start, chunk_start + chunk_size)
+        # rows are doses, columns are dates
+        times = grid[numpy.newaxis, :] - offsets[chunk, numpy.newaxis]
+        chunk_durations = durations[chunk, numpy.newaxis]
+        is_momentary = chunk_durations <= 1.05 * delta_seconds
+
+        # Consider doses within the delta time window as momentary
+        # This will normally be for boluses
+        effects = numpy.where(
+            is_momentary,
+            1 - model.percent_effect_remaining_array(
+                (times - delay_seconds) / 60
+                ),
+            0
+            )
+
+        # Split the remaining doses (normally basals) into delta-long
+        # segments, and add the effect of each segment
+        longest = numpy.max(
+            numpy.where(is_momentary, 0, chunk_durations)
+            )
+        last_segment_dates = numpy.minimum(
+            numpy.floor((times + delay_seconds) / delta_seconds)
+            * delta_seconds,
+            chunk_durations
+            )
+        safe_durations = numpy.where(is_momentary, 1, chunk_durations)
+        dose_date = 0
+        while dose_date <= longest:
+            segment = (numpy.maximum(
+                0,
+                numpy.minimum(dose_date + delta_seconds, chunk_durations)
+                - dose_date
+                ) / safe_durations)
+            is_active = (~is_momentary) & (dose_date <= last_segment_dates)
+            effects += numpy.where(
+                is_active,
+                segment * (1 - model.percent_effect_remaining_array(
+                    (times - delay_seconds - dose_date) / 60
+                    )),
+                0
+                )
+            dose_date += delta_seconds
+
+        effects = numpy.where(times < 0, 0, effects)
+        instrumentation.count(
+            "insulin_model_evaluations",
+            times.size * (1 + int(longest // delta_seconds) + 1)
+        )
+        effect_values += numpy.sum(
+            effects * scaled_units[chunk, numpy.newaxis],
+            axis=0
+            )
+
+    effect_values = effect_values.tolist()
+
+    assert len(effect_dates) == len(effect_values),\
+        "expected output shapes to match"
+    return (effect_dates, effect_values)
+
+
+def delivery_impulses(
+        dose_types,
+        dose_start_dates,
+        dose_end_dates,
+        dose_values,
+        scheduled_basal_rates,
+        reference_date,
+        delta=5
+        ):
+    """ Splits doses into the momentary deliveries that glucose_effects and
+        insulin_on_board treat them as: a dose no longer than 1.05 deltas is
+        delivered all at its start, and a longer dose is delivered in
+        delta-long segments, each at the start of its segment
+
+    Arguments:
+    dose_types -- list of types of doses (basal, bolus, etc)
+    dose_start_dates -- list of datetime objects representing the dates
+                       the doses started at
+    dose_end_dates -- list of datetime objects representing the dates
+                       the doses ended at
+    dose_values -- list of insulin values for doses
+    scheduled_basal_rates -- basal rates scheduled during the times of doses
+    reference_date -- datetime to measure the delivery times from
+    delta -- the differential between timeline entries
+
+    Output:
+    Tuple in format (delivery times (seconds since reference_date),
+                     net units delivered,
+                     index of the segment within its dose (0 for the start
+                     of a dose),
+                     index of the dose the delivery is from)
+    """
+    assert len(dose_types) == len(dose_start_dates) == len(dose_end_dates)\
+        == len(dose_values) == len(scheduled_basal_rates),\
+        "expected input shapes to match"
+
+    delta_seconds = delta * 60
+
+    offsets = []
+    units = []
+    segments = []
+    doses = []
+    for i in range(0, len(dose_types)):
+        offset = time_interval_since(dose_start_dates[i], reference_date)
+        duration = time_interval_since(dose_end_dates[i], dose_start_dates[i])
+        net_units = net_basal_units(
+            dose_types[i],
             dose_values[i],
-            scheduled_basal_rates[i],
-            date,
-            model,
-            sensitivity,
-            delay,
-            delta
+            dose_start_dates[i],
+            dose_end_dates[i],
+            scheduled_basal_rates[i]
+            )
+
+        # Consider doses within the delta time window as momentary
+        # This will normally be for boluses
+        if duration <= 1.05 * delta_seconds:
+            offsets.append(offset)
+            units.append(net_units)
+            segments.append(0)
+            doses.append(i)
+            continue
+
+        # This will normally be for basals
+        dose_date = 0
+        segment = 0
+        while dose_date <= duration:
+            offsets.append(offset + dose_date)
+            units.append(net_units * max(
+                0, min(dose_date + delta_seconds, duration) - dose_date
+                ) / duration)
+            segments.append(segment)
+            doses.append(i)
+            dose_date += delta_seconds
+            segment += 1
+
+    return (
+        numpy.array(offsets, dtype=float),
+        numpy.array(units, dtype=float),
+        numpy.array(segments, dtype=int),
+        numpy.array(doses, dtype=int)
+    )
+
+
+def gridded_delivery(offsets, units, count, delta=5):
+    """ Places momentary deliveries on a timeline of delta-long bins
+
+        Each delivery goes in the bin of the first date at or after it, so
+        nothing is counted at a date before the delivery, and the step at
+        the start of a dose stays where it is. The delivery's lag from that
+        date (less than one delta) is kept, so it can be convolved with the
+        curve at exactly the lags the dates are at (see convolved_delivery).
+
+    Arguments:
+    offsets -- numpy array of the delivery times (seconds since the first
+               date of the timeline)
+    units -- numpy array of the units delivered at each time
+    count -- the number of dates in the timeline
+    delta -- the differential between timeline entries
+
+    Output:
+    Tuple in format (numpy array of the bin of each delivery,
+                     numpy array of the time from each delivery to the date
+                     of its bin (minutes),
+                     numpy array of the units of each delivery,
+                     the number of bins before the first date of the
+                     timeline)
+    """
+    assert len(offsets) == len(units), "expected input shapes to match"
+
+    delta_seconds = delta * 60
+    offsets = numpy.asarray(offsets, dtype=float)
+    units = numpy.asarray(units, dtype=float)
+    upper = numpy.ceil(offsets / delta_seconds)
+
+    # deliveries after the timeline ends can't change it
+    is_used = upper < count
+    offsets = offsets[is_used]
+    units = units[is_used]
+    upper = upper[is_used]
+
+    leading_count = int(max(0, -numpy.min(upper))) if len(upper) else 0
+    indexes = upper.astype(int) + leading_count
+    lags = (upper * delta_seconds - offsets) / 60
+
+    return (indexes, lags, units, leading_count)
+
+
+def convolved_delivery(
+        indexes, lags, units, count, curve,
+        settled_value=0,
+        chunk_size=256
+        ):
+    """ Convolves gridded deliveries (see gridded_delivery) with the curve of
+        a unit delivered at lag 0, which stays at settled_value after the
+        last point of the curve
+
+        The deliveries are grouped by their lag from the date of their bin,
+        and each group is convolved with the curve sampled at that lag, then
+        one bin later, and so on, so every delivery is evaluated at exactly
+        the lags of the timeline's dates. Doses are usually a whole number of
+        seconds apart, so the curve is only sampled for a few hundred lags,
+        however many doses there are.
+
+        The curve only needs to cover the insulin activity; the settled part
+        is added as a running total of the delivery, so the convolution costs
+        O(len(units) * len(curve)) instead of O(len(units) * count).
+
+    Arguments:
+    indexes -- numpy array of the bin of each delivery
+    lags -- numpy array of the time from each delivery to the date of its
+            bin (minutes)
+    units -- numpy array of the units of each delivery
+    count -- the number of bins in the timeline
+    curve -- function of a lag (minutes), giving a numpy array of the curve
+             at that lag, then one bin later, and so on (the same length
+             for every lag)
+    settled_value -- the value of the curve after its last point
+    chunk_size -- the number of deliveries to add to the timeline at once
+
+    Output:
+    numpy array of the convolved timeline, one entry per bin
+    """
+    assert len(indexes) == len(lags) == len(units),\
+        "expected input shapes to match"
+
+    timeline = numpy.zeros(count)
+    if not len(units):
+        return timeline
+
+    (group_lags, groups) = numpy.unique(lags, return_inverse=True)
+    curves = numpy.array([curve(lag) for lag in group_lags])
+    length = curves.shape[1]
+
+    for chunk_start in range(0, len(units), chunk_size):
+        chunk = slice(chunk_start, chunk_start + chunk_size)
+        positions = indexes[chunk, numpy.newaxis] + numpy.arange(length)
+        weights = units[chunk, numpy.newaxis] * curves[groups[chunk]]
+        is_on_timeline = positions < count
+        timeline += numpy.bincount(
+            positions[is_on_timeline],
+            weights=weights[is_on_timeline],
+            minlength=count
+            )
+
+    if settled_value and count > length:
+        timeline[length:] += settled_value * numpy.cumsum(
+            numpy.bincount(indexes, weights=units, minlength=count)
+            )[:count - length]
+
+    return timeline
+
+
+def convolved_glucose_effects(
+        dose_types,
+        dose_start_dates,
+        dose_end_dates,
+        dose_values,
+        scheduled_basal_rates,
+        model,
+        sensitivity_start_times,
+        sensitivity_end_times,
+        sensitivity_values,
+        delay=10,
+        delta=5,
+        start=None,
+        end=None
+        ):
+    """ Calculates the timeline of glucose effects for a collection of doses
+        as one convolution of the net delivery with the insulin curve
+
+        The doses are split into the momentary deliveries glucose_effects
+        uses (see delivery_impulses), placed in delta-long bins
+        (see gridded_delivery) and convolved with the curve at the exact
+        lags of the timeline's dates, so the effects are the iterative
+        engine's, up to floating point rounding.
+
+    Arguments:
+    dose_types -- list of types of doses (basal, bolus, etc)
+    dose_start_dates -- list of datetime objects representing the dates
+                       the doses started at
+    dose_end_dates -- list of datetime objects representing the dates
+                       the doses ended at
+    dose_values -- list of insulin values for doses
+    scheduled_basal_rates -- basal rates scheduled during the times of doses
+
+    model -- list of insulin model parameters in format [DIA, peak_time] if
+             exponential model, or [DIA] if Walsh model, or a compiled
+             InsulinModel (see compile_insulin_model)
+
+    sensitivity_start_times -- list of time objects of start times of
+                               given insulin sensitivity values
+    sensitivity_end_times -- list of time objects of start times of
+                             given insulin sensitivity values
+    sensitivity_values -- list of sensitivities (mg/dL/U)
+
+    delay -- the time to delay the dose effect
+    delta -- the differential between timeline entries
+
+    start -- datetime to start calculating the effects at
+    end -- datetime to end calculation of effects
+
+    Output:
+    Tuple in format (times_glucose_effect_was_calculated_at,
+                     glucose_effect_values (mg/dL))
+    """
+    assert len(dose_types) == len(dose_start_dates) == len(dose_end_dates)\
+        == len(dose_values) == len(scheduled_basal_rates),\
+        "expected input shapes to match"
+
+    if not dose_types and not (start is not None and end is not None):
+        return ([], [])
+
+    model = compile_insulin_model(model)
+
+    start, end = simulation_date_range_for_samples(
+        start_times=dose_start_dates,
+        end_times=dose_end_dates,
+        duration=model.effect_duration,
+        delay=delay,
+        delta=delta,
+        start=start,
+        end=end
+    )
+
+    effect_dates = timeline_dates(start, end, delta)
+
+    if not effect_dates:
+        return ([], [])
+    instrumentation.count("insulin_effect_dates", len(effect_dates))
+
+    (offsets, units, _, doses) = delivery_impulses(
+        dose_types, dose_start_dates, dose_end_dates, dose_values,
+        scheduled_basal_rates,
+        start,
+        delta
         )
+    # the sensitivity for each dose doesn't depend on the date
+    sensitivities = compiled_schedule(
+        sensitivity_start_times,
+        sensitivity_end_times,
+        sensitivity_values
+        ).values_at(dose_start_dates)
+    if len(doses):
+        units = units * -sensitivities[doses]
 
-    while date <= end:
-        effect_sum = 0
-        for i in range(0, len(dose_start_dates)):
-            effect_sum += find_partial_effect(i)
+    (indexes, lags, units, leading_count) = gridded_delivery(
+        offsets, units, len(effect_dates), delta
+        )
 
-        effect_dates.append(date)
-        effect_values.append(effect_sum)
-        date += timedelta(minutes=delta)
+    # the effect of a unit delivered lag minutes before a date, then one
+    # bin before, and so on, which is complete once the curve has ended
+    bin_count = ceil((model.effect_duration + delay) / delta) + 1
+
+    def curve(lag):
+        instrumentation.count("insulin_model_evaluations", bin_count)
+        return 1 - model.percent_effect_remaining_array(
+            numpy.arange(bin_count) * delta + lag - delay
+            )
+
+    effect_values = convolved_delivery(
+        indexes, lags, units, len(effect_dates) + leading_count, curve, 1
+        )[leading_count:].tolist()
 
     assert len(effect_dates) == len(effect_values),\
         "expected output shapes to match"
     return (effect_dates, effect_values)
 
 
+def convolved_insulin_on_board(
+        dose_types, start_dates, end_dates, values, scheduled_basal_rates,
+        model,
+        delay=10,
+        delta=5
+    ):
+    """ Calculates the timeline of insulin remaining for a collection of doses
+        as a convolution of the net delivery with the insulin curve
+
+        See convolved_glucose_effects; like insulin_on_board, the later
+        segments of a continuous dose are counted as soon as they're within
+        the insulin delay of the date.
+
+    Arguments:
+    dose_types -- list of types of doses (basal, bolus, etc)
+    start_dates -- list of datetime objects representing the dates
+                   the doses started at
+    end_dates -- list of datetime objects representing the dates
+                   the doses ended at
+    values -- list of insulin values for doses
+    scheduled_basal_rates -- basal rates scheduled during the times of doses
+    model -- list of insulin model parameters in format [DIA, peak_time],
+             or a compiled InsulinModel (see compile_insulin_model)
+    delay -- the time to delay the dose effect
+    delta -- the differential between timeline entries
+
+    Output:
+    Tuple in format (times_iob_was_calculated_at, iob_values (U of insulin))
+    """
+    assert len(dose_types) == len(start_dates) == len(end_dates) ==\
+        len(values) == len(scheduled_basal_rates),\
+        "expected input shapes to match"
+
+    if not dose_types:
+        return ([], [])
+
+    model = compile_insulin_model(model)
+
+    (start, end
+     ) = simulation_date_range_for_samples(
+         start_times=start_dates,
+         end_times=end_dates,
+         duration=model.effect_duration,
+         delay=delay,
+         delta=delta
+         )
+
+    iob_dates = timeline_dates(start, end, delta)
+
+    (offsets, units, segments, _) = delivery_impulses(
+        dose_types, start_dates, end_dates, values, scheduled_basal_rates,
+        start,
+        delta
+        )
+
+    bin_count = ceil((model.effect_duration + delay) / delta) + 1
+
+    # segment k of a continuous dose is counted up to min(k, lead) bins
+    # before it's delivered (and while its dose hasn't started, it isn't)
+    lead = floor(delay / delta)
+    iob_values = numpy.zeros(len(iob_dates))
+    for early_bins in range(0, lead + 1):
+        is_in_group = (
+            numpy.minimum(segments, lead) == early_bins
+        )
+        if not numpy.any(is_in_group):
+            continue
+        (indexes, lags, group_units, leading_count) = gridded_delivery(
+            offsets[is_in_group] - early_bins * delta * 60,
+            units[is_in_group],
+            len(iob_dates),
+            delta
+            )
+
+        # the insulin remaining from a unit delivered lag minutes before a
+        # date, then one bin before, and so on
+        def early_curve(lag, early_bins=early_bins):
+            return numpy.concatenate((
+                numpy.ones(early_bins),
+                model.percent_effect_remaining_array(
+                    numpy.arange(bin_count) * delta + lag - delay
+                    )
+                ))
+
+        iob_values += convolved_delivery(
+            indexes, lags, group_units, len(iob_dates) + leading_count,
+            early_curve
+            )[leading_count:]
+
+    iob_values = iob_values.tolist()
+
+    assert len(iob_dates) == len(iob_values), "expected output shape to match"
+    return (iob_dates, iob_values)
+
+
 def find_ratio_at_time(ratio_start_times, ratio_end_times,
                        ratio_values, time_to_check
                        ):
     """ Finds ratio or correction range value at a given time
 
+        The schedule is compiled once and cached (see schedule.Schedule), so
+        repeated lookups in the same schedule don't scan every entry.
+
     Arguments:
     ratio_start_times -- list of time objects of start times of
                                given ratio/correction range values
@@ -983,25 +1740,11 @@ def find_ratio_at_time(ratio_start_times, ratio_end_times,
     assert len(ratio_start_times) == len(ratio_values),\
         "expected input shapes to match"
 
-    for i in range(0, len(ratio_start_times)):
-        if ratio_end_times:
-            if is_time_between(
-                    ratio_start_times[i],
-                    ratio_end_times[i],
-                    time_to_check
-                    ):  # pylint: disable=C0330
-                return ratio_values[i]
-        else:
-            if is_time_between(
-                    ratio_start_times[i],
-                    (ratio_start_times[i+1]
-                     if i+1 < len(ratio_start_times)
-                     else ratio_start_times[0]
-                    ),
-                    time_to_check
-                    ):  # pylint: disable=C0330
-                return ratio_values[i]
-    return 0
+    return compiled_schedule(
+        ratio_start_times,
+        ratio_end_times,
+        ratio_values
+        ).value_at(time_to_check)
 
 
 def is_time_between(start, end, time_to_check):
@@ -1040,7 +1783,8 @@ def glucose_effect(
         model,
         insulin_sensitivity,
         delay,
-        delta
+        delta,
+        closed_form=False
     ):
     """ Calculates the timeline of glucose effects for a specific dose
 
@@ -1054,61 +1798,78 @@ def glucose_effect(
     insulin_sensitivity -- sensitivity (mg/dL/U)
     delay -- the time to delay the dose effect
     delta -- the differential between timeline entries
+    closed_form -- whether to sum the curve over the delivery segments of a
+                   continuous dose in closed form, rather than one segment
+                   at a time
 
     Output:
     Glucose effect (mg/dL)
     """
     time = time_interval_since(date, dose_start_date)
-    delay *= 60
-    delta *= 60
 
     if time < 0:
         return 0
 
-    # Consider doses within the delta time window as momentary
-    # This will normally be for boluses
-    if time_interval_since(
-                dose_end_date,
-                dose_start_date
-            ) <= 1.05 * delta:  # pylint: disable=C0330
-
-        if len(model) == 1:  # walsh model
-            return net_basal_units(
-                dose_type, dose_value,
-                dose_start_date,
-                dose_end_date,
-                scheduled_basal_rate
-                ) * -insulin_sensitivity * (1 - walsh_percent_effect_remaining(
-                    (time - delay) / 60,
-                    model[0]
-                    ))
-
-        return net_basal_units(
-            dose_type,
-            dose_value,
-            dose_start_date,
-            dose_end_date,
-            scheduled_basal_rate
-            ) * -insulin_sensitivity * (1 - percent_effect_remaining(
-                (time - delay) / 60,
-                model[0],
-                model[1]
-                ))
-    # This will normally be for basals, and handles Walsh model automatically
     return net_basal_units(
         dose_type,
         dose_value,
         dose_start_date,
         dose_end_date,
         scheduled_basal_rate
-        ) * -insulin_sensitivity * continuous_delivery_glucose_effect(
-            dose_start_date,
-            dose_end_date,
-            date,
+        ) * -insulin_sensitivity * dose_glucose_effect(
+            time,
+            time_interval_since(dose_end_date, dose_start_date),
             model,
-            delay / 60,
-            delta / 60
+            delay,
+            delta,
+            closed_form
+            )
+
+
+def dose_glucose_effect(
+        time,
+        dose_duration,
+        model,
+        delay,
+        delta,
+        closed_form=False
+    ):
+    """ Calculates the fraction of a dose's glucose effect that has happened,
+        from the time since the dose started
+
+        This is glucose_effect on seconds instead of datetimes, so it can be
+        called in loops over timestamps (see timestamp_since_reference_date).
+
+    Arguments:
+    time -- the time since the dose started (seconds, at least 0)
+    dose_duration -- the length of the dose (seconds)
+    model -- list of insulin model parameters in format [DIA, peak_time] if
+             exponential model, or [DIA] if Walsh model
+    delay -- the time to delay the dose effect
+    delta -- the differential between timeline entries
+    closed_form -- whether to sum the curve over the delivery segments of a
+                   continuous dose in closed form
+
+    Output:
+    Fraction of the dose's glucose effect at the time
+    """
+    model = tabulated_insulin_model(model, delay, delta)
+
+    # Consider doses within the delta time window as momentary
+    # This will normally be for boluses
+    if dose_duration <= 1.05 * (delta * 60):
+        return 1 - model.percent_effect_remaining(
+            (time - delay * 60) / 60
             )
+    # This will normally be for basals
+    return continuous_delivery_glucose_effect_at(
+        dose_duration,
+        time,
+        model,
+        delay,
+        delta,
+        closed_form
+        )
 
 
 def continuous_delivery_glucose_effect(
@@ -1116,7 +1877,8 @@ def continuous_delivery_glucose_effect(
         at_date,
         model,
         delay,
-        delta
+        delta,
+        closed_form=False
     ):
     """ Calculates the percent of glucose effect at a specific time for
         a dose given over a period greater than 1.05x the delta
@@ -1129,18 +1891,50 @@ def continuous_delivery_glucose_effect(
     model -- list of insulin model parameters in format [DIA, peak_time]
     delay -- the time to delay the dose effect
     delta -- the differential between timeline entries
+    closed_form -- whether to sum the curve over the delivery segments in
+                   closed form (see summed_continuous_delivery)
 
     Output:
     Percentage of insulin remaining at the at_date
     """
-    dose_duration = time_interval_since(dose_end_date, dose_start_date)
+    return continuous_delivery_glucose_effect_at(
+        time_interval_since(dose_end_date, dose_start_date),
+        time_interval_since(at_date, dose_start_date),
+        model,
+        delay,
+        delta,
+        closed_form
+        )
+
+
+def continuous_delivery_glucose_effect_at(
+        dose_duration,
+        time,
+        model,
+        delay,
+        delta,
+        closed_form=False
+    ):
+    """ continuous_delivery_glucose_effect, on the length of the dose and the
+        time since it started (both in seconds) instead of datetimes
+
+    Output:
+    Percentage of the glucose effect at the time
+    """
     delay *= 60
     delta *= 60
 
     if dose_duration < 0:
         return 0
 
-    time = time_interval_since(at_date, dose_start_date)
+    model = compile_insulin_model(model)
+
+    if closed_form and dose_duration > 0:
+        (delivered, remaining) = summed_continuous_delivery(
+            dose_duration, time, model, delay, delta
+            )
+        return delivered - remaining
+
     activity = 0
     dose_date = 0
 
@@ -1158,24 +1952,70 @@ def continuous_delivery_glucose_effect(
         else:
             segment = 1
 
-        if len(model) == 1:  # if walsh model
-            activity += segment * (1 - walsh_percent_effect_remaining(
-                (time - delay - dose_date) / 60,
-                model[0])
-                                  )
-
-        else:
-            activity += segment * (1 - percent_effect_remaining(
-                (time - delay - dose_date) / 60,
-                model[0],
-                model[1]
-                )
-                                  )
+        activity += segment * (1 - model.percent_effect_remaining(
+            (time - delay - dose_date) / 60
+            ))
         dose_date += delta
 
     return activity
 
 
+def summed_continuous_delivery(dose_duration, time, model, delay, delta):
+    """ Sums the insulin curve over the delivery segments of a continuous
+        dose in O(1), giving the same totals as stepping through the segments
+        one at a time in continuous_delivery_glucose_effect and
+        continuous_delivery_insulin_on_board
+
+        Every segment but the last covers a full delta, so its weight is the
+        same and the curve values can be summed in closed form
+        (see InsulinModel.summed_percent_effect_remaining); the last,
+        partial segment is added separately.
+
+    Arguments:
+    dose_duration -- the length of the dose (seconds, greater than 0)
+    time -- the time since the start of the dose (seconds)
+    model -- list of insulin model parameters in format [DIA, peak_time] if
+             exponential model, or [DIA] if Walsh model
+    delay -- the time to delay the dose effect (seconds)
+    delta -- the differential between timeline entries (seconds)
+
+    Output:
+    Tuple in format (fraction of the dose delivered by the time,
+                     fraction of the dose still on board at the time)
+    """
+    model = compile_insulin_model(model)
+
+    # segments start at 0, delta, 2 * delta... up to and including the limit
+    limit = min(floor((time + delay) / delta) * delta, dose_duration)
+    if limit < 0:
+        return (0, 0)
+    segment_count = floor(limit / delta) + 1
+    while segment_count > 0 and (segment_count - 1) * delta > limit:
+        segment_count -= 1
+
+    full_segments = min(segment_count, floor(dose_duration / delta))
+    while full_segments > 0 and full_segments * delta > dose_duration:
+        full_segments -= 1
+
+    delivered = full_segments * delta / dose_duration
+    remaining = delta / dose_duration * model.summed_percent_effect_remaining(
+        (time - delay) / 60,
+        delta / 60,
+        full_segments
+        )
+
+    if full_segments < segment_count:
+        partial_segment = max(
+            0, dose_duration - full_segments * delta
+            ) / dose_duration
+        delivered += partial_segment
+        remaining += partial_segment * model.percent_effect_remaining(
+            (time - delay - full_segments * delta) / 60
+            )
+
+    return (delivered, remaining)
+
+
 def trim(
         dose_type, start, end, value, scheduled_basal_rate,
         start_interval=None,
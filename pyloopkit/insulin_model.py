@@ -0,0 +1,521 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Insulin models compiled from the parameter lists in the settings dictionary
+("model" is [DIA (minutes), peak (minutes)] for an exponential model,
+or [DIA (hours)] for a Walsh model)
+
+The constants each curve depends on are derived once when the model is
+compiled, rather than on every evaluation, and both curves share one
+interface so callers don't need to branch on the type of model.
+
+Github URL: https://github.com/tidepool-org/LoopKit/blob/
+57a9f2ba65ae3765ef7baafe66b883e654e08391/LoopKit/InsulinKit/InsulinModel.swift
+"""
+# pylint: disable=C0103
+import abc
+from functools import lru_cache
+import math
+import numpy
+
+
+class InsulinModel(abc.ABC):
+    """ Interface for an insulin model; times are in minutes after delivery
+
+    Attributes:
+    parameters -- the parameter list the model was compiled from
+    effect_duration -- the total duration of insulin activity (minutes)
+    """
+    parameters = ()
+    effect_duration = 0
+
+    @abc.abstractmethod
+    def percent_effect_remaining(self, minutes):
+        """ Returns the percentage of total insulin effect remaining at
+            minutes after delivery; aka insulin on board (IOB)
+        """
+
+    @abc.abstractmethod
+    def percent_effect_remaining_array(self, minutes):
+        """ Array version of percent_effect_remaining """
+
+    @abc.abstractmethod
+    def percent_activity(self, minutes):
+        """ Returns the percentage of total insulin effect acting per minute
+            at minutes after delivery
+        """
+
+    @abc.abstractmethod
+    def percent_activity_array(self, minutes):
+        """ Array version of percent_activity """
+
+    @abc.abstractmethod
+    def summed_percent_effect_remaining(
+            self, first_minutes, minute_step, count):
+        """ Returns the sum of percent_effect_remaining over an evenly spaced,
+            descending run of times, without evaluating the curve at each time:
+            percent_effect_remaining(first_minutes)
+            + percent_effect_remaining(first_minutes - minute_step)
+            + ...
+            + percent_effect_remaining(
+                first_minutes - (count - 1) * minute_step)
+
+        Arguments:
+        first_minutes -- the minutes after insulin delivery of the first term
+        minute_step -- the (positive) number of minutes between terms
+        count -- the number of terms to sum
+
+        Output:
+        The summed percentages of total insulin effect remaining
+        """
+
+    def __repr__(self):
+        return "{}({})".format(
+            type(self).__name__,
+            ", ".join(str(parameter) for parameter in self.parameters)
+        )
+
+
+class ExponentialInsulinModel(InsulinModel):
+    """ Exponential insulin curve with a specified peak activity time
+
+    https://github.com/tidepool-org/LoopKit/blob/
+    57a9f2ba65ae3765ef7baafe66b883e654e08391/LoopKit/InsulinKit/
+    ExponentialInsulinModel.swift
+    """
+    def __init__(self, action_duration, peak_activity_time):
+        """
+        Arguments:
+        action_duration -- the total duration on insulin activity (DIA),
+                           in minutes
+        peak_activity_time -- the time (in minutes) of the peak of insulin
+                              activity from dose
+        """
+        self.parameters = (action_duration, peak_activity_time)
+        self.action_duration = action_duration
+        self.peak_activity_time = peak_activity_time
+        self.effect_duration = action_duration
+
+        self.tau = (
+            peak_activity_time * (1 - peak_activity_time / action_duration) /
+            (1 - 2 * peak_activity_time / action_duration)
+        )
+        self.a = 2 * self.tau / action_duration
+        self.S = 1 / (
+            1 - self.a + (1 + self.a) * math.exp(-action_duration / self.tau)
+        )
+
+    def percent_effect_remaining(self, minutes):
+        if minutes <= 0:
+            return 1
+        if minutes > self.action_duration:
+            return 0
+
+        tau = self.tau
+        a = self.a
+        return 1 - self.S * (1 - a) * (
+            (pow(minutes, 2) / (tau * self.action_duration * (1 - a))
+             - minutes / tau - 1) * math.exp(-minutes / tau) + 1)
+
+    def percent_effect_remaining_array(self, minutes):
+        minutes = numpy.asarray(minutes, dtype=float)
+        tau = self.tau
+        a = self.a
+
+        remaining = 1 - self.S * (1 - a) * (
+            (numpy.power(minutes, 2) / (tau * self.action_duration * (1 - a))
+             - minutes / tau - 1) * numpy.exp(-minutes / tau) + 1)
+
+        remaining = numpy.where(minutes > self.action_duration, 0, remaining)
+        return numpy.where(minutes <= 0, 1, remaining)
+
+    def percent_activity(self, minutes):
+        if minutes <= 0 or minutes > self.action_duration:
+            return 0
+
+        return (self.S / pow(self.tau, 2) * minutes
+                * (1 - minutes / self.action_duration)
+                * math.exp(-minutes / self.tau))
+
+    def percent_activity_array(self, minutes):
+        minutes = numpy.asarray(minutes, dtype=float)
+
+        activity = (self.S / pow(self.tau, 2) * minutes
+                    * (1 - minutes / self.action_duration)
+                    * numpy.exp(-minutes / self.tau))
+
+        return numpy.where(
+            (minutes <= 0) | (minutes > self.action_duration), 0, activity
+        )
+
+    def summed_percent_effect_remaining(
+            self, first_minutes, minute_step, count):
+        # Between 0 and the DIA the curve is a quadratic times an exponential,
+        # so the sum over that stretch is a closed-form geometric series
+        if count <= 0:
+            return 0
+
+        def minutes_at(k):
+            return first_minutes - k * minute_step
+
+        # times are descending, so the terms past the DIA (which are 0) come
+        # first, then the curve, then the terms before delivery (which are 1)
+        past_duration = _leading_count(
+            lambda k: minutes_at(k) > self.action_duration,
+            (first_minutes - self.action_duration) / minute_step,
+            count
+            )
+        before_delivery = _leading_count(
+            lambda k: minutes_at(k) > 0,
+            first_minutes / minute_step,
+            count
+            )
+        on_curve = before_delivery - past_duration
+
+        total = count - before_delivery
+        if on_curve <= 0:
+            return total
+
+        tau = self.tau
+        a = self.a
+        S = self.S
+
+        # sum (alpha * t^2 + beta * t + gamma) * exp(-t / tau) from the
+        # smallest time on the curve upwards: t = start + j * minute_step
+        alpha = 1 / (tau * self.action_duration * (1 - a))
+        beta = -1 / tau
+        gamma = -1
+        start = minutes_at(before_delivery - 1)
+
+        constant = alpha * pow(start, 2) + beta * start + gamma
+        linear = (2 * alpha * start + beta) * minute_step
+        quadratic = alpha * pow(minute_step, 2)
+
+        ratio = math.exp(-minute_step / tau)
+        (sum_0, sum_1, sum_2) = _geometric_power_sums(ratio, on_curve)
+
+        exponential_sum = math.exp(-start / tau) * (
+            constant * sum_0 + linear * sum_1 + quadratic * sum_2
+        )
+
+        return (total + on_curve * (1 - S * (1 - a))
+                - S * (1 - a) * exponential_sum)
+
+
+class WalshInsulinModel(InsulinModel):
+    """ Walsh insulin curves, fit to 3, 4, 5 and 6 hour durations
+
+    https://github.com/tidepool-org/LoopKit/blob/
+    57a9f2ba65ae3765ef7baafe66b883e654e08391/LoopKit/InsulinKit/
+    WalshInsulinModel.swift
+    """
+    # polynomial coefficients in scaled minutes, from the constant term up
+    COEFFICIENTS = {
+        3: (0.99951, 9.255e-4, -1.759e-4, 1.354e-6, -3.2030e-9),
+        4: (0.99950, -9.086e-4, -5.510e-5, 2.530e-7, -3.310e-10),
+        5: (0.99300, 4.490e-4, -5.550e-5, 2.320e-7, -2.950e-10),
+        6: (0.99700, 6.365e-4, -4.095e-5, 1.413e-7, -1.493e-10),
+    }
+
+    def __init__(self, action_duration):
+        """
+        Arguments:
+        action_duration -- duration of insulin action, in hours
+        """
+        self.parameters = (action_duration,)
+        self.action_duration = action_duration
+        self.effect_duration = action_duration * 60
+
+        dia = round(action_duration)
+        if dia < 3:
+            dia = 3
+        elif dia > 6:
+            dia = 6
+
+        self.scale = dia / action_duration
+        self.coefficients = self.COEFFICIENTS[dia]
+
+    def percent_effect_remaining(self, minutes):
+        if minutes <= 0:
+            return 1
+        if minutes >= self.effect_duration:
+            return 0
+
+        scaled = minutes * self.scale
+        (c0, c1, c2, c3, c4) = self.coefficients
+        return (c4 * pow(scaled, 4) + c3 * pow(scaled, 3)
+                + c2 * pow(scaled, 2) + c1 * scaled + c0)
+
+    def percent_effect_remaining_array(self, minutes):
+        minutes = numpy.asarray(minutes, dtype=float)
+
+        scaled = minutes * self.scale
+        (c0, c1, c2, c3, c4) = self.coefficients
+        remaining = (c4 * numpy.power(scaled, 4) + c3 * numpy.power(scaled, 3)
+                     + c2 * numpy.power(scaled, 2) + c1 * scaled + c0)
+
+        remaining = numpy.where(minutes >= self.effect_duration, 0, remaining)
+        return numpy.where(minutes <= 0, 1, remaining)
+
+    def percent_activity(self, minutes):
+        if minutes <= 0 or minutes >= self.effect_duration:
+            return 0
+
+        scaled = minutes * self.scale
+        (_, c1, c2, c3, c4) = self.coefficients
+        return -self.scale * (4 * c4 * pow(scaled, 3) + 3 * c3 * pow(scaled, 2)
+                              + 2 * c2 * scaled + c1)
+
+    def percent_activity_array(self, minutes):
+        minutes = numpy.asarray(minutes, dtype=float)
+
+        scaled = minutes * self.scale
+        (_, c1, c2, c3, c4) = self.coefficients
+        activity = -self.scale * (
+            4 * c4 * numpy.power(scaled, 3) + 3 * c3 * numpy.power(scaled, 2)
+            + 2 * c2 * scaled + c1)
+
+        return numpy.where(
+            (minutes <= 0) | (minutes >= self.effect_duration), 0, activity
+        )
+
+    def summed_percent_effect_remaining(
+            self, first_minutes, minute_step, count):
+        # Between 0 and the DIA the curve is a quartic, so the sum over that
+        # stretch reduces to sums of powers of the term index
+        if count <= 0:
+            return 0
+
+        def minutes_at(k):
+            return first_minutes - k * minute_step
+
+        # minutes are descending, so the terms past the DIA (which are 0) come
+        # first, then the curve, then the terms before delivery (which are 1)
+        past_duration = _leading_count(
+            lambda k: minutes_at(k) >= self.effect_duration,
+            (first_minutes - self.effect_duration) / minute_step,
+            count
+            )
+        before_delivery = _leading_count(
+            lambda k: minutes_at(k) > 0,
+            first_minutes / minute_step,
+            count
+            )
+        on_curve = before_delivery - past_duration
+
+        total = count - before_delivery
+        if on_curve <= 0:
+            return total
+
+        # sum the polynomial from the smallest time on the curve upwards:
+        # scaled = start + j * step
+        start = minutes_at(before_delivery - 1) * self.scale
+        step = minute_step * self.scale
+        index_sums = _power_sums(on_curve - 1)
+
+        curve_sum = 0
+        for power, coefficient in enumerate(self.coefficients):
+            # expand (start + j * step)^power binomially
+            power_sum = sum(
+                _BINOMIAL_COEFFICIENTS[power][r]
+                * pow(start, power - r) * pow(step, r)
+                * index_sums[r]
+                for r in range(power + 1)
+            )
+            curve_sum += coefficient * power_sum
+
+        return total + curve_sum
+
+
+class TabulatedInsulinModel(InsulinModel):
+    """ An insulin model whose curves are precomputed on a fixed grid of
+        offsets from the start of a dose
+
+        Effects are evaluated at times that are whole numbers of seconds
+        after a dose starts, shifted by the insulin delay, so those lookups
+        land exactly on the grid; any other times are linearly interpolated
+        between the neighbouring grid points.
+    """
+    # the number of grid points per delta; with a 5 minute delta, this
+    # gives one grid point per second
+    SUBDIVISIONS = 300
+
+    def __init__(self, model, delay, delta):
+        """
+        Arguments:
+        model -- the InsulinModel to tabulate
+        delay -- the time to delay the dose effect (minutes)
+        delta -- the differential between timeline entries (minutes)
+        """
+        self.model = model
+        self.parameters = model.parameters
+        self.effect_duration = model.effect_duration
+        self.delay = delay
+        self.delta = delta
+
+        # grid point i is at (i * step - delay) minutes after delivery, and
+        # the table runs until the curve has ended
+        self.points_per_minute = self.SUBDIVISIONS / delta
+        point_count = math.ceil(
+            (model.effect_duration + delay) * self.points_per_minute
+        ) + 2
+        minutes = numpy.arange(point_count) / self.points_per_minute - delay
+
+        self.remaining = model.percent_effect_remaining_array(minutes).tolist()
+        self.activity = model.percent_activity_array(minutes).tolist()
+
+    def _lookup(self, table, minutes):
+        """ Look up minutes in table, which must be inside the table's
+            range
+        """
+        position = (minutes + self.delay) * self.points_per_minute
+        index = int(position + 0.5)
+
+        if -1e-6 < position - index < 1e-6:
+            return table[index]
+
+        lower = int(position)
+        fraction = position - lower
+        return table[lower] + (table[lower + 1] - table[lower]) * fraction
+
+    def percent_effect_remaining(self, minutes):
+        if minutes <= 0:
+            return 1
+        if minutes >= self.effect_duration:
+            return self.model.percent_effect_remaining(minutes)
+        return self._lookup(self.remaining, minutes)
+
+    def percent_effect_remaining_array(self, minutes):
+        return self.model.percent_effect_remaining_array(minutes)
+
+    def percent_activity(self, minutes):
+        if minutes <= 0 or minutes >= self.effect_duration:
+            return self.model.percent_activity(minutes)
+        return self._lookup(self.activity, minutes)
+
+    def percent_activity_array(self, minutes):
+        return self.model.percent_activity_array(minutes)
+
+    def summed_percent_effect_remaining(
+            self, first_minutes, minute_step, count):
+        return self.model.summed_percent_effect_remaining(
+            first_minutes, minute_step, count
+        )
+
+
+def compile_insulin_model(model):
+    """ Get the insulin model object for a list of model parameters
+
+        Models are cached by their parameters, so compiling the same
+        parameters again is cheap and returns the same object.
+
+    Arguments:
+    model -- list of insulin model parameters in format [DIA, peak_time] if
+             exponential model, or [DIA] if Walsh model; an InsulinModel is
+             returned unchanged
+
+    Output:
+    InsulinModel object
+    """
+    if isinstance(model, InsulinModel):
+        return model
+
+    return _compiled_insulin_model(tuple(model))
+
+
+@lru_cache(maxsize=32)
+def _compiled_insulin_model(parameters):
+    if len(parameters) == 1:
+        return WalshInsulinModel(parameters[0])
+    if len(parameters) == 2:
+        return ExponentialInsulinModel(parameters[0], parameters[1])
+
+    raise ValueError(
+        "Expected insulin model parameters in format [DIA, peak_time] or "
+        + "[DIA], got " + str(list(parameters))
+    )
+
+
+def tabulated_insulin_model(model, delay, delta):
+    """ Get the tabulated version of an insulin model for a particular
+        delay and delta
+
+        Tables are kept in a least-recently-used cache keyed by the model
+        parameters, delay and delta, so they are only built once for
+        settings that don't change between loop runs.
+
+    Arguments:
+    model -- list of insulin model parameters in format [DIA, peak_time] if
+             exponential model, or [DIA] if Walsh model, or an InsulinModel
+    delay -- the time to delay the dose effect (minutes)
+    delta -- the differential between timeline entries (minutes)
+
+    Output:
+    TabulatedInsulinModel object
+    """
+    if (isinstance(model, TabulatedInsulinModel)
+            and model.delay == delay and model.delta == delta):
+        return model
+
+    return _tabulated_insulin_model(
+        compile_insulin_model(model).parameters, delay, delta
+    )
+
+
+@lru_cache(maxsize=16)
+def _tabulated_insulin_model(parameters, delay, delta):
+    return TabulatedInsulinModel(
+        _compiled_insulin_model(parameters), delay, delta
+    )
+
+
+def _leading_count(predicate, estimate, count):
+    """ Count how many of the first terms (indexes 0, 1, ..., count - 1)
+        satisfy predicate, given that they form a leading run and that
+        estimate is approximately where the run ends
+    """
+    index = min(count, max(0, math.ceil(estimate)))
+    # correct for any floating point error in the estimate
+    while index > 0 and not predicate(index - 1):
+        index -= 1
+    while index < count and predicate(index):
+        index += 1
+    return index
+
+
+def _geometric_power_sums(ratio, count):
+    """ Returns (sum of r^j, sum of j * r^j, sum of j^2 * r^j) for
+        j = 0...count - 1, where r is ratio (r != 1)
+    """
+    n = count
+    r_n = pow(ratio, n)
+    sum_0 = (1 - r_n) / (1 - ratio)
+    sum_1 = (ratio * (1 - n * pow(ratio, n - 1) + (n - 1) * r_n)
+             / pow(1 - ratio, 2))
+    sum_2 = (ratio * (1 + ratio - pow(n, 2) * pow(ratio, n - 1)
+                      + (2 * pow(n, 2) - 2 * n - 1) * r_n
+                      - pow(n - 1, 2) * r_n * ratio)
+             / pow(1 - ratio, 3))
+    return (sum_0, sum_1, sum_2)
+
+
+# _BINOMIAL_COEFFICIENTS[n][r] is n choose r, for the powers of the Walsh
+# curve's quartic
+_BINOMIAL_COEFFICIENTS = [
+    [1],
+    [1, 1],
+    [1, 2, 1],
+    [1, 3, 3, 1],
+    [1, 4, 6, 4, 1]
+]
+
+
+def _power_sums(n):
+    """ Returns the sums of j^0, j^1, ..., j^4 for j = 0...n """
+    return [
+        n + 1,
+        n * (n + 1) / 2,
+        n * (n + 1) * (2 * n + 1) / 6,
+        pow(n * (n + 1) / 2, 2),
+        n * (n + 1) * (2 * n + 1) * (3 * pow(n, 2) + 3 * n - 1) / 30
+    ]
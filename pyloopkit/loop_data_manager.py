@@ -9,32 +9,38 @@ Github URL: https://github.com/tidepool-org/Loop/blob/
 8c1dfdba38fbf6588b07cee995a8b28fcf80ef69/Loop/Managers/LoopDataManager.swift
 """
 # pylint: disable=R0913, R0914, W0105, C0200, R0916
+from bisect import bisect_left, bisect_right
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from datetime import timedelta
+import os
 import warnings
 
-from pyloopkit.carb_store import get_carb_glucose_effects, get_carbs_on_board
-from pyloopkit.date import time_interval_since
+from pyloopkit.carb_store import get_carb_glucose_effects_and_carbs_on_board
+from pyloopkit.date import time_interval_since, timeline_dates
 from pyloopkit.dose import DoseType
-from pyloopkit.dose_math import recommended_temp_basal, recommended_bolus
+from pyloopkit.dose_math import recommended_temp_basal_and_bolus
 from pyloopkit.dose_store import get_glucose_effects
 from pyloopkit.glucose_store import (get_recent_momentum_effects,
                            get_counteraction_effects)
-from pyloopkit.input_validation_tools import (
-    are_settings_valid, are_glucose_readings_valid, are_carb_readings_valid,
-    is_insulin_sensitivity_schedule_valid, are_carb_ratios_valid,
-    are_basal_rates_valid, are_correction_ranges_valid,
-    are_insulin_doses_valid)
+from pyloopkit.input_validation_tools import is_loop_input_valid
+from pyloopkit.instrumentation import (Instrumentation, instrumenting, stage,
+                                       count)
 from pyloopkit.insulin_math import find_ratio_at_time
+from pyloopkit.insulin_model import compile_insulin_model
+from pyloopkit.loop_input import LoopInput
 from pyloopkit.loop_math import (combined_sums, decay_effect, subtracting,
-                       predict_glucose)
+                       predict_glucose, filter_date_range)
 
 
-def update(input_dict):
+def update(input_dict, instrumentation=None):
     """ Run data through the Loop algorithm and return the predicted glucose
         values, recommended temporary basal, and recommended bolus
 
     Arguments:
-    input_dict - dictionary containing the following keys/data:
+    input_dict - dictionary (or a LoopInput built from one, which is
+                 converted back to a dictionary to run it) containing the
+                 following keys/data:
         "glucose_dates" -- times of glucose measurements
         "glucose_values" -- glucose measurements in mg/dL)
 
@@ -86,6 +92,10 @@ def update(input_dict):
                 - the maximum basal rate that Loop is allowed to give
             - "max_bolus"
                 - the maximum bolus that Loop is allowed to give or recommend
+            - "insulin_effect_engine" (optional)
+                - "iterative" (default), "vectorized" or "convolution";
+                  selects how insulin_math.glucose_effects sums the dose
+                  effects
 
         "sensitivity_ratio_start_times" -- start times for sensitivity ratios
         "sensitivity_ratio_end_times" -- end times for sensitivity ratios
@@ -113,11 +123,60 @@ def update(input_dict):
         time_to_calculate_at -- the "now" time and the time at which to
             recommend the basal rate and bolus
 
+        "previous_counteraction_effect_dates" (optional) -- end times of the
+            counteraction effects calculated by a previous run; only the
+            counteraction effects after the last one are calculated
+        "previous_counteraction_effect_start_times" and
+        "previous_counteraction_effect_values" (optional) -- the start times
+            and values of those counteraction effects; if given, they are
+            used together with the new counteraction effects
+
+    instrumentation -- whether to record the wall time of each stage of the
+        run and counts like the number of doses after reconciliation (see
+        instrumentation.py):
+            - None or False to not record them
+            - True to return them under the "instrumentation" key
+            - an Instrumentation to record them to (or a Tracer, which
+              also records the nested calls of the run as spans)
+            - any other callable (a sink) to call with them, in the format
+              Instrumentation.as_dict gives, after the run
+
     Output:
         Dictionary containing all of the calculated effects, the input
         dictionary, the predicted glucose values, and the recommended
         temp basal/bolus
     """
+    if instrumentation is None or instrumentation is False:
+        return _update(input_dict)
+
+    recorder = (
+        instrumentation if isinstance(instrumentation, Instrumentation)
+        else Instrumentation()
+    )
+    with instrumenting(recorder), recorder.stage("total"):
+        output = _update(input_dict)
+
+    if instrumentation is True:
+        if output:
+            output["instrumentation"] = recorder.as_dict()
+    elif recorder is not instrumentation:
+        instrumentation(recorder.as_dict())
+
+    return output
+
+
+def _update(input_dict):
+    """ Run the Loop algorithm (see update) """
+    # the math works on lists of datetimes
+    if isinstance(input_dict, LoopInput):
+        input_dict = input_dict.to_dict()
+
+    # check that the inputs make sense before doing math with them
+    with stage("validation"):
+        is_valid = is_loop_input_valid(input_dict)
+    if not is_valid:
+        return []
+
     glucose_dates = input_dict.get("glucose_dates")
     glucose_values = input_dict.get("glucose_values")
 
@@ -152,33 +211,12 @@ def update(input_dict):
 
     time_to_calculate_at = input_dict.get("time_to_calculate_at")
 
-    # check that the inputs make sense before doing math with them
-    if (
-            not are_settings_valid(settings_dictionary)
-            or not are_glucose_readings_valid(
-                glucose_dates, glucose_values,
-            )
-            or not are_carb_readings_valid(
-                carb_dates, carb_values, carb_absorptions
-            )
+    count("glucose_samples", len(glucose_dates))
+    count("doses", len(dose_types))
+    count("carb_entries", len(carb_dates))
 
-            or not are_insulin_doses_valid(
-                dose_types, dose_starts, dose_ends, dose_values
-            )
-            or not is_insulin_sensitivity_schedule_valid(
-                sensitivity_starts, sensitivity_ends, sensitivity_values
-            )
-            or not are_carb_ratios_valid(
-                carb_ratio_starts, carb_ratio_values
-            )
-            or not are_basal_rates_valid(
-                basal_starts, basal_rates, basal_minutes
-            )
-            or not are_correction_ranges_valid(
-                target_range_starts, target_range_ends,
-                target_range_mins, target_range_maxes
-            )):
-        return []
+    # derive the insulin curve's constants once for the whole run
+    insulin_model = compile_insulin_model(settings_dictionary.get("model"))
 
     last_glucose_date = glucose_dates[-1]
 
@@ -198,80 +236,113 @@ def update(input_dict):
         else earliest_effect_date
     )
 
-    (momentum_effect_dates,
-     momentum_effect_values
-     ) = get_recent_momentum_effects(
-         glucose_dates, glucose_values,
-         next_effect_date,
-         time_to_calculate_at,
-         settings_dictionary.get("momentum_data_interval") or 15,
-         5
-         )
+    # counteraction effects from a previous run, within the last 24 hours
+    previous_counteraction_effects = ([], [], [])
+    if (input_dict.get("previous_counteraction_effect_start_times")
+            and input_dict.get("previous_counteraction_effect_values")):
+        previous_counteraction_effects = filter_date_range(
+            input_dict.get("previous_counteraction_effect_start_times"),
+            input_dict.get("previous_counteraction_effect_dates"),
+            input_dict.get("previous_counteraction_effect_values"),
+            earliest_effect_date,
+            None
+            )
 
-    # calculate previous insulin effects in order to later calculate the
-    # insulin counteraction effects
-    (insulin_effect_dates,
-     insulin_effect_values
-     ) = get_glucose_effects(
-         dose_types, dose_starts, dose_ends, dose_values,
-         next_effect_date,
-         basal_starts, basal_rates, basal_minutes,
-         sensitivity_starts, sensitivity_ends, sensitivity_values,
-         settings_dictionary.get("model"),
-         delay=settings_dictionary.get("insulin_delay") or 10
-         )
+    with stage("momentum"):
+        (momentum_effect_dates,
+         momentum_effect_values
+         ) = get_recent_momentum_effects(
+             glucose_dates, glucose_values,
+             next_effect_date,
+             time_to_calculate_at,
+             settings_dictionary.get("momentum_data_interval") or 15,
+             5
+             )
 
-    # calculate future insulin effects for the purposes of predicting glucose
-    (now_to_dia_insulin_effect_dates,
-     now_to_dia_insulin_effect_values
-     ) = get_glucose_effects(
-        dose_types, dose_starts, dose_ends, dose_values,
-        time_to_calculate_at,
-        basal_starts, basal_rates, basal_minutes,
-        sensitivity_starts, sensitivity_ends, sensitivity_values,
-        settings_dictionary.get("model"),
-        delay=settings_dictionary.get("insulin_delay") or 10
-        )
+    # when continuing from a previous run, only the insulin effects from just
+    # before next_effect_date are needed, but the doses are prepared as if
+    # all 24 hours were calculated, so the new counteraction effects are the
+    # same as a run without the previous ones would find
+    insulin_effect_start = next_effect_date
+    if input_dict.get("previous_counteraction_effect_dates"):
+        insulin_effect_start -= timedelta(minutes=5)
+
+    insulin_delay = settings_dictionary.get("insulin_delay") or 10
+    insulin_effect_engine = (
+        settings_dictionary.get("insulin_effect_engine") or "iterative"
+    )
+
+    with stage("insulin_effects"):
+        # calculate previous insulin effects in order to later calculate the
+        # insulin counteraction effects
+        (insulin_effect_dates,
+         insulin_effect_values
+         ) = get_glucose_effects(
+             dose_types, dose_starts, dose_ends, dose_values,
+             insulin_effect_start,
+             basal_starts, basal_rates, basal_minutes,
+             sensitivity_starts, sensitivity_ends, sensitivity_values,
+             insulin_model,
+             delay=insulin_delay,
+             engine=insulin_effect_engine,
+             history_start=earliest_effect_date
+             )
+
+        # calculate future insulin effects for the purposes of predicting
+        # glucose
+        (now_to_dia_insulin_effect_dates,
+         now_to_dia_insulin_effect_values
+         ) = get_glucose_effects(
+             dose_types, dose_starts, dose_ends, dose_values,
+             time_to_calculate_at,
+             basal_starts, basal_rates, basal_minutes,
+             sensitivity_starts, sensitivity_ends, sensitivity_values,
+             insulin_model,
+             delay=insulin_delay,
+             engine=insulin_effect_engine
+             )
 
     # if our BG data is current and we know the expected insulin effects,
     # calculate tbe counteraction effects
-    if next_effect_date < last_glucose_date and insulin_effect_dates:
+    with stage("counteraction"):
+        new_counteraction_effects = ([], [], [])
+        if next_effect_date < last_glucose_date and insulin_effect_dates:
+            new_counteraction_effects = get_counteraction_effects(
+                glucose_dates, glucose_values,
+                next_effect_date,
+                insulin_effect_dates, insulin_effect_values
+                )
+        count("counteraction_effects", len(new_counteraction_effects[0]))
+
         (counteraction_starts,
          counteraction_ends,
          counteraction_values
-         ) = counteraction_effects = get_counteraction_effects(
-             glucose_dates, glucose_values,
-             next_effect_date,
-             insulin_effect_dates, insulin_effect_values
+         ) = counteraction_effects = tuple(
+             previous + new for (previous, new) in zip(
+                 previous_counteraction_effects, new_counteraction_effects
              )
-
-    (carb_effect_dates,
-     carb_effect_values
-     ) = get_carb_glucose_effects(
-         carb_dates, carb_values, carb_absorptions,
-         retrospective_start,
-         *counteraction_effects if
-         settings_dictionary.get("dynamic_carb_absorption_enabled")
-         is not False else ([], [], []),
-         carb_ratio_starts, carb_ratio_values,
-         sensitivity_starts, sensitivity_ends, sensitivity_values,
-         settings_dictionary.get("default_absorption_times"),
-         delay=settings_dictionary.get("carb_delay") or 10
          )
 
-    (cob_dates,
-     cob_values
-     ) = get_carbs_on_board(
-         carb_dates, carb_values, carb_absorptions,
-         time_to_calculate_at,
-         *counteraction_effects if
-         settings_dictionary.get("dynamic_carb_absorption_enabled")
-         is not False else ([], [], []),
-         carb_ratio_starts, carb_ratio_values,
-         sensitivity_starts, sensitivity_ends, sensitivity_values,
-         settings_dictionary.get("default_absorption_times"),
-         delay=settings_dictionary.get("carb_delay") or 10
-         )
+    # calculate the carb effects and COB, sharing the observed absorption of
+    # the carbs between them
+    with stage("carb_effects"):
+        ((carb_effect_dates,
+          carb_effect_values
+          ),
+         (cob_dates,
+          cob_values
+          )) = get_carb_glucose_effects_and_carbs_on_board(
+              carb_dates, carb_values, carb_absorptions,
+              retrospective_start,
+              time_to_calculate_at,
+              *counteraction_effects if
+              settings_dictionary.get("dynamic_carb_absorption_enabled")
+              is not False else ([], [], []),
+              carb_ratio_starts, carb_ratio_values,
+              sensitivity_starts, sensitivity_ends, sensitivity_values,
+              settings_dictionary.get("default_absorption_times"),
+              delay=settings_dictionary.get("carb_delay") or 10
+              )
 
     current_cob = cob_values[
         closest_prior_to_date(
@@ -280,23 +351,24 @@ def update(input_dict):
             )
         ] if cob_dates else 0
 
-    if settings_dictionary.get("retrospective_correction_enabled"):
-        (retrospective_effect_dates,
-         retrospective_effect_values
-         ) = update_retrospective_glucose_effect(
-            glucose_dates, glucose_values,
-            carb_effect_dates, carb_effect_values,
-            counteraction_starts, counteraction_ends, counteraction_values,
-            settings_dictionary.get("recency_interval") or 15,
-            settings_dictionary.get(
-                "retrospective_correction_grouping_interval"
-            ) or 30,
-            time_to_calculate_at
-            )
-    else:
-        (retrospective_effect_dates,
-         retrospective_effect_values
-         ) = ([], [])
+    with stage("retrospective_correction"):
+        if settings_dictionary.get("retrospective_correction_enabled"):
+            (retrospective_effect_dates,
+             retrospective_effect_values
+             ) = update_retrospective_glucose_effect(
+                glucose_dates, glucose_values,
+                carb_effect_dates, carb_effect_values,
+                counteraction_starts, counteraction_ends, counteraction_values,
+                settings_dictionary.get("recency_interval") or 15,
+                settings_dictionary.get(
+                    "retrospective_correction_grouping_interval"
+                ) or 30,
+                time_to_calculate_at
+                )
+        else:
+            (retrospective_effect_dates,
+             retrospective_effect_values
+             ) = ([], [])
 
     recommendations = update_predicted_glucose_and_recommended_basal_and_bolus(
         time_to_calculate_at,
@@ -308,7 +380,7 @@ def update(input_dict):
         target_range_starts, target_range_ends, target_range_mins, target_range_maxes,
         settings_dictionary.get("suspend_threshold"),
         sensitivity_starts, sensitivity_ends, sensitivity_values,
-        settings_dictionary.get("model"),
+        insulin_model,
         basal_starts, basal_rates, basal_minutes,
         settings_dictionary.get("max_basal_rate"),
         settings_dictionary.get("max_bolus"),
@@ -343,6 +415,84 @@ def update(input_dict):
     return recommendations
 
 
+def update_many(inputs, workers=None, chunksize=1):
+    """ Run update over many inputs in a pool of worker processes
+
+    Arguments:
+    inputs -- iterable of input dictionaries (or LoopInputs) in the format
+              update takes
+    workers -- the number of worker processes; if 0, the inputs are run
+               in this process (None uses one worker per CPU)
+    chunksize -- the number of inputs sent to a worker at a time
+
+    Output:
+    Generator of update's output for each input, in the same order as the
+    inputs; if running an input raised an exception, that exception is
+    given in its place instead of stopping the other runs
+    """
+    assert chunksize >= 1, "expected a chunk size of at least 1"
+
+    # inputs are sent to the workers as LoopInputs, which pickle to a few
+    # NumPy columns instead of lists of datetimes and DoseTypes
+    chunks = _input_chunks(inputs, chunksize)
+
+    if workers == 0:
+        for chunk in chunks:
+            yield from _update_chunk(chunk)
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        # keep a bounded number of chunks in flight, so results can be
+        # streamed without reading every input first
+        in_flight = 2 * workers
+        futures = deque()
+        for chunk in chunks:
+            futures.append(executor.submit(_update_chunk, chunk))
+            if len(futures) >= in_flight:
+                yield from futures.popleft().result()
+
+        while futures:
+            yield from futures.popleft().result()
+
+
+def _input_chunks(inputs, chunksize):
+    """ Group inputs into lists of LoopInputs (or the exception raised while
+        building one)
+    """
+    chunk = []
+    for input_ in inputs:
+        try:
+            chunk.append(
+                input_ if isinstance(input_, LoopInput)
+                else LoopInput(input_)
+            )
+        except Exception as error:  # pylint: disable=W0703
+            chunk.append(error)
+
+        if len(chunk) == chunksize:
+            yield chunk
+            chunk = []
+
+    if chunk:
+        yield chunk
+
+
+def _update_chunk(chunk):
+    """ Run update on each LoopInput in a chunk, catching any exceptions """
+    outputs = []
+    for loop_input in chunk:
+        if isinstance(loop_input, Exception):
+            outputs.append(loop_input)
+            continue
+        try:
+            outputs.append(update(loop_input))
+        except Exception as error:  # pylint: disable=W0703
+            outputs.append(error)
+
+    return outputs
+
+
 def closest_prior_to_date(date_to_compare, dates):
     """ Returns the index of the closest element in the sorted sequence
         prior to the specified date
@@ -587,6 +737,8 @@ def update_predicted_glucose_and_recommended_basal_and_bolus(
     assert target_starts and sensitivity_starts and basal_starts and model,\
         "expected to receive complete settings data"
 
+    model = compile_insulin_model(model)
+
     if (not momentum_dates
             and not carb_effect_dates
             and not insulin_effect_dates
@@ -594,57 +746,53 @@ def update_predicted_glucose_and_recommended_basal_and_bolus(
         warnings.warn("Warning: expected to receive effect data")
         return (None, None, None)
 
-    predicted_glucoses = predict_glucose(
-        glucose_dates[-1], glucose_values[-1],
-        momentum_dates, momentum_values,
-        carb_effect_dates, carb_effect_values,
-        insulin_effect_dates, insulin_effect_values,
-        retrospective_effect_dates, retrospective_effect_values
-        )
-
-    # Dosing requires prediction entries at least as long as the insulin
-    # model duration. If our prediction is shorter than that, extend it here.
-    if len(model) == 1:  # Walsh model
-        final_date = glucose_dates[-1] + timedelta(hours=model[0])
-    else:
-        final_date = glucose_dates[-1] + timedelta(minutes=model[0])
+    with stage("prediction"):
+        predicted_glucoses = predict_glucose(
+            glucose_dates[-1], glucose_values[-1],
+            momentum_dates, momentum_values,
+            carb_effect_dates, carb_effect_values,
+            insulin_effect_dates, insulin_effect_values,
+            retrospective_effect_dates, retrospective_effect_values
+            )
 
-    if predicted_glucoses[0][-1] < final_date:
-        predicted_glucoses[0].append(final_date)
-        predicted_glucoses[1].append(predicted_glucoses[1][-1])
+        # Dosing requires prediction entries at least as long as the insulin
+        # model duration. If our prediction is shorter than that, extend it
+        # here.
+        final_date = glucose_dates[-1] + timedelta(
+            minutes=model.effect_duration
+            )
 
-    pending_insulin = get_pending_insulin(
-        at_date,
-        basal_starts, basal_rates, basal_minutes,
-        last_temp_basal
-    )
+        if predicted_glucoses[0][-1] < final_date:
+            predicted_glucoses[0].append(final_date)
+            predicted_glucoses[1].append(predicted_glucoses[1][-1])
+        count("predicted_glucose_dates", len(predicted_glucoses[0]))
 
-    temp_basal = recommended_temp_basal(
-        *predicted_glucoses,
-        target_starts, target_ends, target_mins, target_maxes,
-        at_date,
-        suspend_threshold,
-        sensitivity_starts, sensitivity_ends, sensitivity_values,
-        model,
-        basal_starts, basal_rates, basal_minutes,
-        max_basal_rate,
-        last_temp_basal,
-        duration,
-        continuation_interval,
-        rate_rounder
+    with stage("recommendation"):
+        pending_insulin = get_pending_insulin(
+            at_date,
+            basal_starts, basal_rates, basal_minutes,
+            last_temp_basal
         )
 
-    bolus = recommended_bolus(
-        *predicted_glucoses,
-        target_starts, target_ends, target_mins, target_maxes,
-        at_date,
-        suspend_threshold,
-        sensitivity_starts, sensitivity_ends, sensitivity_values,
-        model,
-        pending_insulin,
-        max_bolus,
-        rate_rounder
-        )
+        (temp_basal,
+         bolus
+         ) = recommended_temp_basal_and_bolus(
+             *predicted_glucoses,
+             target_starts, target_ends, target_mins, target_maxes,
+             at_date,
+             suspend_threshold,
+             sensitivity_starts, sensitivity_ends, sensitivity_values,
+             model,
+             basal_starts, basal_rates, basal_minutes,
+             max_basal_rate,
+             last_temp_basal,
+             pending_insulin,
+             max_bolus,
+             duration,
+             continuation_interval,
+             rate_rounder,
+             rate_rounder
+             )[0:2]
 
     return {
         "predicted_glucose_dates": predicted_glucoses[0],
@@ -652,3 +800,396 @@ def update_predicted_glucose_and_recommended_basal_and_bolus(
         "recommended_temp_basal": temp_basal,
         "recommended_bolus": bolus
     }
+
+
+class LoopDataManager:
+    """ Runs the Loop algorithm for one person over time, the way Loop does
+
+        Glucose, dose and carb samples are added as they come in, and each
+        call to update runs the algorithm at a time. The counteraction
+        effects found by a run are kept, so the next run only calculates the
+        ones after them (and only needs the insulin effects from then on),
+        unless samples were added from before them. Samples and
+        counteraction effects older than the 24 hours of history the
+        algorithm uses are dropped.
+    """
+    # the keys of update's input dictionary that hold samples, rather than
+    # settings and schedules
+    SAMPLE_KEYS = [
+        "glucose_dates", "glucose_values",
+        "dose_types", "dose_start_times", "dose_end_times", "dose_values",
+        "carb_dates", "carb_values", "carb_absorption_times",
+        "last_temporary_basal",
+        "time_to_calculate_at",
+        "previous_counteraction_effect_dates",
+        "previous_counteraction_effect_start_times",
+        "previous_counteraction_effect_values"
+    ]
+    HISTORY_INTERVAL = timedelta(hours=24)
+
+    def __init__(self, input_dict):
+        """
+        Arguments:
+        input_dict -- dictionary in the format update takes (or a
+                      LoopInput); the settings and schedules are used for
+                      every run, and any samples are added
+        """
+        if isinstance(input_dict, LoopInput):
+            input_dict = input_dict.to_dict()
+
+        self.settings = {}
+        self.glucose = ([], [])
+        self.doses = ([], [], [], [])
+        self.carbs = ([], [], [])
+        self.last_temporary_basal = input_dict.get("last_temporary_basal")
+        self.counteraction_effects = ([], [], [])
+        # the earliest date samples were added from since the last run
+        self._changed_date = None
+
+        self.update_settings(input_dict)
+        self.add_glucose(
+            input_dict.get("glucose_dates") or [],
+            input_dict.get("glucose_values") or []
+        )
+        self.add_doses(
+            input_dict.get("dose_types") or [],
+            input_dict.get("dose_start_times") or [],
+            input_dict.get("dose_end_times") or [],
+            input_dict.get("dose_values") or []
+        )
+        self.add_carbs(
+            input_dict.get("carb_dates") or [],
+            input_dict.get("carb_values") or [],
+            input_dict.get("carb_absorption_times") or []
+        )
+
+    def update_settings(self, input_dict):
+        """ Replace the settings and schedules; the kept counteraction
+            effects were found with the old ones, so they are dropped
+
+        Arguments:
+        input_dict -- dictionary in the format update takes (samples are
+                      ignored)
+        """
+        self.settings = {
+            key: value for (key, value) in input_dict.items()
+            if key not in self.SAMPLE_KEYS
+        }
+        self.counteraction_effects = ([], [], [])
+
+    def add_glucose(self, dates, values):
+        """ Add glucose samples; samples that were already added are skipped
+
+        Arguments:
+        dates -- times of glucose measurements (datetime)
+        values -- glucose measurements (mg/dL)
+        """
+        assert len(dates) == len(values), "expected input shapes to match"
+
+        for i in range(0, len(dates)):
+            if self._insert(self.glucose, 0, [dates[i], values[i]]):
+                # the counteraction effects over this glucose sample change
+                self._mark_changed(dates[i])
+
+    def add_doses(self, types, starts, ends, values):
+        """ Add insulin doses; doses that were already added are skipped, and
+            a dose with the same type, start time and value as one that was
+            already added replaces it (like a dose that's still being
+            delivered, whose end time changes as it's delivered)
+
+        Arguments:
+        types -- types of dose (tempBasal, bolus, etc)
+        starts -- start times of insulin delivery (datetime)
+        ends -- end times of insulin delivery (datetime)
+        values -- amounts of insulin (U/hr if a basal, U if a bolus)
+        """
+        assert len(types) == len(starts) == len(ends) == len(values),\
+            "expected input shapes to match"
+
+        delay = timedelta(
+            minutes=self.settings.get("settings_dictionary").get(
+                "insulin_delay"
+            ) or 10
+        )
+
+        for i in range(0, len(types)):
+            # a dose can change how the doses before it are reconciled: a
+            # temp basal cuts short the one before it, and a resume ends the
+            # last suspend
+            changed_date = starts[i]
+            if types[i] == DoseType.resume:
+                for j in range(len(self.doses[0]) - 1, -1, -1):
+                    if self.doses[0][j] == DoseType.suspend:
+                        changed_date = min(changed_date, self.doses[1][j])
+                        break
+
+            if self._insert(
+                    self.doses, 1,
+                    [types[i], starts[i], ends[i], values[i]],
+                    key_indexes=[0, 1, 3]):
+                # the insulin effects only change after the insulin delay; a
+                # counteraction effect uses the insulin effect at the next
+                # 5-minute date after it ends
+                self._mark_changed(
+                    changed_date + delay - timedelta(minutes=5)
+                )
+
+    def add_carbs(self, dates, values, absorption_times):
+        """ Add carb entries; entries that were already added are skipped
+
+        Carbs don't change the counteraction effects, so the kept ones are
+        still used.
+
+        Arguments:
+        dates -- times of carbohydrate entries (datetime)
+        values -- amount of carbohydrates eaten (g)
+        absorption_times -- absorption times for the entries (mins)
+        """
+        assert len(dates) == len(values) == len(absorption_times),\
+            "expected input shapes to match"
+
+        for i in range(0, len(dates)):
+            self._insert(
+                self.carbs, 0,
+                [dates[i], values[i], absorption_times[i]]
+            )
+
+    def update(self, time_to_calculate_at, last_temporary_basal=None,
+               instrumentation=None):
+        """ Run the Loop algorithm
+
+        Arguments:
+        time_to_calculate_at -- the "now" time and the time at which to
+                                recommend the basal rate and bolus
+        last_temporary_basal -- information about the last temporary basal
+                                in the format update takes; if None, the
+                                last one given is used
+        instrumentation -- whether and where to record the timing and
+                           counts of the run (see update)
+
+        Output:
+        The output of update (see update)
+        """
+        if last_temporary_basal is not None:
+            self.last_temporary_basal = last_temporary_basal
+
+        self.evict(time_to_calculate_at)
+
+        # drop the counteraction effects the samples added since the last
+        # run change
+        if self._changed_date is not None:
+            keep_count = bisect_left(
+                self.counteraction_effects[1], self._changed_date
+            )
+            for effect_list in self.counteraction_effects:
+                del effect_list[keep_count:]
+            self._changed_date = None
+
+        input_dict = dict(self.settings)
+        input_dict.update({
+            "glucose_dates": list(self.glucose[0]),
+            "glucose_values": list(self.glucose[1]),
+            "dose_types": list(self.doses[0]),
+            "dose_start_times": list(self.doses[1]),
+            "dose_end_times": list(self.doses[2]),
+            "dose_values": list(self.doses[3]),
+            "carb_dates": list(self.carbs[0]),
+            "carb_values": list(self.carbs[1]),
+            "carb_absorption_times": list(self.carbs[2]),
+            "last_temporary_basal": self.last_temporary_basal,
+            "time_to_calculate_at": time_to_calculate_at
+        })
+        if self.counteraction_effects[0]:
+            input_dict.update({
+                "previous_counteraction_effect_start_times":
+                    list(self.counteraction_effects[0]),
+                "previous_counteraction_effect_dates":
+                    list(self.counteraction_effects[1]),
+                "previous_counteraction_effect_values":
+                    list(self.counteraction_effects[2])
+            })
+
+        output = update(input_dict, instrumentation)
+
+        if output:
+            self.counteraction_effects = (
+                list(output.get("counteraction_effect_start_times")),
+                list(output.get("counteraction_effect_end_times")),
+                list(output.get("counteraction_effect_values"))
+            )
+
+        return output
+
+    def evict(self, time_to_calculate_at):
+        """ Drop samples and counteraction effects that are too old to be
+            used by a run at time_to_calculate_at
+
+        Arguments:
+        time_to_calculate_at -- the "now" time of the next run
+        """
+        earliest_date = time_to_calculate_at - self.HISTORY_INTERVAL
+        insulin_model = compile_insulin_model(
+            self.settings.get("settings_dictionary").get("model")
+        )
+        # doses affect the insulin effects for another insulin duration
+        earliest_dose_date = earliest_date - timedelta(
+            minutes=insulin_model.effect_duration
+        )
+
+        self._drop_before(self.glucose, self.glucose[0], earliest_date)
+        self._drop_before(self.doses, self.doses[2], earliest_dose_date)
+        self._drop_before(self.carbs, self.carbs[0], earliest_date)
+        self._drop_before(
+            self.counteraction_effects,
+            self.counteraction_effects[1],
+            earliest_date
+        )
+
+    def _mark_changed(self, date):
+        """ Note that counteraction effects ending at or after date might
+            have changed
+        """
+        if self._changed_date is None or date < self._changed_date:
+            self._changed_date = date
+
+    @staticmethod
+    def _insert(lists, date_index, properties, key_indexes=None):
+        """ Insert an entry into index-matched lists, keeping them in order
+            of the dates in lists[date_index]; if key_indexes is given, an
+            entry with the same properties at those indexes is replaced
+
+        Output:
+        Whether the entry was inserted, rather than already being there
+        """
+        dates = lists[date_index]
+        date = properties[date_index]
+        index = bisect_right(dates, date)
+
+        # entries with the same date come right before where it goes
+        replaced_index = None
+        i = index - 1
+        while i >= 0 and dates[i] == date:
+            entry = [list_[i] for list_ in lists]
+            if entry == properties:
+                return False
+            if (key_indexes is not None and replaced_index is None
+                    and all(entry[j] == properties[j] for j in key_indexes)):
+                replaced_index = i
+            i -= 1
+
+        if replaced_index is not None:
+            for list_ in lists:
+                del list_[replaced_index]
+            index -= 1
+
+        for (list_, property_) in zip(lists, properties):
+            list_.insert(index, property_)
+        return True
+
+    @staticmethod
+    def _drop_before(lists, dates, earliest_date):
+        """ Drop the leading entries of index-matched lists whose dates are
+            before earliest_date
+        """
+        drop_count = 0
+        while drop_count < len(dates) and dates[drop_count] < earliest_date:
+            drop_count += 1
+
+        for list_ in lists:
+            del list_[:drop_count]
+
+
+def replay(input_dict, start_date, end_date, step=5):
+    """ Run the Loop algorithm at every step over a long history, the way
+        Loop would have run over it
+
+        At each step, the samples from before it are given to a
+        LoopDataManager, so every run only uses the last 24 hours of
+        samples, and the counteraction effects found by one run are used
+        by the next. A dose that's still being delivered at a step is given
+        with its end cut at the step's time, so a run doesn't see that a
+        temp basal will be cancelled later; it's given again at each step
+        until it finishes. The last temporary basal keeps the end it was
+        programmed with, like Loop knows it while the temp basal is running.
+
+    Arguments:
+    input_dict -- dictionary in the format update takes, with the samples
+                  for the whole history (which don't need to be in order)
+    start_date -- the time of the first run
+    end_date -- the time the runs can't go past
+    step -- the time between runs (minutes)
+
+    Output:
+    Generator of (time of the run, output of update) tuples; the last
+    temporary basal of each run is the last temp basal dose that started
+    by then (with its programmed end, rather than cut at the time of the run)
+    """
+    if isinstance(input_dict, LoopInput):
+        input_dict = input_dict.to_dict()
+
+    manager = LoopDataManager({
+        key: value for (key, value) in input_dict.items()
+        if key not in LoopDataManager.SAMPLE_KEYS
+    })
+
+    glucose = _sorted_samples(
+        input_dict, ["glucose_dates", "glucose_values"]
+    )
+    doses = _sorted_samples(
+        input_dict,
+        ["dose_types", "dose_start_times", "dose_end_times", "dose_values"],
+        date_index=1
+    )
+    carbs = _sorted_samples(
+        input_dict, ["carb_dates", "carb_values", "carb_absorption_times"]
+    )
+
+    last_temporary_basal = []
+    # the indexes of the doses that were still being delivered at the last
+    # step
+    delivering = []
+    (glucose_count, dose_count, carb_count) = (0, 0, 0)
+    for date in timeline_dates(start_date, end_date, step):
+        glucose_end = bisect_right(glucose[0], date)
+        dose_end = bisect_right(doses[1], date)
+        carb_end = bisect_right(carbs[0], date)
+
+        step_doses = delivering + list(range(dose_count, dose_end))
+        step_ends = [min(doses[2][i], date) for i in step_doses]
+        delivering = [i for i in step_doses if doses[2][i] > date]
+
+        manager.add_glucose(
+            *[list_[glucose_count:glucose_end] for list_ in glucose]
+        )
+        manager.add_doses(
+            [doses[0][i] for i in step_doses],
+            [doses[1][i] for i in step_doses],
+            step_ends,
+            [doses[3][i] for i in step_doses]
+        )
+        manager.add_carbs(
+            *[list_[carb_count:carb_end] for list_ in carbs]
+        )
+
+        for i in range(dose_count, dose_end):
+            if doses[0][i] == DoseType.tempbasal:
+                last_temporary_basal = [list_[i] for list_ in doses]
+
+        (glucose_count, dose_count, carb_count) = (
+            glucose_end, dose_end, carb_end
+        )
+
+        yield (date, manager.update(date, last_temporary_basal))
+
+
+def _sorted_samples(input_dict, keys, date_index=0):
+    """ Get index-matched lists from the input dictionary, sorted by the
+        dates in the list at date_index
+    """
+    lists = [input_dict.get(key) or [] for key in keys]
+    order = sorted(
+        range(0, len(lists[date_index])),
+        key=lambda i: lists[date_index][i]
+    )
+
+    return [[list_[i] for i in order] for list_ in lists]
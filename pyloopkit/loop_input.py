@@ -0,0 +1,230 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Columnar storage for the inputs to a run of the Loop algorithm
+
+A LoopInput holds the same data as the input dictionary update takes, but
+stores each list as a NumPy column: dates as integer timestamps (see
+timestamp_since_reference_date) plus, for dates with a timezone, a column of
+their UTC offsets in seconds, dose types as their DoseType values, and
+schedule times as microseconds since midnight. Columns are checked to have
+matching shapes when the LoopInput is built.
+
+A LoopInput is a compact format to pickle (like update_many does to send
+inputs to its workers) and store; it isn't a faster way to run the
+algorithm. The algorithm works on lists of datetimes, so update converts a
+LoopInput back to the dictionary format (see LoopInput.to_dict), and
+validates it, every time it's run.
+"""
+# pylint: disable=R0902
+from datetime import timedelta, timezone
+import numpy
+
+from pyloopkit.date import (timestamps_since_reference_date,
+                            date_from_timestamp, dates_from_timestamps)
+from pyloopkit.dose import DoseType
+from pyloopkit.schedule import (microseconds_of_day,
+                                time_from_microseconds_of_day)
+
+_DATES = "dates"
+_TIMES = "times"
+_DOSE_TYPES = "dose_types"
+_VALUES = "values"
+
+# (input dictionary key, LoopInput column, kind of column), in groups of
+# columns that must have the same length
+_COLUMN_GROUPS = [
+    [
+        ("glucose_dates", "glucose_timestamps", _DATES),
+        ("glucose_values", "glucose_values", _VALUES),
+    ],
+    [
+        ("dose_types", "dose_type_codes", _DOSE_TYPES),
+        ("dose_start_times", "dose_start_timestamps", _DATES),
+        ("dose_end_times", "dose_end_timestamps", _DATES),
+        ("dose_values", "dose_values", _VALUES),
+    ],
+    [
+        ("carb_dates", "carb_timestamps", _DATES),
+        ("carb_values", "carb_values", _VALUES),
+        ("carb_absorption_times", "carb_absorption_times", _VALUES),
+    ],
+    [
+        ("sensitivity_ratio_start_times", "sensitivity_start_times", _TIMES),
+        ("sensitivity_ratio_end_times", "sensitivity_end_times", _TIMES),
+        ("sensitivity_ratio_values", "sensitivity_values", _VALUES),
+    ],
+    [
+        ("carb_ratio_start_times", "carb_ratio_start_times", _TIMES),
+        ("carb_ratio_values", "carb_ratio_values", _VALUES),
+    ],
+    [
+        ("basal_rate_start_times", "basal_rate_start_times", _TIMES),
+        ("basal_rate_minutes", "basal_rate_minutes", _VALUES),
+        ("basal_rate_values", "basal_rate_values", _VALUES),
+    ],
+    [
+        ("target_range_start_times", "target_range_start_times", _TIMES),
+        ("target_range_end_times", "target_range_end_times", _TIMES),
+        ("target_range_minimum_values", "target_range_minimum_values",
+         _VALUES),
+        ("target_range_maximum_values", "target_range_maximum_values",
+         _VALUES),
+    ],
+]
+
+_COLUMNS = [column for group in _COLUMN_GROUPS for column in group]
+
+# the column of UTC offsets for each column of dates
+_UTC_OFFSET_COLUMNS = {
+    column: column.replace("_timestamps", "_utc_offsets")
+    for (_, column, kind) in _COLUMNS if kind == _DATES
+}
+
+_OTHER_KEYS = [
+    "settings_dictionary", "last_temporary_basal", "time_to_calculate_at"
+]
+
+
+class LoopInput:
+    """ The inputs to update, stored as NumPy columns
+
+        Columns that were missing from the input dictionary are None, as
+        are the UTC offsets of dates without a timezone. Dates come back
+        from to_dict with their own UTC offsets (as fixed-offset timezones),
+        so the wall-clock times of dates on either side of a daylight saving
+        change stay the same, and values (including carb absorption times,
+        where a missing time is stored as NaN) as floats.
+    """
+    __slots__ = (
+        [column for (_, column, _) in _COLUMNS]
+        + list(_UTC_OFFSET_COLUMNS.values())
+        + [
+            "settings", "last_temporary_basal", "time_to_calculate_at",
+            "extras"
+        ]
+    )
+
+    def __init__(self, input_dict):
+        """
+        Arguments:
+        input_dict -- dictionary in the format update takes; keys that
+                      aren't stored as columns (units, counteraction effects
+                      from a previous run, etc) are kept as-is in extras
+        """
+        for group in _COLUMN_GROUPS:
+            lengths = {
+                len(input_dict.get(key)) for (key, _, _) in group
+                if input_dict.get(key) is not None
+            }
+            assert len(lengths) <= 1, "expected input shapes to match"
+
+        self.settings = input_dict.get("settings_dictionary")
+        self.last_temporary_basal = input_dict.get("last_temporary_basal")
+        self.time_to_calculate_at = input_dict.get("time_to_calculate_at")
+        self.extras = {
+            key: value for (key, value) in input_dict.items()
+            if key not in _OTHER_KEYS
+            and key not in [key for (key, _, _) in _COLUMNS]
+        }
+
+        for (key, column, kind) in _COLUMNS:
+            setattr(self, column, _to_column(input_dict.get(key), kind))
+            if kind == _DATES:
+                setattr(
+                    self, _UTC_OFFSET_COLUMNS[column],
+                    _utc_offsets(input_dict.get(key))
+                )
+
+    def to_dict(self):
+        """ Convert the columns back to the dictionary format update takes
+
+        Output:
+        A new dictionary with new lists, so it can be changed without
+        changing the LoopInput
+        """
+        input_dict = dict(self.extras)
+
+        for (key, column, kind) in _COLUMNS:
+            values = getattr(self, column)
+            if values is None:
+                continue
+            if kind == _DATES:
+                input_dict[key] = _dates(
+                    values, getattr(self, _UTC_OFFSET_COLUMNS[column])
+                )
+            else:
+                input_dict[key] = _from_column(values, kind)
+
+        input_dict["settings_dictionary"] = (
+            dict(self.settings) if self.settings is not None else None
+        )
+        input_dict["last_temporary_basal"] = (
+            list(self.last_temporary_basal)
+            if self.last_temporary_basal is not None else None
+        )
+        input_dict["time_to_calculate_at"] = self.time_to_calculate_at
+
+        return input_dict
+
+
+def _utc_offsets(dates):
+    """ The UTC offsets (seconds) of a list of dates, or None if the dates
+        don't have a timezone
+    """
+    if not dates or dates[0].tzinfo is None:
+        return None
+
+    return numpy.array(
+        [date.utcoffset() // timedelta(seconds=1) for date in dates],
+        dtype=numpy.int32
+    )
+
+
+def _dates(timestamps, utc_offsets):
+    """ Convert timestamps back to dates, each in a timezone with its UTC
+        offset (or without a timezone, if utc_offsets is None)
+    """
+    if utc_offsets is None:
+        return dates_from_timestamps(timestamps)
+
+    timezones = {
+        offset: timezone(timedelta(seconds=offset))
+        for offset in set(utc_offsets.tolist())
+    }
+    return [
+        date_from_timestamp(timestamp, timezones[offset])
+        for (timestamp, offset) in zip(
+            timestamps.tolist(), utc_offsets.tolist()
+        )
+    ]
+
+
+def _to_column(values, kind):
+    if values is None:
+        return None
+    if kind == _DATES:
+        return timestamps_since_reference_date(values)
+    if kind == _TIMES:
+        return numpy.array(
+            [microseconds_of_day(value) for value in values],
+            dtype=numpy.int64
+        )
+    if kind == _DOSE_TYPES:
+        return numpy.array(
+            [dose_type.value for dose_type in values], dtype=numpy.int8
+        )
+
+    return numpy.array(
+        [numpy.nan if value is None else value for value in values],
+        dtype=numpy.float64
+    )
+
+
+def _from_column(values, kind):
+    if kind == _TIMES:
+        return [time_from_microseconds_of_day(value) for value in values]
+    if kind == _DOSE_TYPES:
+        return [DoseType(int(code)) for code in values]
+
+    return [None if numpy.isnan(value) else value for value in values.tolist()]
@@ -10,15 +10,18 @@ Github URL: https://github.com/tidepool-org/LoopKit/blob/
 """
 # pylint: disable=R0913, R0914, C0200, R0912, R0915, W0102, C0103
 # disable pylint errors for too many arguments/variables
+from bisect import bisect_left
 from datetime import timedelta
 import numpy
 from backports.datetime_fromisoformat import MonkeyPatch
 MonkeyPatch.patch_fromisoformat()
 
+from pyloopkit import instrumentation
 from pyloopkit.date import (date_floored_to_time_interval,
                   date_ceiled_to_time_interval, time_interval_since)
 
 
+@instrumentation.traced
 def predict_glucose(
         starting_date, starting_glucose,
         momentum_dates=[], momentum_values=None,
@@ -79,6 +82,18 @@ def predict_glucose(
        ):
         return ([], [])
 
+    # effects are normally all on the same 5 minute grid, which lets the
+    # timelines be merged with array operations
+    grid_prediction = predict_glucose_on_grid(
+        starting_date, starting_glucose,
+        momentum_dates, momentum_values,
+        carb_effect_dates, carb_effect_values,
+        insulin_effect_dates, insulin_effect_values,
+        correction_effect_dates, correction_effect_values
+        )
+    if grid_prediction is not None:
+        return grid_prediction
+
     merged_dates = sorted(
         list(
             dict.fromkeys(
@@ -89,6 +104,8 @@ def predict_glucose(
             )
         )
     )
+    # look up where each effect date falls in the merged timeline
+    merged_indexes = {date: i for (i, date) in enumerate(merged_dates)}
 
     merged_values = [0 for i in merged_dates]
 
@@ -98,7 +115,7 @@ def predict_glucose(
                        len(carb_effect_dates)
                        ):
             value = carb_effect_values[i]
-            list_index = merged_dates.index(carb_effect_dates[i])
+            list_index = merged_indexes[carb_effect_dates[i]]
             merged_values[list_index] = (
                 value
                 - previous_effect_value
@@ -112,7 +129,7 @@ def predict_glucose(
                        len(insulin_effect_dates)
                        ):
             value = insulin_effect_values[i]
-            list_index = merged_dates.index(insulin_effect_dates[i])
+            list_index = merged_indexes[insulin_effect_dates[i]]
             merged_values[list_index] = (
                 merged_values[list_index]
                 + value
@@ -127,7 +144,7 @@ def predict_glucose(
                        len(correction_effect_dates)
                        ):
             value = correction_effect_values[i]
-            list_index = merged_dates.index(correction_effect_dates[i])
+            list_index = merged_indexes[correction_effect_dates[i]]
             merged_values[list_index] = (
                 merged_values[list_index]
                 + value
@@ -164,7 +181,7 @@ def predict_glucose(
         for i in range(0, len(momentum_dates)):
             value = momentum_values[i]
             date = momentum_dates[i]
-            merge_index = merged_dates.index(date)
+            merge_index = merged_indexes[date]
 
             effect_value_change = value - previous_effect_value
 
@@ -205,6 +222,143 @@ def predict_glucose(
     return (predicted_dates, predicted_values)
 
 
+def predict_glucose_on_grid(
+        starting_date, starting_glucose,
+        momentum_dates, momentum_values,
+        carb_effect_dates, carb_effect_values,
+        insulin_effect_dates, insulin_effect_values,
+        correction_effect_dates, correction_effect_values,
+        delta=5
+        ):
+    """ Calculates the same timeline of predicted glucose values as
+        predict_glucose, using array operations, for effect timelines whose
+        dates are all on one shared grid
+
+    Arguments:
+    starting_date -- time of starting_glucose (datetime object)
+    starting_glucose -- glucose value to use in predictions
+
+    momentum_dates -- times of calculated momentums (datetime)
+    momentum_values -- values (mg/dL) of momentums
+
+    carb_effect_dates -- times of carb effects (datetime)
+    carb_effect -- values (mg/dL) of effects from carbs
+
+    insulin_effect_dates -- times of insulin effects (datetime)
+    insulin_effect -- values (mg/dL) of effects from insulin
+
+    correction_effect_dates -- times of retrospective effects (datetime)
+    correction_effect -- values (mg/dL) retrospective glucose effects
+
+    delta -- the spacing of the grid (mins)
+
+    Output:
+    Glucose predictions in form (prediction_times, prediction_glucose_values),
+    or None if the effect dates aren't on a shared grid (or a timeline isn't
+    strictly ascending)
+    """
+    effect_timelines = [
+        (dates, values) for (dates, values) in [
+            (carb_effect_dates, carb_effect_values),
+            (insulin_effect_dates, insulin_effect_values),
+            (correction_effect_dates, correction_effect_values)
+        ] if dates
+    ]
+    # momentum dates are part of the timeline, but blended in separately
+    timelines = effect_timelines + (
+        [(momentum_dates, momentum_values)] if momentum_dates else []
+    )
+    if not timelines:
+        return None
+
+    # find each date's position on the grid
+    origin = min(dates[0] for (dates, _) in timelines)
+    timeline_indexes = []
+    for (dates, _) in timelines:
+        positions = numpy.array([
+            time_interval_since(date, origin) for date in dates
+        ]) / (delta * 60)
+        indexes = numpy.rint(positions).astype(int)
+
+        if (numpy.any(numpy.abs(positions - indexes) > 1e-6)
+                or numpy.any(indexes < 0)
+                or numpy.any(numpy.diff(indexes) <= 0)):
+            return None
+        timeline_indexes.append(indexes)
+
+    grid_length = max(indexes[-1] for indexes in timeline_indexes) + 1
+    grid_dates = [None] * grid_length
+    merged_values = numpy.zeros(grid_length)
+
+    for ((dates, _), indexes) in zip(timelines, timeline_indexes):
+        for (index, date) in zip(indexes.tolist(), dates):
+            grid_dates[index] = date
+
+    for ((_, values), indexes) in zip(effect_timelines, timeline_indexes):
+        # each effect contributes its change since the previous date
+        changes = numpy.diff(
+            numpy.asarray(values, dtype=float),
+            prepend=values[0] or 0
+            )
+        merged_values[indexes] += changes
+
+    # Blend the momentum effect linearly into the summed effect list
+    if len(momentum_dates) > 1:
+        indexes = timeline_indexes[-1]
+        values = numpy.asarray(momentum_values, dtype=float)
+        changes = numpy.diff(values, prepend=values[0])
+
+        # The blend begins delta minutes after after the last glucose (1.0)
+        # and ends at the last momentum point (0.0)
+        # This assumes the first one occurs on/before the starting glucose
+        blend_count = len(momentum_dates) - 2
+        time_delta = time_interval_since(
+            momentum_dates[1],
+            momentum_dates[0]
+            )
+        # The difference between the first momentum value
+        # and the starting glucose value
+        momentum_offset = time_interval_since(
+            starting_date,
+            momentum_dates[0]
+            )
+
+        blend_slope = 1 / blend_count
+        blend_offset = (momentum_offset
+                        / time_delta
+                        * blend_slope
+                        )
+
+        split = numpy.clip(
+            (len(momentum_dates) - numpy.arange(len(momentum_dates)))
+            / blend_count
+            - blend_slope
+            + blend_offset,
+            0,
+            1
+            )
+        merged_values[indexes] = (
+            (1 - split) * merged_values[indexes] + split * changes
+        )
+
+    predicted_dates = [starting_date]
+    predicted_indexes = []
+    for (index, date) in enumerate(grid_dates):
+        if date is not None and date > starting_date:
+            predicted_dates.append(date)
+            predicted_indexes.append(index)
+
+    predicted_values = numpy.cumsum(
+        numpy.concatenate(
+            ([starting_glucose], merged_values[predicted_indexes])
+        )
+    ).tolist()
+
+    assert len(predicted_dates) == len(predicted_values),\
+        "expected output shapes to match"
+    return (predicted_dates, predicted_values)
+
+
 def decay_effect(
         glucose_date, glucose_value,
         rate,
@@ -432,6 +586,78 @@ def subtracting(starts, ends, values,
     return (subtracted_starts, subtracted_values)
 
 
+def windowed_sums(
+        dates, window_starts, settled_dates, contribution, count_name=None
+        ):
+    """ Sums the contributions of a collection of entries (doses or carb
+        entries) at each date of a timeline, where an entry contributes
+        nothing before its window starts and a constant amount from the date
+        its contribution settles
+
+        Only the dates inside each entry's window are evaluated; the constant
+        an entry settles at is evaluated once and carried forward as a
+        running total. The cost scales with the total length of the windows,
+        rather than the number of entries times the number of dates.
+
+        The settled constants are added to the running total in order of the
+        date each one settles at, so the sum at a date is the same no matter
+        which date the timeline starts at.
+
+    Arguments:
+    dates -- sorted list of the dates of the timeline
+    window_starts -- list of the first date each entry can contribute at
+    settled_dates -- list of the dates each entry's contribution stops
+                     changing from, or None if it never does
+    contribution -- function taking the index of an entry and a date, and
+                    returning the entry's contribution at that date
+    count_name -- if given, the number of times contribution is called is
+                  added to this count of the active Instrumentation
+
+    Output:
+    List of the summed contributions at each date
+    """
+    assert len(window_starts) == len(settled_dates),\
+        "expected input shapes to match"
+
+    sums = [0] * len(dates)
+    # the entries that settle by the last date, as (date the entry settles
+    # at, index of the entry, index of the first date it's settled at)
+    settled_entries = []
+    evaluation_count = 0
+
+    for i in range(0, len(window_starts)):
+        first = bisect_left(dates, window_starts[i])
+        last = (
+            len(dates) if settled_dates[i] is None
+            else max(first, bisect_left(dates, settled_dates[i]))
+        )
+
+        for j in range(first, min(last, len(dates))):
+            sums[j] += contribution(i, dates[j])
+        evaluation_count += max(0, min(last, len(dates)) - first)
+
+        if last < len(dates):
+            settled_entries.append(
+                (max(window_starts[i], settled_dates[i]), i, last)
+            )
+
+    settled_entries.sort()
+    settled_total = 0
+    k = 0
+    for j in range(0, len(dates)):
+        while k < len(settled_entries) and settled_entries[k][2] <= j:
+            (_, i, last) = settled_entries[k]
+            settled_total += contribution(i, dates[last])
+            evaluation_count += 1
+            k += 1
+        sums[j] += settled_total
+
+    if count_name is not None:
+        instrumentation.count(count_name, evaluation_count)
+
+    return sums
+
+
 def filter_date_range(
         starts, ends, values,
         start_date,
@@ -494,7 +720,9 @@ def sort_dose_lists(list_1, list_2, list_3=None, list_4=None, list_5=None):
     unsort_4 = numpy.array(list_4)
     unsort_5 = numpy.array(list_5)
 
-    sort_indexes = unsort_2.argsort()
+    # a stable sort keeps doses that start at the same time in order, so
+    # adding a later dose doesn't change how the earlier ones are summed
+    sort_indexes = unsort_2.argsort(kind="stable")
 
     l1 = list(unsort_1[sort_indexes])
     unsort_2.sort()
@@ -6,19 +6,154 @@ Created on Fri Jul 12 13:35:43 2019
 @author: annaquinlan
 """
 # pylint: disable=C0200, C0103, R0912, R0913, R0914, R0915
+from concurrent.futures import ProcessPoolExecutor
+import glob
 import json
 import os
+import re
 import warnings
 
-from datetime import datetime, time, timedelta
+from datetime import datetime, time, timedelta, timezone
 import numpy
 
 from pyloopkit.dose import DoseType
 from pyloopkit.loop_data_manager import update
 from pyloopkit.loop_math import sort_dose_lists
+from pyloopkit.snapshot import load_snapshot
+
+# orjson is optional; if it's installed, issue reports are loaded with it,
+# which is several times faster than the json module
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# the sections of an issue report that are used to run it
+REPORT_KEYS = [
+    "basalProfileApplyingOverrideHistory_items",
+    "basal_rate_schedule",
+    "basal_rate_timeZone",
+    "cached_carb_entries",
+    "cached_dose_entries",
+    "cached_glucose_samples",
+    "carbRatioScheduleApplyingOverrideHistory_items",
+    "carb_default_absorption_times_fast",
+    "carb_default_absorption_times_medium",
+    "carb_default_absorption_times_slow",
+    "carb_ratio_schedule",
+    "carb_ratio_timeZone",
+    "correction_range_schedule",
+    "get_normalized_dose_entries",
+    "get_normalized_pump_event_dose",
+    "glucose_store",
+    "insulin_action_duration",
+    "insulin_model",
+    "insulin_sensitivity_factor_schedule",
+    "insulin_sensitivity_factor_timeZone",
+    "insulinSensitivityScheduleApplyingOverrideHistory_items",
+    "last_temp_basal",
+    "maximum_basal_rate",
+    "maximum_bolus",
+    "recommended_bolus",
+    "recommended_temp_basal",
+    "retrospective_correction_enabled",
+    "suspend_threshold"
+]
+
+
+# %% Load an issue report
+def load_report(data_path_and_name, keys=REPORT_KEYS):
+    """ Load the sections of an issue report that are used to run it
+
+        The report is parsed with orjson if it's installed (otherwise, or
+        if orjson rejects it, like reports with NaN values, with the json
+        module). The whole report is parsed, and only the sections in keys
+        are kept in the dictionary that's returned.
+
+    Arguments:
+    data_path_and_name -- the path to the issue report, including the name
+                          of the file with the .json extension
+    keys -- the top-level keys of the sections to keep (None keeps all of
+            them)
+
+    Output:
+    Dictionary of the issue report's sections
+    """
+    with open(data_path_and_name, "rb") as file:
+        contents = file.read()
+
+    report = None
+    if orjson is not None:
+        try:
+            report = orjson.loads(contents)
+        except orjson.JSONDecodeError:
+            pass
+
+    if report is None:
+        report = json.loads(contents)
+
+    if keys is None:
+        return report
+
+    return {key: report[key] for key in keys if key in report}
 
 
 # %% Functions to get various data from an issue report
+def parse_dates(date_strings, offset=0):
+    """ Parse a list of issue report dates, which are in
+        "%Y-%m-%d %H:%M:%S %z" format (possibly with leading spaces)
+
+        The dates are parsed all at once with NumPy, which gives the same
+        datetimes as datetime.strptime much faster.
+
+    Arguments:
+    date_strings -- list of date strings
+    offset -- the offset from UTC in seconds, added to every date
+
+    Output:
+    List of timezone-aware datetime objects
+    """
+    if not date_strings:
+        return []
+
+    strings = numpy.char.strip(numpy.array(date_strings, dtype=str))
+    timezones = [string[19:] for string in strings.tolist()]
+    local_dates = (
+        strings.astype("U19").astype("datetime64[us]")
+        + numpy.timedelta64(int(offset * 1000000), "us")
+    )
+
+    tzinfos = {}
+    dates = []
+    for (date, timezone_string) in zip(local_dates.astype(object), timezones):
+        tzinfo = tzinfos.get(timezone_string)
+        if tzinfo is None:
+            tzinfo = _parse_utc_offset(timezone_string)
+            tzinfos[timezone_string] = tzinfo
+        dates.append(date.replace(tzinfo=tzinfo))
+
+    return dates
+
+
+def parse_date(date_string, offset=0):
+    """ Parse one issue report date (see parse_dates) """
+    return parse_dates([date_string], offset)[0]
+
+
+def _parse_utc_offset(timezone_string):
+    """ Convert a " +HHMM" or " -HHMM" UTC offset to a timezone """
+    match = re.fullmatch(r" ([+-])(\d{2})(\d{2})", timezone_string)
+    if match is None:
+        raise ValueError(
+            "time data does not match format '%Y-%m-%d %H:%M:%S %z'"
+        )
+
+    utc_offset = timedelta(
+        hours=int(match.group(2)), minutes=int(match.group(3))
+    )
+    return timezone(-utc_offset if match.group(1) == "-" else utc_offset)
+
+
 def get_glucose_data(glucose_dict, offset=0):
     """ Load glucose values from an issue report cached_glucose dictionary
 
@@ -29,13 +164,10 @@ def get_glucose_data(glucose_dict, offset=0):
     Output:
     2 lists in (date, glucose_value) format
     """
-    dates = [
-        datetime.strptime(
-            dict_.get("startDate"),
-            "%Y-%m-%d %H:%M:%S %z"
-        ) + timedelta(seconds=offset)
-        for dict_ in glucose_dict
-    ]
+    dates = parse_dates(
+        [dict_.get("startDate") for dict_ in glucose_dict],
+        offset
+    )
 
     glucose_values = [float(dict_.get("quantity")) for dict_ in glucose_dict]
 
@@ -86,20 +218,14 @@ def get_insulin_data(
             dict_.get("type")
         ) for dict_ in data
     ]
-    start_dates = [
-        datetime.strptime(
-            dict_.get("startDate"),
-            "%Y-%m-%d %H:%M:%S %z"
-        ) + timedelta(seconds=offset)
-        for dict_ in data
-    ]
-    end_dates = [
-        datetime.strptime(
-            dict_.get("endDate"),
-            "%Y-%m-%d %H:%M:%S %z"
-        ) + timedelta(seconds=offset)
-        for dict_ in data
-    ]
+    start_dates = parse_dates(
+        [dict_.get("startDate") for dict_ in data],
+        offset
+    )
+    end_dates = parse_dates(
+        [dict_.get("endDate") for dict_ in data],
+        offset
+    )
     values = []
     for i in range(0, len(data)):
         if 'deliveredUnits' in data[i].keys() and data[i].get("deliveredUnits") != 'nil':
@@ -115,14 +241,14 @@ def get_insulin_data(
             )
 
     if entry_to_add and now_time:
-        start = datetime.strptime(
+        start = parse_date(
             entry_to_add.get("startDate"),
-            "%Y-%m-%d %H:%M:%S %z"
-        ) + timedelta(seconds=offset)
-        dose_end = datetime.strptime(
+            offset
+        )
+        dose_end = parse_date(
             entry_to_add.get("endDate"),
-            "%Y-%m-%d %H:%M:%S %z"
-        ) + timedelta(seconds=offset)
+            offset
+        )
 
         # if this entry is truly a new entry, convert to the appropriate units
         # and add to the output
@@ -166,13 +292,10 @@ def get_carb_data(data, offset=0):
     format
     """
     carb_values = [float(dict_.get("quantity")) for dict_ in data]
-    start_dates = [
-        datetime.strptime(
-            dict_.get("startDate"),
-            " %Y-%m-%d %H:%M:%S %z"
-        ) + timedelta(seconds=offset)
-        for dict_ in data
-    ]
+    start_dates = parse_dates(
+        [dict_.get("startDate") for dict_ in data],
+        offset
+    )
     absorption_times = [
         float(dict_.get("absorptionTime")) / 60
         if dict_.get("absorptionTime") is not None
@@ -296,13 +419,10 @@ def get_target_range_schedule(data):
 
 def load_momentum_effects(data, offset=0):
     """ Load glucose momentum effects from a list """
-    start_times = [
-        datetime.strptime(
-            dict_.get("startDate"),
-            "%Y-%m-%d %H:%M:%S %z"
-        ) + timedelta(seconds=offset)
-        for dict_ in data
-    ]
+    start_times = parse_dates(
+        [dict_.get("startDate") for dict_ in data],
+        offset
+    )
     values = [
         float(dict_.get("quantity")) for dict_ in data
     ]
@@ -311,20 +431,14 @@ def load_momentum_effects(data, offset=0):
 
 def get_counteractions(data, offset=0):
     """ Load counteraction effect data from a list """
-    start_times = [
-        datetime.strptime(
-            dict_.get("start_time"),
-            "%Y-%m-%d %H:%M:%S %z"
-        ) + timedelta(seconds=offset)
-        for dict_ in data
-    ]
-    end_times = [
-        datetime.strptime(
-            dict_.get("end_time"),
-            " %Y-%m-%d %H:%M:%S %z"
-        ) + timedelta(seconds=offset)
-        for dict_ in data
-    ]
+    start_times = parse_dates(
+        [dict_.get("start_time") for dict_ in data],
+        offset
+    )
+    end_times = parse_dates(
+        [dict_.get("end_time") for dict_ in data],
+        offset
+    )
     values = [
         float(dict_.get("value")) for dict_ in data
     ]
@@ -333,13 +447,10 @@ def get_counteractions(data, offset=0):
 
 def load_insulin_effects(data, offset=0):
     """ Load insulin effect data from a list """
-    start_times = [
-        datetime.strptime(
-            dict_.get("start_time"),
-            "%Y-%m-%d %H:%M:%S %z"
-        ) + timedelta(seconds=offset)
-        for dict_ in data
-    ]
+    start_times = parse_dates(
+        [dict_.get("start_time") for dict_ in data],
+        offset
+    )
     values = [
         float(dict_.get("value")) for dict_ in data
     ]
@@ -348,13 +459,10 @@ def load_insulin_effects(data, offset=0):
 
 def get_retrospective_effects(data, offset=0):
     """ Load retrospective effect data from a list """
-    start_times = [
-        datetime.strptime(
-            dict_.get("startDate"),
-            "%Y-%m-%d %H:%M:%S %z"
-        ) + timedelta(seconds=offset)
-        for dict_ in data
-    ]
+    start_times = parse_dates(
+        [dict_.get("startDate") for dict_ in data],
+        offset
+    )
     values = [
         float(dict_.get("quantity")) for dict_ in data
     ]
@@ -448,16 +556,16 @@ def get_last_temp_basal(data, offset=0):
 
     return [
         type_,
-        datetime.strptime(
+        parse_date(
             data.get(" startDate") if data.get(" startDate") is not None
             else data.get("startDate"),
-            "%Y-%m-%d %H:%M:%S %z"
-        ) + timedelta(seconds=offset),
-        datetime.strptime(
+            offset
+        ),
+        parse_date(
             data.get(" endDate") if data.get(" endDate") is not None
             else data.get("endDate"),
-            "%Y-%m-%d %H:%M:%S %z"
-        ) + timedelta(seconds=offset),
+            offset
+        ),
         float(data.get(" value")) if data.get(" value") is not None
         else float(data.get("value"))
     ]
@@ -554,16 +662,28 @@ def parse_report_and_run_with_name(data_path_and_name):
         run PyLoopKit
 
     Arguments:
-    path -- the path to the issue report
-    name -- the name of the file, with the .json extension
+    data_path_and_name -- the path to the issue report, including the name
+                          of the file with the .json extension
 
     Output:
     A dictionary of all 4 effects, the predicted glucose values, and the
     recommended basal and bolus
     """
+    return update(parse_report(data_path_and_name))
 
-    with open(data_path_and_name, "r") as file:
-        issue_dict = json.load(file)
+
+def parse_report(data_path_and_name):
+    """ Get relevent information from a Loop issue report, in the format
+        update takes (which can be stored as a LoopInput)
+
+    Arguments:
+    data_path_and_name -- the path to the issue report, including the name
+                          of the file with the .json extension
+
+    Output:
+    Input dictionary for update
+    """
+    issue_dict = load_report(data_path_and_name)
     input_dict = {}
 
     if issue_dict.get("basal_rate_timeZone") is not None:
@@ -577,17 +697,17 @@ def parse_report_and_run_with_name(data_path_and_name):
     input_dict["offset_applied_to_dates"] = offset
 
     if issue_dict.get("recommended_temp_basal"):
-        time_to_run = datetime.strptime(
+        time_to_run = parse_date(
             issue_dict.get("recommended_temp_basal").get("date")
             or issue_dict.get("recommended_temp_basal").get(" date"),
-            "%Y-%m-%d %H:%M:%S %z"
-        ) + timedelta(seconds=offset)
+            offset
+        )
     elif issue_dict.get("recommended_bolus"):
-        time_to_run = datetime.strptime(
+        time_to_run = parse_date(
             issue_dict.get("recommended_bolus").get("date") or
             issue_dict.get("recommended_bolus").get(" date"),
-            "%Y-%m-%d %H:%M:%S %z"
-        ) + timedelta(seconds=offset)
+            offset
+        )
     else:
         raise RuntimeError("No information found about report time")
 
@@ -831,11 +951,116 @@ def parse_report_and_run_with_name(data_path_and_name):
 
     input_dict["last_temporary_basal"] = last_temp_basal
 
-    recommendations = update(
-        input_dict
+    return input_dict
+
+
+def convert_times_and_types(obj):
+    """ Convert dates and dose types into strings when saving as a json """
+    if isinstance(obj, (datetime, time)):
+        return obj.isoformat()
+    if isinstance(obj, DoseType):
+        return str(obj.name)
+    if isinstance(obj, numpy.generic):
+        return obj.item()
+
+    raise TypeError(repr(obj) + " is not JSON serializable")
+
+
+def find_report_paths(path_or_pattern):
+    """ Find the issue reports in a directory, or matching a glob pattern
+
+    Arguments:
+    path_or_pattern -- a directory (every .json file in it is used) or a
+                       glob pattern like "reports/*/*.json"
+
+    Output:
+    Sorted list of the paths to the issue reports
+    """
+    if os.path.isdir(path_or_pattern):
+        path_or_pattern = os.path.join(path_or_pattern, "*.json")
+
+    return sorted(glob.glob(path_or_pattern))
+
+
+def parse_reports_and_run(
+        path_or_pattern, output_path, workers=None, chunksize=1):
+    """ Run many issue reports in a pool of worker processes, writing the
+        output for each one as a line of a JSON Lines file
+
+        A report that can't be parsed or run (like one without glucose
+        information) doesn't stop the others; its error is written instead
+        of its output, and listed in the summary.
+
+    Arguments:
+    path_or_pattern -- a directory of issue reports or a glob pattern
+                       (see find_report_paths)
+    output_path -- the path of the JSON Lines file to write; each line has
+                   the "report" path and either the "output" of the run or
+                   the "error" it raised
+    workers -- the number of worker processes; if 0, the reports are run
+               in this process (None uses one worker per CPU)
+    chunksize -- the number of reports sent to a worker at a time
+
+    Output:
+    Summary dictionary with the number of reports ("report_count"), the
+    number that raised errors ("error_count"), and the error for each of
+    those reports ("errors")
+    """
+    paths = find_report_paths(path_or_pattern)
+
+    if workers == 0:
+        lines = map(_run_report_to_json_line, paths)
+        summary = _write_report_lines(paths, lines, output_path)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            lines = executor.map(
+                _run_report_to_json_line, paths, chunksize=chunksize
+            )
+            summary = _write_report_lines(paths, lines, output_path)
+
+    return summary
+
+
+def _run_report_to_json_line(data_path_and_name):
+    """ Run an issue report, serializing its output (or the error it
+        raised) in the worker, so only a string is sent back
+
+    Output:
+    (JSON line, error message or None) tuple
+    """
+    try:
+        output = parse_report_and_run_with_name(data_path_and_name)
+        return (
+            json.dumps(
+                {"report": data_path_and_name, "output": output},
+                default=convert_times_and_types
+            ),
+            None
+        )
+    except Exception as exception:  # pylint: disable=W0703
+        error = type(exception).__name__ + ": " + str(exception)
+        return (
+            json.dumps({"report": data_path_and_name, "error": error}),
+            error
         )
 
-    return recommendations
+
+def _write_report_lines(paths, lines, output_path):
+    """ Write the JSON lines of the reports, in order, and summarize the
+        errors
+    """
+    errors = {}
+    with open(output_path, "w") as file:
+        for (path, (line, error)) in zip(paths, lines):
+            file.write(line + "\n")
+            if error is not None:
+                errors[path] = error
+
+    return {
+        "report_count": len(paths),
+        "error_count": len(errors),
+        "errors": errors
+    }
 
 
 def parse_dictionary_from_previous_run(path, name):
@@ -843,6 +1068,18 @@ def parse_dictionary_from_previous_run(path, name):
         and convert the ISO strings to datetime or time objects, and
         dose types to enums
     """
+    return update(load_dictionary_from_previous_run(path, name))
+
+
+def parse_snapshot_and_run(path, name):
+    """ Run the input dictionary saved in a snapshot (see snapshot.py) """
+    return update(load_snapshot(os.path.join(path, name)))
+
+
+def load_dictionary_from_previous_run(path, name):
+    """ Load the input dictionary of a previous run of PyLoopKit, converting
+        the ISO strings to datetime or time objects, and dose types to enums
+    """
     data_path_and_name = os.path.join(path, name)
 
     with open(data_path_and_name, "r") as file:
@@ -892,6 +1129,4 @@ def parse_dictionary_from_previous_run(path, name):
         DoseType.from_str(value) for value in dictionary.get("dose_types")
     ]
 
-    output = update(dictionary)
-
-    return output
+    return dictionary
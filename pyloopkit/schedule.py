@@ -0,0 +1,172 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Daily schedules (insulin sensitivities, carb ratios, basal rates and
+correction ranges) compiled for fast lookups
+
+A schedule is given as lists of start times, end times (optional) and values,
+in the same format find_ratio_at_time takes. Compiling it splits the day into
+the stretches where the value doesn't change, so a lookup is a table access
+or a binary search instead of a scan of every entry.
+"""
+from bisect import bisect_right
+from datetime import datetime, time
+from functools import lru_cache
+import numpy
+
+MICROSECONDS_PER_DAY = 24 * 60 * 60 * 1000000
+
+
+class Schedule:
+    """ A compiled daily schedule
+
+        Lookups match find_ratio_at_time: an entry covers its start and end
+        times inclusively, entries that end before they start continue past
+        midnight, the first matching entry wins, and times no entry covers
+        have a value of 0.
+    """
+    # the day is divided into 288 five-minute slots; slots where the value
+    # doesn't change are answered directly from a table
+    SLOT_COUNT = 288
+    SLOT_LENGTH = MICROSECONDS_PER_DAY // SLOT_COUNT
+
+    def __init__(self, start_times, end_times, values):
+        """
+        Arguments:
+        start_times -- list of time objects of start times of the values
+        end_times -- list of time objects of end times of the values; if
+                     empty, each value lasts until the next start time
+        values -- list of schedule values
+        """
+        assert len(start_times) == len(values),\
+            "expected input shapes to match"
+
+        starts = [microseconds_of_day(start) for start in start_times]
+        if end_times:
+            ends = [microseconds_of_day(end) for end in end_times]
+        else:
+            ends = [
+                starts[i + 1] if i + 1 < len(starts) else starts[0]
+                for i in range(0, len(starts))
+            ]
+        self.values = list(values)
+
+        def value_covering(moment):
+            for i in range(0, len(starts)):
+                if _is_between(starts[i], ends[i], moment):
+                    return self.values[i]
+            return 0
+
+        # the value can only change where an entry starts, or just after
+        # one ends
+        breakpoints = sorted(
+            {0}
+            | set(starts)
+            | {end + 1 for end in ends if end + 1 < MICROSECONDS_PER_DAY}
+        )
+        self.breakpoints = breakpoints
+        self.segment_values = [value_covering(point) for point in breakpoints]
+
+        self.slot_values = []
+        for slot in range(0, self.SLOT_COUNT):
+            slot_start = slot * self.SLOT_LENGTH
+            first = bisect_right(breakpoints, slot_start) - 1
+            last = bisect_right(
+                breakpoints, slot_start + self.SLOT_LENGTH - 1
+            ) - 1
+            self.slot_values.append(
+                self.segment_values[first] if first == last else None
+            )
+
+        self._breakpoint_array = numpy.array(breakpoints, dtype=numpy.int64)
+        self._segment_array = numpy.array(self.segment_values)
+
+    def value_at(self, time_to_check):
+        """ Finds the schedule value at a given time
+
+        Arguments:
+        time_to_check -- finding the value at this (date)time
+
+        Output:
+        Value at time_to_check
+        """
+        moment = microseconds_of_day(time_to_check)
+        value = self.slot_values[moment // self.SLOT_LENGTH]
+        if value is not None:
+            return value
+
+        return self.segment_values[bisect_right(self.breakpoints, moment) - 1]
+
+    def values_at(self, times_to_check):
+        """ Finds the schedule values at each of a list of times
+
+        Arguments:
+        times_to_check -- list of (date)times to find the values at
+
+        Output:
+        numpy array with the value at each time
+        """
+        moments = numpy.array(
+            [microseconds_of_day(moment) for moment in times_to_check],
+            dtype=numpy.int64
+        )
+        indexes = numpy.searchsorted(
+            self._breakpoint_array, moments, side="right"
+        ) - 1
+
+        return self._segment_array[indexes]
+
+
+def compiled_schedule(start_times, end_times, values):
+    """ Get the compiled Schedule for lists of start times, end times and
+        values
+
+        Schedules are cached by their contents, so settings that don't change
+        between calls are only compiled once.
+
+    Arguments:
+    start_times -- list of time objects of start times of the values
+    end_times -- list of time objects of end times of the values (or an
+                 empty list)
+    values -- list of schedule values
+
+    Output:
+    Schedule object
+    """
+    return _compiled_schedule(
+        tuple(start_times), tuple(end_times or ()), tuple(values)
+    )
+
+
+@lru_cache(maxsize=32)
+def _compiled_schedule(start_times, end_times, values):
+    return Schedule(start_times, end_times, values)
+
+
+def microseconds_of_day(time_to_convert):
+    """ Convert a time (or the time of day of a datetime) to the number of
+        microseconds since midnight
+    """
+    if isinstance(time_to_convert, datetime):
+        time_to_convert = time_to_convert.time()
+    assert isinstance(time_to_convert, time), "expected a time or datetime"
+
+    return ((time_to_convert.hour * 60 + time_to_convert.minute) * 60
+            + time_to_convert.second) * 1000000 + time_to_convert.microsecond
+
+
+def _is_between(start, end, moment):
+    """ is_time_between, on microseconds since midnight """
+    if start < end:
+        return start <= moment <= end
+    # if it crosses midnight
+    return moment >= start or moment <= end
+
+
+def time_from_microseconds_of_day(microseconds):
+    """ Convert a number of microseconds since midnight back to a time """
+    (seconds, microsecond) = divmod(int(microseconds), 1000000)
+    (minutes, second) = divmod(seconds, 60)
+    (hour, minute) = divmod(minutes, 60)
+
+    return time(hour, minute, second, microsecond)
@@ -0,0 +1,324 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Binary snapshots of the inputs and outputs of update
+
+A snapshot is an uncompressed .npz file. Lists of dates, times, dose types
+and numbers are stored as NumPy columns:
+- aware dates as int64 timestamps (see timestamp_since_reference_date) plus
+  their UTC offsets in seconds
+- naive dates as int64 timestamps
+- times as int64 microseconds since midnight
+- dose types as int8 DoseType values
+- numbers as int64 or float64 arrays (with an int8 array marking the ints
+  in lists that mix ints and floats)
+
+The columns are packed into one array per dtype, so a snapshot only has a
+few entries however many lists it holds. Everything else (settings,
+recommendations, etc) is kept in a UTF-8 JSON "metadata" entry, which also
+records where each column is in the packed arrays. Loading a snapshot gives
+back a dictionary equal to the one that was saved. Because the file is
+uncompressed, load_snapshot_columns can memory-map the packed arrays, and
+every column is a view of them.
+"""
+from datetime import datetime, time, timedelta, timezone
+import json
+import zipfile
+import numpy
+
+from pyloopkit.date import timestamp_since_reference_date, REF_TIME
+from pyloopkit.dose import DoseType
+from pyloopkit.loop_input import LoopInput
+from pyloopkit.schedule import (microseconds_of_day,
+                                time_from_microseconds_of_day)
+
+METADATA_KEY = "metadata"
+
+
+def save_snapshot(path, dictionary):
+    """ Save a dictionary (an input dictionary, a LoopInput, or the output
+        of update) as a snapshot
+
+    Arguments:
+    path -- the path of the .npz file to write
+    dictionary -- the dictionary to save
+    """
+    if isinstance(dictionary, LoopInput):
+        dictionary = dictionary.to_dict()
+
+    columns = {}
+    value = _encode(dictionary, "", columns)
+
+    # pack the columns into one array per dtype
+    packed_columns = {}
+    layout = {}
+    for (name, column) in columns.items():
+        dtype_columns = packed_columns.setdefault(column.dtype.name, [])
+        start = sum(len(dtype_column) for dtype_column in dtype_columns)
+        layout[name] = [column.dtype.name, start, start + len(column)]
+        dtype_columns.append(column)
+
+    arrays = {
+        dtype_name: numpy.concatenate(dtype_columns)
+        for (dtype_name, dtype_columns) in packed_columns.items()
+    }
+    arrays[METADATA_KEY] = numpy.frombuffer(
+        json.dumps({"layout": layout, "value": value}).encode("utf-8"),
+        dtype=numpy.uint8
+    )
+
+    with open(path, "wb") as file:
+        numpy.savez(file, **arrays)
+
+
+def load_snapshot(path, mmap_mode=None):
+    """ Load a snapshot as the dictionary that was saved
+
+    Arguments:
+    path -- the path of the .npz file
+    mmap_mode -- if "r", the columns are memory-mapped while they're
+                 converted back to lists
+
+    Output:
+    The saved dictionary
+    """
+    columns = load_snapshot_columns(path, mmap_mode)
+    metadata = json.loads(columns[METADATA_KEY].tobytes().decode("utf-8"))
+
+    return _decode(metadata.get("value"), columns)
+
+
+def load_snapshot_columns(path, mmap_mode="r"):
+    """ Load the NumPy columns of a snapshot, without converting them
+
+    Arguments:
+    path -- the path of the .npz file
+    mmap_mode -- "r" to memory-map the columns (without copying them into
+                 memory), or None to read them
+
+    Output:
+    Dictionary of column name to array (views of the packed arrays); dates
+    are under "<key>/timestamps" (and "<key>/utc_offsets" if they're
+    aware), and the JSON metadata is under "metadata"
+    """
+    arrays = (
+        _read_arrays(path) if mmap_mode is None
+        else _memory_map_arrays(path, mmap_mode)
+    )
+    metadata = json.loads(arrays[METADATA_KEY].tobytes().decode("utf-8"))
+
+    columns = {
+        name: arrays[dtype_name][start:end]
+        for (name, (dtype_name, start, end)) in metadata["layout"].items()
+    }
+    columns[METADATA_KEY] = arrays[METADATA_KEY]
+
+    return columns
+
+
+def _read_arrays(path):
+    with numpy.load(path) as npz_file:
+        return {key: npz_file[key] for key in npz_file.files}
+
+
+def _memory_map_arrays(path, mmap_mode):
+    arrays = {}
+    with open(path, "rb") as file, zipfile.ZipFile(file) as zip_file:
+        for info in zip_file.infolist():
+            assert info.compress_type == zipfile.ZIP_STORED,\
+                "expected an uncompressed snapshot"
+
+            # the member's data starts after its local file header
+            file.seek(info.header_offset + 26)
+            (name_length, extra_length) = numpy.frombuffer(
+                file.read(4), dtype="<u2"
+            )
+            file.seek(info.header_offset + 30 + name_length + extra_length)
+
+            version = numpy.lib.format.read_magic(file)
+            (shape, fortran_order, dtype) = (
+                numpy.lib.format.read_array_header_1_0(file)
+                if version == (1, 0)
+                else numpy.lib.format.read_array_header_2_0(file)
+            )
+            arrays[info.filename[:-len(".npy")]] = numpy.memmap(
+                path, dtype=dtype, mode=mmap_mode, offset=file.tell(),
+                shape=shape, order="F" if fortran_order else "C"
+            )
+
+    return arrays
+
+
+def _encode(value, name, columns):
+    """ Convert a value to JSON-compatible metadata, moving the lists that
+        can be stored as columns into columns
+    """
+    if isinstance(value, dict):
+        return {
+            key: _encode(item, name + "/" + key if name else key, columns)
+            for (key, item) in value.items()
+        }
+
+    if isinstance(value, list):
+        kind = _column_kind(value)
+        if kind is None:
+            return [
+                _encode(item, name + "/" + str(i), columns)
+                for (i, item) in enumerate(value)
+            ]
+        _to_columns(value, kind, name, columns)
+        return {"__column__": name, "kind": kind}
+
+    if isinstance(value, tuple):
+        return {"__tuple__": _encode(list(value), name, columns)}
+    if isinstance(value, datetime):
+        return {"__datetime__": value.isoformat()}
+    if isinstance(value, time):
+        return {"__time__": value.isoformat()}
+    if isinstance(value, DoseType):
+        return {"__dose_type__": value.value}
+    if isinstance(value, numpy.generic):
+        return value.item()
+
+    return value
+
+
+def _decode(value, columns):
+    """ Convert metadata back to the saved value """
+    if isinstance(value, list):
+        return [_decode(item, columns) for item in value]
+    if not isinstance(value, dict):
+        return value
+
+    if "__column__" in value:
+        return _from_columns(value["kind"], value["__column__"], columns)
+    if "__tuple__" in value:
+        return tuple(_decode(value["__tuple__"], columns))
+    if "__datetime__" in value:
+        return datetime.fromisoformat(value["__datetime__"])
+    if "__time__" in value:
+        return time.fromisoformat(value["__time__"])
+    if "__dose_type__" in value:
+        return DoseType(value["__dose_type__"])
+
+    return {key: _decode(item, columns) for (key, item) in value.items()}
+
+
+def _column_kind(values):
+    """ The kind of column a list can be stored as, or None """
+    if not values:
+        return None
+
+    if all(isinstance(value, datetime) for value in values):
+        if all(value.tzinfo is None for value in values):
+            return "naive_dates"
+        if all(
+                value.utcoffset() is not None
+                and value.utcoffset() % timedelta(seconds=1) == timedelta(0)
+                for value in values):
+            return "dates"
+        return None
+    if all(isinstance(value, time) for value in values):
+        if all(value.tzinfo is None for value in values):
+            return "times"
+        return None
+    if all(isinstance(value, DoseType) for value in values):
+        return "dose_types"
+    if all(
+            isinstance(value, int) and not isinstance(value, bool)
+            for value in values):
+        return "ints"
+    if all(isinstance(value, float) for value in values):
+        return "floats"
+    if all(
+            isinstance(value, float)
+            or (isinstance(value, int) and not isinstance(value, bool)
+                and abs(value) <= 2 ** 53)
+            for value in values):
+        return "numbers"
+
+    return None
+
+
+def _to_columns(values, kind, name, columns):
+    if kind in ["dates", "naive_dates"]:
+        columns[name + "/timestamps"] = numpy.array(
+            [timestamp_since_reference_date(value) for value in values],
+            dtype=numpy.int64
+        )
+        if kind == "dates":
+            columns[name + "/utc_offsets"] = numpy.array(
+                [value.utcoffset() // timedelta(seconds=1)
+                 for value in values],
+                dtype=numpy.int32
+            )
+    elif kind == "times":
+        columns[name] = numpy.array(
+            [microseconds_of_day(value) for value in values],
+            dtype=numpy.int64
+        )
+    elif kind == "dose_types":
+        columns[name] = numpy.array(
+            [value.value for value in values], dtype=numpy.int8
+        )
+    elif kind == "ints":
+        columns[name] = numpy.array(values, dtype=numpy.int64)
+    elif kind == "numbers":
+        # ints and floats mixed together, like effects starting at 0
+        columns[name] = numpy.array(values, dtype=numpy.float64)
+        columns[name + "/is_int"] = numpy.array(
+            [isinstance(value, int) for value in values], dtype=numpy.int8
+        )
+    else:
+        columns[name] = numpy.array(values, dtype=numpy.float64)
+
+
+def _from_columns(kind, name, columns):
+    if kind in ["dates", "naive_dates"]:
+        timestamps = columns[name + "/timestamps"]
+        if kind == "naive_dates":
+            return list(map(REF_TIME.__add__, _timedeltas(timestamps)))
+
+        # dates are built by adding to the reference date in their timezone
+        offsets = columns[name + "/utc_offsets"]
+        local_timestamps = timestamps + offsets.astype(numpy.int64) * 1000000
+        reference_dates = {
+            offset: datetime(2001, 1, 1, tzinfo=timezone(
+                timedelta(seconds=offset)
+            ))
+            for offset in set(offsets.tolist())
+        }
+        if len(reference_dates) == 1:
+            (reference_date,) = reference_dates.values()
+            return list(
+                map(reference_date.__add__, _timedeltas(local_timestamps))
+            )
+
+        return [
+            reference_dates[offset] + delta for (offset, delta) in zip(
+                offsets.tolist(), _timedeltas(local_timestamps)
+            )
+        ]
+
+    if kind == "times":
+        return [
+            time_from_microseconds_of_day(value)
+            for value in columns[name].tolist()
+        ]
+    if kind == "dose_types":
+        return [DoseType(value) for value in columns[name].tolist()]
+    if kind == "numbers":
+        return [
+            int(value) if is_int else value for (value, is_int) in zip(
+                columns[name].tolist(), columns[name + "/is_int"].tolist()
+            )
+        ]
+
+    return columns[name].tolist()
+
+
+def _timedeltas(timestamps):
+    """ Convert an array of microseconds to a list of timedeltas """
+    return numpy.asarray(timestamps).astype("timedelta64[us]").astype(
+        object
+    ).tolist()
@@ -19,7 +19,7 @@ setup(
     long_description=long_description,
     long_description_content_type="text/markdown",
     url="https://github.com/tidepool-org/PyLoopKit",
-    packages=find_packages(),
+    packages=find_packages(exclude=["benchmarks", "benchmarks.*", "tests"]),
     classifiers=[
         'Development Status :: 3 - Alpha',
         'Intended Audience :: Developers',
@@ -31,5 +31,9 @@ setup(
           'numpy==1.16.4',
           'backports-datetime-fromisoformat==1.0.0',
       ],
+    extras_require={
+          'fast-json': ['orjson'],
+          'plots': ['matplotlib'],
+      },
     python_requires='>=3.6',
 )
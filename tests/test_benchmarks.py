@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the benchmarks package
+"""
+# pylint: disable=C0111, R0201, R0904, W0105
+import json
+import os
+import shutil
+import tempfile
+import unittest
+import warnings
+
+from benchmarks.run_benchmarks import (
+    compare_results, time_call, example_report_paths, trace_input)
+from benchmarks.stages import loop_stages, STAGE_NAMES
+from benchmarks.synthetic_data import synthetic_input, scaled_synthetic_input
+from pyloopkit.input_validation_tools import is_loop_input_valid
+from pyloopkit.loop_data_manager import update
+from pyloopkit.pyloop_parser import parse_report
+
+
+class TestBenchmarkFunctions(unittest.TestCase):
+    """ unittest class to run benchmark tests. """
+    def test_loop_stages_match_update(self):
+        path = example_report_paths()[2]
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            input_dict = parse_report(path)
+            expected = update(input_dict)
+            stages = dict(loop_stages(input_dict, path))
+
+            self.assertEqual(STAGE_NAMES, list(stages.keys()))
+            self.assertEqual(input_dict, stages["parse"]())
+            self.assertEqual(
+                expected.get("momentum_effect_values"),
+                stages["momentum"]()[1]
+            )
+            self.assertEqual(
+                expected.get("counteraction_effect_values"),
+                stages["counteraction"]()[2]
+            )
+            self.assertEqual(
+                expected.get("predicted_glucose_values")[:-1],
+                stages["prediction"]()[1][:-1]
+            )
+            self.assertEqual(
+                expected.get("recommended_temp_basal"),
+                stages["recommendation"]()[0]
+            )
+
+    def test_synthetic_input(self):
+        self.assertEqual(synthetic_input(seed=3), synthetic_input(seed=3))
+        self.assertNotEqual(synthetic_input(seed=3), synthetic_input(seed=4))
+
+        for size in [1, 50, 2000]:
+            with warnings.catch_warnings(record=True) as caught:
+                warnings.simplefilter("always")
+                input_dict = scaled_synthetic_input(size)
+                self.assertTrue(is_loop_input_valid(input_dict))
+            self.assertEqual([], caught)
+
+            self.assertEqual(max(2, size), len(input_dict["glucose_dates"]))
+            self.assertEqual(
+                size + max(1, size // 4), len(input_dict["dose_types"])
+            )
+            self.assertEqual(
+                sorted(input_dict["dose_start_times"]),
+                input_dict["dose_start_times"]
+            )
+
+        output = update(synthetic_input(seed=1))
+        self.assertTrue(output.get("predicted_glucose_values"))
+
+    def test_trace_input(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        path = os.path.join(directory, "trace.json")
+
+        tracer = trace_input(path, report_path=example_report_paths()[0])
+        with open(path) as file:
+            trace = json.load(file)
+
+        events = trace["traceEvents"]
+        self.assertEqual(len(tracer.spans), len(events))
+        self.assertEqual(
+            ["parse_report", "total"], [event["name"] for event in events[:2]]
+        )
+        self.assertEqual(
+            {"X"}, {event["ph"] for event in events}
+        )
+        self.assertEqual(
+            sorted(event["ts"] for event in events),
+            [event["ts"] for event in events]
+        )
+
+    def test_time_call(self):
+        timing = time_call(lambda: sum(range(100)), repeat=3, min_time=0)
+        self.assertEqual(1, timing.get("number"))
+        self.assertTrue(timing.get("min") <= timing.get("median")
+                        <= timing.get("max"))
+
+    def test_compare_results(self):
+        baseline = {"benchmarks": {
+            "a": {"min": 1.0}, "b": {"min": 2.0}, "c": {"min": 1.0}
+        }}
+        results = {"benchmarks": {
+            "a": {"min": 1.1}, "b": {"min": 3.0}, "c": {"min": 2.0},
+            "new": {"min": 5.0}
+        }}
+
+        # the worst regression comes first
+        self.assertEqual(
+            [("c", 1.0, 2.0, 2.0), ("b", 2.0, 3.0, 1.5)],
+            compare_results(baseline, results, 0.2)
+        )
+        self.assertEqual(
+            [("c", 1.0, 2.0, 2.0)], compare_results(baseline, results, 0.6)
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
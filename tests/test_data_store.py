@@ -10,7 +10,9 @@ from datetime import datetime, time, timedelta
 import unittest
 
 #from . import path_grabber  # pylint: disable=unused-import
-from pyloopkit.carb_store import get_carb_glucose_effects, get_carbs_on_board
+from pyloopkit.carb_store import (
+    get_carb_glucose_effects, get_carbs_on_board,
+    get_carb_glucose_effects_and_carbs_on_board)
 from pyloopkit.dose_store import get_glucose_effects
 from pyloopkit.dose import DoseType
 from pyloopkit.glucose_store import (
@@ -429,6 +431,49 @@ class TestDataStoreFunctions(unittest.TestCase):
                 expected_values[i], effect_values[i], delta=3
             )
 
+    def test_glucose_effects_history_start(self):
+        # the second temp basal cuts the first one short
+        now_date = datetime(2016, 2, 15, 17, 0)
+        doses = (
+            [DoseType.tempbasal, DoseType.tempbasal, DoseType.bolus],
+            [datetime(2016, 2, 15, 10, 0), datetime(2016, 2, 15, 10, 30),
+             datetime(2016, 2, 15, 16, 0)],
+            [datetime(2016, 2, 15, 12, 0), datetime(2016, 2, 15, 10, 45),
+             datetime(2016, 2, 15, 16, 0)],
+            [2.0, 0.5, 1.5]
+        )
+        history_start = now_date - timedelta(hours=8)
+        for engine in ["iterative", "vectorized", "convolution"]:
+            (expected_dates,
+             expected_values
+             ) = get_glucose_effects(
+                 *doses,
+                 history_start,
+                 *self.load_scheduled_basals("basal_schedule"),
+                 *self.load_sensitivities("insulin_sensitivity_schedule"),
+                 [360, 75],
+                 engine=engine
+                 )
+
+            # the doses are prepared from history_start, so the effects are
+            # the same as the ones from then on
+            (effect_dates,
+             effect_values
+             ) = get_glucose_effects(
+                 *doses,
+                 now_date,
+                 *self.load_scheduled_basals("basal_schedule"),
+                 *self.load_sensitivities("insulin_sensitivity_schedule"),
+                 [360, 75],
+                 engine=engine,
+                 history_start=history_start
+                 )
+
+            offset = expected_dates.index(now_date)
+            self.assertTrue(effect_dates)
+            self.assertEqual(expected_dates[offset:], effect_dates)
+            self.assertEqual(expected_values[offset:], effect_values)
+
     """ Tests for get_recent_momentum_effects """
     def test_momentum_bouncing_glucose(self):
         glucose_data = self.load_glucose_data(
@@ -924,6 +969,58 @@ class TestDataStoreFunctions(unittest.TestCase):
                 expected_values[i], effect_values[i], 2
             )
 
+    def test_carb_glucose_effects_and_carbs_on_board(self):
+        input_ice = self.load_glucose_velocities("ice_35_min_input")
+        carb_data = self.load_carb_data("carb_entry_input")
+        end_date = datetime.fromisoformat("2015-10-16T06:00:00")
+
+        for (effect_date, cob_date) in [
+                (input_ice[0][0], datetime.fromisoformat("2015-10-15T21:35:00")),
+                # only the COB timeline fetches the earliest carb entry
+                (datetime.fromisoformat("2015-10-16T05:40:00"),
+                 datetime.fromisoformat("2015-10-16T05:40:00"))
+        ]:
+            settings = (
+                *self.load_carb_ratios(),
+                self.INSULIN_SENSITIVITY_START_DATES,
+                self.INSULIN_SENSITIVITY_END_DATES,
+                self.INSULIN_SENSITIVITY_VALUES,
+                self.DEFAULT_ABSORPTION_TIMES
+            )
+            (effects,
+             cob_data
+             ) = get_carb_glucose_effects_and_carbs_on_board(
+                 *carb_data,
+                 effect_date,
+                 cob_date,
+                 *input_ice,
+                 *settings,
+                 absorption_time_overrun=2,
+                 end_date=end_date
+                 )
+
+            expected_effects = get_carb_glucose_effects(
+                *carb_data,
+                effect_date,
+                *input_ice,
+                *settings,
+                absorption_time_overrun=2,
+                end_date=end_date
+                )
+            expected_cob_data = get_carbs_on_board(
+                *carb_data,
+                cob_date,
+                *input_ice,
+                *settings,
+                absorption_time_overrun=2,
+                end_date=end_date
+                )
+
+            self.assertTrue(effects[0])
+            self.assertTrue(cob_data[0])
+            self.assertEqual(expected_effects, effects)
+            self.assertEqual(expected_cob_data, cob_data)
+
     def test_dynamic_cob_edge_cases(self):
         input_ice = self.load_glucose_velocities("ice_slow_absorption")
 
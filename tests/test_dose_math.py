@@ -14,7 +14,9 @@ from datetime import time, datetime, timedelta
 
 #from . import path_grabber  # pylint: disable=unused-import
 from .loop_kit_tests import load_fixture
-from pyloopkit.dose_math import recommended_temp_basal, recommended_bolus
+from pyloopkit.dose_math import (
+    recommended_temp_basal, recommended_bolus,
+    recommended_temp_basal_and_bolus, Correction)
 from pyloopkit.dose import DoseType
 
 
@@ -711,6 +713,117 @@ class TestDoseMathFunctions(unittest.TestCase):
             )
         self.assertEqual(0, dose[0])
 
+    def test_recommended_temp_basal_and_bolus(self):
+        for name in [
+                "recommend_temp_basal_start_low_end_high",
+                "recommend_temp_basal_flat_and_high",
+                "recommend_temp_basal_high_and_falling",
+                "recommend_temp_basal_start_very_low_end_high"
+        ]:
+            glucose = self.load_glucose_value_fixture(name)
+            arguments = (
+                *glucose,
+                *self.TARGET_RANGE,
+                glucose[0][0],
+                self.SUSPEND_THRESHOLD,
+                *self.SENSITIVITY,
+                self.WALSH_MODEL
+            )
+
+            (temp_basal,
+             bolus,
+             correction
+             ) = recommended_temp_basal_and_bolus(
+                 *arguments,
+                 *self.basal_rate_schedule(),
+                 self.MAX_BASAL_RATE,
+                 None,
+                 1,
+                 self.MAX_BOLUS,
+                 rate_rounder=0.025,
+                 volume_rounder=0.025
+             )
+
+            self.assertIn(correction[0], list(Correction))
+            self.assertEqual(
+                recommended_temp_basal(
+                    *arguments,
+                    *self.basal_rate_schedule(),
+                    self.MAX_BASAL_RATE,
+                    None,
+                    rate_rounder=0.025
+                ),
+                temp_basal
+            )
+            self.assertEqual(
+                recommended_bolus(
+                    *arguments,
+                    1,
+                    self.MAX_BOLUS,
+                    0.025
+                ),
+                bolus
+            )
+
+    def test_given_correction(self):
+        glucose = self.load_glucose_value_fixture(
+            "recommend_temp_basal_flat_and_high"
+        )
+        arguments = (
+            *glucose,
+            *self.TARGET_RANGE,
+            glucose[0][0],
+            self.SUSPEND_THRESHOLD,
+            *self.SENSITIVITY,
+            self.WALSH_MODEL
+        )
+        # the given correction is used instead of the prediction's
+        correction = [Correction.suspend, 50]
+
+        temp_basal = recommended_temp_basal(
+            *arguments,
+            *self.basal_rate_schedule(),
+            self.MAX_BASAL_RATE,
+            None,
+            rate_rounder=0.025,
+            correction=correction
+        )
+        self.assertEqual([0, 30], temp_basal)
+
+        bolus = recommended_bolus(
+            *arguments,
+            0,
+            self.MAX_BOLUS,
+            0.025,
+            correction=correction
+        )
+        self.assertEqual(0, bolus[0])
+        self.assertEqual(
+            ["glucoseBelowSuspendThreshold", 50], bolus[2]
+        )
+
+    def test_no_input_glucose_temp_basal_and_bolus(self):
+        (temp_basal,
+         bolus,
+         correction
+         ) = recommended_temp_basal_and_bolus(
+             [], [],
+             *self.TARGET_RANGE,
+             datetime.now(),
+             self.SUSPEND_THRESHOLD,
+             *self.SENSITIVITY,
+             self.WALSH_MODEL,
+             *self.basal_rate_schedule(),
+             self.MAX_BASAL_RATE,
+             None,
+             0,
+             self.MAX_BOLUS
+         )
+
+        self.assertIsNone(temp_basal)
+        self.assertEqual(0, bolus[0])
+        self.assertIsNone(correction)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the headless graph rendering in generate_graphs.py
+"""
+# pylint: disable=C0111, R0201, R0904, W0105
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import unittest
+import numpy
+
+from pyloopkit.generate_graphs import (
+    loop_inspired_glucose_graph_arguments,
+    plot_loop_inspired_glucose_graph,
+    render_loop_inspired_glucose_graphs)
+from pyloopkit.pyloop_parser import parse_report_and_run
+from .loop_kit_tests import find_root_path
+
+try:
+    import matplotlib
+except ImportError:
+    matplotlib = None
+
+
+class TestGenerateGraphsFunctions(unittest.TestCase):
+    """ unittest class to run graph rendering tests. """
+    REPORT_NAMES = ["utc_issue_report", "timezoned_issue_report"]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+        self.outputs = [
+            parse_report_and_run(
+                find_root_path(name, ".json") + "/", name + ".json"
+            )
+            for name in self.REPORT_NAMES
+        ]
+
+    def test_import_without_matplotlib(self):
+        loaded = subprocess.check_output([
+            sys.executable, "-c",
+            "import sys, pyloopkit.generate_graphs; "
+            + "print(any(name.startswith('matplotlib') "
+            + "for name in sys.modules))"
+        ])
+        self.assertEqual("False", loaded.decode().strip())
+
+    def test_loop_inspired_glucose_graph_arguments(self):
+        output = self.outputs[0]
+        arguments = loop_inspired_glucose_graph_arguments(
+            output, "graph", previous_glucose_count=5
+        )
+
+        self.assertEqual(
+            output.get("predicted_glucose_values"),
+            arguments.get("overall_values")
+        )
+        self.assertEqual(
+            output.get("input_data").get("glucose_values")[-5:],
+            arguments.get("previous_glucose_values")
+        )
+        self.assertEqual("graph", arguments.get("file_name"))
+
+    @unittest.skipIf(matplotlib is None, "matplotlib isn't installed")
+    def test_render_loop_inspired_glucose_graphs(self):
+        matplotlib.use("Agg")
+        import matplotlib.pyplot as plt  # pylint: disable=C0415
+        from matplotlib.image import imread  # pylint: disable=C0415
+
+        graphs = [
+            loop_inspired_glucose_graph_arguments(
+                output, os.path.join(self.directory, "batch_" + str(i))
+            )
+            for (i, output) in enumerate(self.outputs)
+        ]
+        # a graph that can't be drawn shouldn't stop the others
+        graphs.insert(1, {"file_name": os.path.join(self.directory, "bad")})
+
+        paths = list(render_loop_inspired_glucose_graphs(graphs, workers=0))
+        self.assertEqual(3, len(paths))
+        self.assertIsInstance(paths[1], Exception)
+
+        # drawing on the reused figure gives the same image as a new figure
+        for (graph, path) in zip(
+                [graphs[0], graphs[2]], [paths[0], paths[2]]):
+            arguments = dict(graph)
+            arguments["file_name"] += "_plotted"
+            plot_loop_inspired_glucose_graph(**arguments)
+            plt.close("all")
+
+            self.assertTrue(numpy.array_equal(
+                imread(path), imread(arguments["file_name"] + ".png")
+            ))
+
+
+if __name__ == '__main__':
+    unittest.main()
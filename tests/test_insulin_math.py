@@ -20,7 +20,8 @@ from pyloopkit.dose import DoseType
 from pyloopkit.exponential_insulin_model import percent_effect_remaining
 from pyloopkit.insulin_math import (dose_entries, is_continuous, insulin_on_board,
                           glucose_effects, annotated, reconciled,
-                          total_delivery, trim, overlay_basal_schedule)
+                          total_delivery, trim, overlay_basal_schedule,
+                          gridded_delivery, convolved_delivery)
 from .loop_kit_tests import load_fixture
 
 
@@ -1217,6 +1218,244 @@ class TestInsulinKitFunctions(unittest.TestCase):
             0, len(effect_dates)
         )
 
+    def test_vectorized_glucose_effect_matches_iterative(self):
+        doses = self.load_dose_fixture("normalized_doses")
+
+        for model in [self.MODEL, self.WALSH_MODEL]:
+            (expected_dates,
+             expected_effect_values
+             ) = glucose_effects(
+                 *doses,
+                 model,
+                 self.MULTIPLE_INSULIN_SENSITIVITY_START_DATES,
+                 self.MULTIPLE_INSULIN_SENSITIVITY_END_DATES,
+                 self.MULTIPLE_INSULIN_SENSITIVITY_VALUES
+                 )
+
+            (effect_dates,
+             effect_values
+             ) = glucose_effects(
+                 *doses,
+                 model,
+                 self.MULTIPLE_INSULIN_SENSITIVITY_START_DATES,
+                 self.MULTIPLE_INSULIN_SENSITIVITY_END_DATES,
+                 self.MULTIPLE_INSULIN_SENSITIVITY_VALUES,
+                 engine="vectorized"
+                 )
+
+            self.assertEqual(expected_dates, effect_dates)
+            for i in range(0, len(expected_effect_values)):
+                self.assertAlmostEqual(
+                    expected_effect_values[i], effect_values[i], 8
+                )
+
+    def test_vectorized_glucose_effect_from_bolus(self):
+        (i_types,
+         i_start_dates,
+         i_end_dates,
+         i_values,
+         i_scheduled_basal_rates
+         ) = self.load_dose_fixture("bolus_dose")
+
+        (expected_dates,
+         expected_effect_values
+         ) = self.load_glucose_effect_fixture(
+             "effect_from_bolus_output_exponential"
+             )
+
+        (effect_dates,
+         effect_values
+         ) = glucose_effects(
+             i_types,
+             i_start_dates,
+             i_end_dates,
+             i_values,
+             i_scheduled_basal_rates,
+             self.MODEL,
+             self.INSULIN_SENSITIVITY_START_DATES,
+             self.INSULIN_SENSITIVITY_END_DATES,
+             self.INSULIN_SENSITIVITY_VALUES,
+             engine="vectorized"
+             )
+
+        self.assertEqual(
+            len(expected_dates), len(effect_dates)
+        )
+
+        for i in range(0, len(expected_dates)):
+            self.assertEqual(
+                expected_dates[i], effect_dates[i]
+            )
+            self.assertAlmostEqual(
+                expected_effect_values[i], effect_values[i], 0
+            )
+
+    def test_closed_form_glucose_effect_matches_segments(self):
+        (i_types,
+         i_start_dates,
+         i_end_dates,
+         i_values,
+         i_scheduled_basal_rates
+         ) = self.load_dose_fixture("normalized_doses")
+
+        for model in [self.MODEL, self.WALSH_MODEL]:
+            (expected_dates,
+             expected_effect_values
+             ) = glucose_effects(
+                 i_types,
+                 i_start_dates,
+                 i_end_dates,
+                 i_values,
+                 i_scheduled_basal_rates,
+                 model,
+                 self.MULTIPLE_INSULIN_SENSITIVITY_START_DATES,
+                 self.MULTIPLE_INSULIN_SENSITIVITY_END_DATES,
+                 self.MULTIPLE_INSULIN_SENSITIVITY_VALUES
+                 )
+
+            (effect_dates,
+             effect_values
+             ) = glucose_effects(
+                 i_types,
+                 i_start_dates,
+                 i_end_dates,
+                 i_values,
+                 i_scheduled_basal_rates,
+                 model,
+                 self.MULTIPLE_INSULIN_SENSITIVITY_START_DATES,
+                 self.MULTIPLE_INSULIN_SENSITIVITY_END_DATES,
+                 self.MULTIPLE_INSULIN_SENSITIVITY_VALUES,
+                 closed_form=True
+                 )
+
+            self.assertEqual(expected_dates, effect_dates)
+
+            for i in range(0, len(expected_dates)):
+                self.assertAlmostEqual(
+                    expected_effect_values[i], effect_values[i], 8
+                )
+
+    def test_closed_form_iob_matches_segments(self):
+        (i_types,
+         i_start_dates,
+         i_end_dates,
+         i_values,
+         i_scheduled_basal_rates
+         ) = self.load_dose_fixture("normalized_doses")
+
+        for model in [self.MODEL, self.WALSH_MODEL]:
+            (expected_dates,
+             expected_insulin_values
+             ) = insulin_on_board(
+                 i_types,
+                 i_start_dates,
+                 i_end_dates,
+                 i_values,
+                 i_scheduled_basal_rates,
+                 model
+                 )
+
+            (dates,
+             insulin_values
+             ) = insulin_on_board(
+                 i_types,
+                 i_start_dates,
+                 i_end_dates,
+                 i_values,
+                 i_scheduled_basal_rates,
+                 model,
+                 closed_form=True
+                 )
+
+            self.assertEqual(expected_dates, dates)
+
+            for i in range(0, len(expected_dates)):
+                self.assertAlmostEqual(
+                    expected_insulin_values[i], insulin_values[i], 8
+                )
+
+    def test_convolved_glucose_effect_matches_iterative(self):
+        for (resource_name, start_dates, end_dates, values) in [
+                ("normalized_doses",
+                 self.MULTIPLE_INSULIN_SENSITIVITY_START_DATES,
+                 self.MULTIPLE_INSULIN_SENSITIVITY_END_DATES,
+                 self.MULTIPLE_INSULIN_SENSITIVITY_VALUES),
+                ("basal_dose",
+                 self.INSULIN_SENSITIVITY_START_DATES,
+                 self.INSULIN_SENSITIVITY_END_DATES,
+                 self.INSULIN_SENSITIVITY_VALUES)]:
+            doses = self.load_dose_fixture(resource_name)
+
+            for model in [self.MODEL, self.WALSH_MODEL]:
+                (expected_dates,
+                 expected_effect_values
+                 ) = glucose_effects(
+                     *doses, model, start_dates, end_dates, values
+                     )
+
+                (effect_dates,
+                 effect_values
+                 ) = glucose_effects(
+                     *doses, model, start_dates, end_dates, values,
+                     engine="convolution"
+                     )
+
+                # doses that aren't on the 5-minute grid are exact too
+                self.assertEqual(expected_dates, effect_dates)
+                for i in range(0, len(expected_effect_values)):
+                    self.assertAlmostEqual(
+                        expected_effect_values[i], effect_values[i], 8
+                    )
+
+    def test_convolved_iob_matches_iterative(self):
+        doses = self.load_dose_fixture("normalized_doses")
+
+        for model in [self.MODEL, self.WALSH_MODEL]:
+            (expected_dates,
+             expected_insulin_values
+             ) = insulin_on_board(*doses, model)
+
+            (dates,
+             insulin_values
+             ) = insulin_on_board(*doses, model, engine="convolution")
+
+            self.assertEqual(expected_dates, dates)
+            for i in range(0, len(expected_dates)):
+                self.assertAlmostEqual(
+                    expected_insulin_values[i], insulin_values[i], 8
+                )
+
+        with self.assertRaises(ValueError):
+            insulin_on_board(*doses, self.MODEL, engine="unknown")
+
+    def test_gridded_delivery(self):
+        # on the grid, 2 minutes after the first date, and before the first
+        # date; the delivery after the timeline is dropped
+        (indexes, lags, units, leading_count) = gridded_delivery(
+            numpy.array([300, 420, -600, 3600]),
+            numpy.array([1, 2, 0.5, 4]),
+            3
+            )
+
+        self.assertEqual(2, leading_count)
+        numpy.testing.assert_array_equal([3, 4, 0], indexes)
+        numpy.testing.assert_allclose([0, 3, 0], lags)
+        numpy.testing.assert_allclose([1, 2, 0.5], units)
+
+        # nothing is counted at a date before a delivery, and each delivery
+        # has the curve at its own lag
+        def curve(lag):
+            return numpy.array([1, 0.5, 0.25]) - lag / 10
+
+        numpy.testing.assert_allclose(
+            [0.5, 0.25, 0.125, 1, 1.9],
+            convolved_delivery(indexes, lags, units, 5, curve)
+        )
+        numpy.testing.assert_allclose(
+            [0.5, 0.25, 0.125, 1.5, 2.4],
+            convolved_delivery(indexes, lags, units, 5, curve, 1)
+        )
+
     """ Tests for total_delivery """
     def test_total_delivery(self):
         (i_types,
@@ -0,0 +1,188 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the compiled insulin models in insulin_model.py
+"""
+# pylint: disable=C0111, R0201, R0904, W0105
+import unittest
+import numpy
+
+from pyloopkit.exponential_insulin_model import percent_effect_remaining
+from pyloopkit.walsh_insulin_model import walsh_percent_effect_remaining
+from pyloopkit.insulin_model import (
+    compile_insulin_model, tabulated_insulin_model,
+    InsulinModel, ExponentialInsulinModel, WalshInsulinModel)
+
+
+class TestInsulinModelFunctions(unittest.TestCase):
+    """ unittest class to run InsulinModel tests. """
+    MODEL = [360, 75]
+    WALSH_MODELS = [[2.5], [3], [4], [4.4], [5], [6], [7]]
+
+    # includes the plateaus before delivery and after the DIA, plus their
+    # exact boundaries
+    MINUTES = [-10, 0, 0.5, 5, 37.5, 75, 120, 240, 300, 359, 360, 361, 420, 500]
+
+    def test_compile_insulin_model(self):
+        model = compile_insulin_model(self.MODEL)
+        self.assertIsInstance(model, ExponentialInsulinModel)
+        self.assertEqual(360, model.effect_duration)
+        self.assertIs(model, compile_insulin_model([360, 75]))
+        self.assertIs(model, compile_insulin_model(model))
+
+        walsh_model = compile_insulin_model([4])
+        self.assertIsInstance(walsh_model, WalshInsulinModel)
+        self.assertEqual(240, walsh_model.effect_duration)
+
+        with self.assertRaises(ValueError):
+            compile_insulin_model([360, 75, 10])
+
+    def test_incomplete_insulin_model(self):
+        class RemainingOnlyModel(InsulinModel):
+            def percent_effect_remaining(self, minutes):
+                return 1
+
+        with self.assertRaises(TypeError):
+            InsulinModel()
+        with self.assertRaises(TypeError):
+            RemainingOnlyModel()
+
+    def test_exponential_matches_percent_effect_remaining(self):
+        for (duration, peak) in [(360, 75), (360, 65), (300, 55), (361, 75)]:
+            model = compile_insulin_model([duration, peak])
+            for minutes in self.MINUTES:
+                self.assertAlmostEqual(
+                    percent_effect_remaining(minutes, duration, peak),
+                    model.percent_effect_remaining(minutes),
+                    12
+                )
+
+            array = model.percent_effect_remaining_array(self.MINUTES)
+            for i in range(0, len(self.MINUTES)):
+                self.assertAlmostEqual(
+                    model.percent_effect_remaining(self.MINUTES[i]),
+                    array[i],
+                    12
+                )
+
+    def test_walsh_matches_walsh_percent_effect_remaining(self):
+        for parameters in self.WALSH_MODELS:
+            model = compile_insulin_model(parameters)
+            for minutes in self.MINUTES:
+                self.assertAlmostEqual(
+                    walsh_percent_effect_remaining(minutes, parameters[0]),
+                    model.percent_effect_remaining(minutes),
+                    12
+                )
+
+            array = model.percent_effect_remaining_array(self.MINUTES)
+            for i in range(0, len(self.MINUTES)):
+                self.assertAlmostEqual(
+                    model.percent_effect_remaining(self.MINUTES[i]),
+                    array[i],
+                    12
+                )
+
+    def test_percent_activity(self):
+        # activity is the rate the effect remaining drops at
+        step = 1e-4
+        for parameters in [self.MODEL] + self.WALSH_MODELS:
+            model = compile_insulin_model(parameters)
+            for fraction in [0.02, 0.1, 0.25, 0.5, 0.75, 0.95]:
+                minutes = fraction * model.effect_duration
+                slope = (
+                    model.percent_effect_remaining(minutes - step)
+                    - model.percent_effect_remaining(minutes + step)
+                ) / (2 * step)
+                self.assertAlmostEqual(
+                    slope, model.percent_activity(minutes), 6
+                )
+
+            self.assertEqual(0, model.percent_activity(-5))
+            self.assertEqual(0, model.percent_activity(0))
+            self.assertEqual(
+                0, model.percent_activity(model.effect_duration + 1)
+            )
+
+            array = model.percent_activity_array(self.MINUTES)
+            for i in range(0, len(self.MINUTES)):
+                self.assertAlmostEqual(
+                    model.percent_activity(self.MINUTES[i]), array[i], 12
+                )
+
+    def test_summed_percent_effect_remaining(self):
+        for parameters in [self.MODEL, [360, 65]] + self.WALSH_MODELS:
+            model = compile_insulin_model(parameters)
+            for first_minutes in [-20, 0, 3.5, 55, 360, 365, 600, 1000]:
+                for (step, count) in [(5, 0), (5, 1), (5, 80), (2.5, 150)]:
+                    expected = sum(
+                        model.percent_effect_remaining(
+                            first_minutes - k * step
+                        )
+                        for k in range(0, count)
+                    )
+                    self.assertAlmostEqual(
+                        expected,
+                        model.summed_percent_effect_remaining(
+                            first_minutes, step, count
+                        ),
+                        8
+                    )
+
+    def test_array_accepts_matrix(self):
+        model = compile_insulin_model(self.MODEL)
+        minutes = numpy.array([[-5, 60], [120, 400]])
+        remaining = model.percent_effect_remaining_array(minutes)
+
+        self.assertEqual((2, 2), remaining.shape)
+        self.assertEqual(1, remaining[0][0])
+        self.assertEqual(0, remaining[1][1])
+
+    def test_tabulated_insulin_model_cache(self):
+        table = tabulated_insulin_model(self.MODEL, 10, 5)
+        self.assertIs(table, tabulated_insulin_model([360, 75], 10, 5))
+        self.assertIs(table, tabulated_insulin_model(table, 10, 5))
+        self.assertIs(
+            table, tabulated_insulin_model(compile_insulin_model([360, 75]),
+                                           10, 5)
+        )
+        self.assertIsNot(table, tabulated_insulin_model(self.MODEL, 0, 5))
+        self.assertEqual(360, table.effect_duration)
+
+    def test_tabulated_insulin_model_on_grid(self):
+        # whole seconds after a dose starts are exactly on the grid
+        for parameters in [self.MODEL] + self.WALSH_MODELS:
+            model = compile_insulin_model(parameters)
+            table = tabulated_insulin_model(parameters, 10, 5)
+            for seconds in range(-700, 30000, 37):
+                minutes = (seconds - 600) / 60
+                self.assertAlmostEqual(
+                    model.percent_effect_remaining(minutes),
+                    table.percent_effect_remaining(minutes),
+                    12
+                )
+                self.assertAlmostEqual(
+                    model.percent_activity(minutes),
+                    table.percent_activity(minutes),
+                    12
+                )
+
+    def test_tabulated_insulin_model_interpolates(self):
+        for parameters in [self.MODEL, [4]]:
+            model = compile_insulin_model(parameters)
+            table = tabulated_insulin_model(parameters, 10, 5)
+            for minutes in [0.3, 12.345, 75.001, 200.77, 239.5]:
+                self.assertAlmostEqual(
+                    model.percent_effect_remaining(minutes),
+                    table.percent_effect_remaining(minutes),
+                    6
+                )
+                self.assertAlmostEqual(
+                    model.percent_activity(minutes),
+                    table.percent_activity(minutes),
+                    6
+                )
+
+
+if __name__ == '__main__':
+    unittest.main()
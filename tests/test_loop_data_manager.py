@@ -6,19 +6,23 @@ Created on Thu Jul 11 15:16:42 2019
 @author: annaquinlan
 """
 # pylint: disable=C0111, C0200, R0201, W0105, R0914, R0904
-from datetime import datetime
+from datetime import datetime, timedelta
 import unittest
 
 #from . import path_grabber  # pylint: disable=unused-import
 from pyloopkit.dose import DoseType
+from pyloopkit.instrumentation import (Instrumentation, Tracer,
+                                       current_instrumentation)
 from pyloopkit.loop_data_manager import (get_pending_insulin,
-                               update_retrospective_glucose_effect)
+                               update_retrospective_glucose_effect,
+                               update, update_many, replay,
+                               LoopDataManager)
 from .loop_kit_tests import load_fixture, find_root_path
 from pyloopkit.pyloop_parser import (
     load_momentum_effects, get_glucose_data, load_insulin_effects,
     get_insulin_data, get_basal_schedule, get_carb_ratios,
     get_sensitivities, get_settings, get_counteractions, get_carb_data,
-    get_retrospective_effects, parse_report_and_run
+    get_retrospective_effects, parse_report_and_run, parse_report
 )
 
 
@@ -278,6 +282,315 @@ class TestLoopDataManagerFunctions(unittest.TestCase):
             )
         self.assertIsNone(recommendation.get("recommended_temp_basal"))
 
+    """ Tests for LoopDataManager """
+    def samples_before(self, input_dict, date):
+        """ Copy an input dictionary, keeping only the samples from before a
+            date
+        """
+        output = dict(input_dict)
+
+        glucose = [
+            i for i in range(0, len(input_dict.get("glucose_dates")))
+            if input_dict.get("glucose_dates")[i] <= date
+        ]
+        for key in ["glucose_dates", "glucose_values"]:
+            output[key] = [input_dict.get(key)[i] for i in glucose]
+
+        doses = [
+            i for i in range(0, len(input_dict.get("dose_types")))
+            if input_dict.get("dose_start_times")[i] <= date
+        ]
+        for key in ["dose_types", "dose_start_times", "dose_end_times",
+                    "dose_values"]:
+            output[key] = [input_dict.get(key)[i] for i in doses]
+
+        carbs = [
+            i for i in range(0, len(input_dict.get("carb_dates")))
+            if input_dict.get("carb_dates")[i] <= date
+        ]
+        for key in ["carb_dates", "carb_values", "carb_absorption_times"]:
+            output[key] = [input_dict.get(key)[i] for i in carbs]
+
+        output["time_to_calculate_at"] = date
+        return output
+
+    def report_with_dose_history(self, report_name):
+        """ Load the input to an issue report, replacing its doses with a
+            temp basal every 30 minutes and a few boluses over the 12 hours
+            before it was run
+        """
+        input_dict = dict(self.run_report_through_runner(
+            report_name
+        ).get("input_data"))
+        date = input_dict.get("time_to_calculate_at")
+
+        doses = []
+        for i in range(24, 0, -1):
+            start = date - timedelta(minutes=30 * i + 7)
+            doses.append([
+                DoseType.tempbasal, start, start + timedelta(minutes=30),
+                [0.2, 1.5, 0.9, 2.4][i % 4]
+            ])
+            if i % 7 == 0:
+                doses.append([DoseType.bolus, start, start, 1.5])
+
+        for (index, key) in enumerate(["dose_types", "dose_start_times",
+                                       "dose_end_times", "dose_values"]):
+            input_dict[key] = [dose[index] for dose in doses]
+
+        return input_dict
+
+    def test_loop_data_manager_matches_update(self):
+        input_dict = self.report_with_dose_history("utc_issue_report")
+        start_date = input_dict.get("time_to_calculate_at") - timedelta(hours=2)
+
+        manager = LoopDataManager(self.samples_before(input_dict, start_date))
+        for cycle in range(0, 25):
+            date = start_date + timedelta(minutes=5 * cycle)
+            cycle_input = self.samples_before(input_dict, date)
+
+            # the manager gets every sample again, plus the new ones
+            manager.add_glucose(
+                cycle_input.get("glucose_dates"),
+                cycle_input.get("glucose_values")
+            )
+            manager.add_doses(
+                cycle_input.get("dose_types"),
+                cycle_input.get("dose_start_times"),
+                cycle_input.get("dose_end_times"),
+                cycle_input.get("dose_values")
+            )
+            manager.add_carbs(
+                cycle_input.get("carb_dates"),
+                cycle_input.get("carb_values"),
+                cycle_input.get("carb_absorption_times")
+            )
+            if cycle > 0:
+                # the counteraction effects from the last run are kept
+                self.assertTrue(manager.counteraction_effects[0])
+
+            recommendation = manager.update(
+                date, cycle_input.get("last_temporary_basal")
+            )
+            expected_recommendation = update(cycle_input)
+
+            self.assertEqual(
+                cycle_input.get("glucose_dates"), manager.glucose[0]
+            )
+            # the kept counteraction effects are the ones a run without them
+            # finds, so every output is the same
+            self.assertEqual(
+                sorted(expected_recommendation), sorted(recommendation)
+            )
+            for key in expected_recommendation:
+                if key != "input_data":
+                    self.assertEqual(
+                        expected_recommendation.get(key),
+                        recommendation.get(key)
+                    )
+
+    def test_replay(self):
+        input_dict = self.report_with_dose_history("utc_issue_report")
+        end_date = input_dict.get("time_to_calculate_at")
+        start_date = end_date - timedelta(hours=1)
+
+        steps = list(replay(input_dict, start_date, end_date))
+        self.assertEqual(13, len(steps))
+
+        running_count = 0
+        for (date, recommendation) in steps:
+            step_input = self.samples_before(input_dict, date)
+            # the last temp basal has the end it was programmed with
+            temp_basals = [
+                i for i in range(0, len(step_input.get("dose_types")))
+                if step_input.get("dose_types")[i] == DoseType.tempbasal
+            ]
+            step_input["last_temporary_basal"] = [
+                step_input.get(key)[temp_basals[-1]]
+                for key in ["dose_types", "dose_start_times",
+                            "dose_end_times", "dose_values"]
+            ]
+            if step_input["last_temporary_basal"][2] > date:
+                running_count += 1
+            # but a run only knows when the doses being delivered end up to
+            # now
+            step_input["dose_end_times"] = [
+                min(end, date) for end in step_input.get("dose_end_times")
+            ]
+            expected_recommendation = update(step_input)
+
+            self.assertEqual(
+                date, recommendation.get("input_data").get(
+                    "time_to_calculate_at")
+            )
+            for key in expected_recommendation:
+                if key != "input_data":
+                    self.assertEqual(
+                        expected_recommendation.get(key),
+                        recommendation.get(key)
+                    )
+        # most steps run while a temp basal is still being delivered
+        self.assertGreater(running_count, len(steps) // 2)
+
+    def test_update_many(self):
+        inputs = []
+        for report_name in ["utc_issue_report", "timezoned_issue_report",
+                            "high_bg_recommended_basal_and_bolus_report"]:
+            root = find_root_path(report_name, ".json")
+            inputs.append(parse_report(root + "/" + report_name + ".json"))
+        # a bad input shouldn't stop the others from running
+        inputs.insert(1, {})
+
+        expected = [update(inputs[i]) for i in [0, 2, 3]]
+        for (workers, chunksize) in [(0, 1), (2, 2)]:
+            outputs = list(
+                update_many(inputs, workers=workers, chunksize=chunksize)
+            )
+
+            self.assertEqual(4, len(outputs))
+            self.assertIsInstance(outputs[1], Exception)
+            for (expected_output, output) in zip(
+                    expected, [outputs[i] for i in [0, 2, 3]]):
+                for key in ["predicted_glucose_dates",
+                            "predicted_glucose_values",
+                            "recommended_temp_basal", "recommended_bolus"]:
+                    self.assertEqual(
+                        expected_output.get(key), output.get(key)
+                    )
+
+    def test_update_instrumentation(self):
+        input_dict = self.report_with_dose_history("utc_issue_report")
+        expected = update(input_dict)
+        self.assertNotIn("instrumentation", expected)
+
+        output = update(input_dict, instrumentation=True)
+        for key in ["predicted_glucose_values", "recommended_temp_basal",
+                    "recommended_bolus"]:
+            self.assertEqual(expected.get(key), output.get(key))
+
+        stages = output["instrumentation"]["stages"]
+        self.assertEqual(
+            ["validation", "momentum", "insulin_effects", "counteraction",
+             "carb_effects", "retrospective_correction", "prediction",
+             "recommendation", "total"],
+            list(stages)
+        )
+        self.assertTrue(all(seconds >= 0 for seconds in stages.values()))
+        self.assertLessEqual(
+            sum(stages.values()) - stages["total"], stages["total"]
+        )
+
+        counts = output["instrumentation"]["counts"]
+        self.assertEqual(len(input_dict["dose_types"]), counts["doses"])
+        self.assertEqual(
+            len(output["predicted_glucose_dates"]),
+            counts["predicted_glucose_dates"]
+        )
+        self.assertEqual(
+            len(output["counteraction_effect_values"]),
+            counts["counteraction_effects"]
+        )
+        for key in ["reconciled_doses", "insulin_effect_dates",
+                    "insulin_model_evaluations", "carb_builders"]:
+            self.assertGreater(counts[key], 0)
+
+        # a sink is called with the same format, and an Instrumentation sums
+        # the runs recorded to it
+        sunk = []
+        update(input_dict, instrumentation=sunk.append)
+        self.assertEqual(1, len(sunk))
+        self.assertEqual(counts, sunk[0]["counts"])
+
+        instrumentation = Instrumentation()
+        update(input_dict, instrumentation=instrumentation)
+        update(input_dict, instrumentation=instrumentation)
+        self.assertEqual(
+            2 * counts["reconciled_doses"],
+            instrumentation.counts["reconciled_doses"]
+        )
+
+        # nothing is recorded once update returns
+        self.assertIsNone(current_instrumentation())
+
+    def test_update_tracing(self):
+        input_dict = self.report_with_dose_history("utc_issue_report")
+        tracer = Tracer()
+        output = update(input_dict, instrumentation=tracer)
+        self.assertNotIn("instrumentation", output)
+
+        # each span's parent is the innermost span around it
+        spans = sorted(
+            tracer.spans, key=lambda span: (span["start"], span["depth"])
+        )
+        parents = {}
+        open_spans = []
+        for span in spans:
+            while open_spans[span["depth"]:]:
+                open_spans.pop()
+            self.assertEqual(len(open_spans), span["depth"])
+            if open_spans:
+                parent = open_spans[-1]
+                self.assertLessEqual(
+                    span["start"] + span["duration"],
+                    parent["start"] + parent["duration"]
+                )
+                parents.setdefault(span["name"], parent["name"])
+            open_spans.append(span)
+
+        for (name, parent) in [
+                ("get_glucose_effects", "insulin_effects"),
+                ("get_prepared_doses", "get_glucose_effects"),
+                ("reconciled", "get_prepared_doses"),
+                ("annotated", "get_prepared_doses"),
+                ("glucose_effects", "get_glucose_effects"),
+                ("map_", "get_carb_glucose_effects_and_carbs_on_board"),
+                ("dynamic_glucose_effects", "get_carb_glucose_effects"),
+                ("recommended_temp_basal_and_bolus", "recommendation")]:
+            self.assertEqual(parent, parents.get(name))
+
+        # counts are kept with the span they were recorded in (the doses
+        # are prepared once for the past and once for the future effects)
+        prepared_doses = [
+            span for span in spans if span["name"] == "get_prepared_doses"
+        ]
+        self.assertEqual(2, len(prepared_doses))
+        self.assertEqual(
+            tracer.counts["reconciled_doses"],
+            sum(span["metadata"]["reconciled_doses"]
+                for span in prepared_doses)
+        )
+
+        events = tracer.chrome_trace()["traceEvents"]
+        self.assertEqual(
+            [span["name"] for span in spans],
+            [event["name"] for event in events]
+        )
+        self.assertEqual("total", events[0]["name"])
+
+    def test_loop_data_manager_eviction(self):
+        input_dict = self.report_with_dose_history("utc_issue_report")
+        date = input_dict.get("time_to_calculate_at")
+
+        manager = LoopDataManager(input_dict)
+        manager.update(date)
+        later_date = date + timedelta(hours=20)
+        manager.evict(later_date)
+
+        self.assertTrue(manager.glucose[0])
+        self.assertTrue(
+            min(manager.glucose[0]) >= later_date - timedelta(hours=24)
+        )
+        self.assertTrue(
+            min(manager.counteraction_effects[1])
+            >= later_date - timedelta(hours=24)
+        )
+        self.assertTrue(
+            min(manager.doses[2])
+            >= later_date - timedelta(hours=24)
+            - timedelta(minutes=input_dict.get(
+                "settings_dictionary").get("model")[0])
+        )
+
     """ Tests for get_pending_insulin """
     def test_negative_pending_insulin(self):
         now_time = datetime.fromisoformat("2019-08-01T12:15:00")
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the columnar inputs in loop_input.py
+"""
+# pylint: disable=C0111, R0201, R0904, W0105
+from datetime import timedelta, timezone
+import unittest
+import warnings
+import numpy
+
+from pyloopkit.loop_data_manager import update
+from pyloopkit.loop_input import LoopInput
+from pyloopkit.pyloop_parser import parse_report
+from .loop_kit_tests import find_root_path
+
+
+class TestLoopInputFunctions(unittest.TestCase):
+    """ unittest class to run LoopInput tests. """
+    def load_report_input(self, report_name):
+        root = find_root_path(report_name, ".json")
+        return parse_report(root + "/" + report_name + ".json")
+
+    def test_loop_input_round_trip(self):
+        for report_name in ["utc_issue_report", "timezoned_issue_report"]:
+            input_dict = self.load_report_input(report_name)
+            loop_input = LoopInput(input_dict)
+
+            self.assertEqual(numpy.int64, loop_input.glucose_timestamps.dtype)
+            self.assertEqual(numpy.int8, loop_input.dose_type_codes.dtype)
+            self.assertEqual(
+                len(input_dict.get("dose_values")),
+                len(loop_input.dose_values)
+            )
+            self.assertEqual(input_dict, loop_input.to_dict())
+
+    def test_update_with_loop_input(self):
+        input_dict = self.load_report_input("utc_issue_report")
+        expected = update(input_dict)
+        output = update(LoopInput(input_dict))
+
+        for key in ["predicted_glucose_dates", "predicted_glucose_values",
+                    "recommended_temp_basal", "recommended_bolus",
+                    "counteraction_effect_values", "carb_effect_values"]:
+            self.assertEqual(expected.get(key), output.get(key))
+
+    def test_mixed_utc_offsets(self):
+        # dates from before a daylight saving change keep their own offset
+        input_dict = self.load_report_input("utc_issue_report")
+        change = input_dict.get("time_to_calculate_at") - timedelta(hours=5)
+        for key in ["glucose_dates", "dose_start_times", "dose_end_times",
+                    "carb_dates"]:
+            input_dict[key] = [
+                date.astimezone(timezone(
+                    date.utcoffset() - timedelta(hours=1)
+                )) if date < change else date
+                for date in input_dict.get(key)
+            ]
+        for key in ["glucose_dates", "dose_start_times"]:
+            self.assertEqual(
+                2, len({date.utcoffset() for date in input_dict.get(key)})
+            )
+
+        loop_input = LoopInput(input_dict)
+        self.assertEqual(numpy.int32, loop_input.glucose_utc_offsets.dtype)
+
+        round_trip = loop_input.to_dict()
+        for key in ["glucose_dates", "dose_start_times", "dose_end_times",
+                    "carb_dates"]:
+            self.assertEqual(
+                [(date, date.utcoffset()) for date in input_dict.get(key)],
+                [(date, date.utcoffset()) for date in round_trip.get(key)]
+            )
+
+        self.assertEqual(update(input_dict), update(loop_input))
+
+    def test_invalid_loop_input(self):
+        input_dict = self.load_report_input("utc_issue_report")
+        input_dict["carb_values"] = [-10] * len(input_dict["carb_values"])
+
+        # a LoopInput is validated when it's run, like a dictionary
+        loop_input = LoopInput(input_dict)
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            self.assertEqual([], update(loop_input))
+
+        input_dict["carb_values"] = input_dict["carb_values"][1:]
+        with self.assertRaises(AssertionError):
+            LoopInput(input_dict)
+
+
+if __name__ == '__main__':
+    unittest.main()
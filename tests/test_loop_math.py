@@ -10,11 +10,13 @@ Github URL: https://github.com/tidepool-org/LoopKit/blob/
 """
 # pylint: disable=C0111, C0200, R0201, W0105
 import unittest
-from datetime import datetime
+from datetime import datetime, timedelta
 
 #from . import path_grabber  # pylint: disable=unused-import
 from .loop_kit_tests import load_fixture
-from pyloopkit.loop_math import predict_glucose, decay_effect, subtracting, combined_sums
+from pyloopkit.loop_math import (predict_glucose, predict_glucose_on_grid,
+                                 decay_effect, subtracting, combined_sums,
+                                 windowed_sums)
 from pyloopkit.date import time_interval_since
 
 
@@ -386,6 +388,85 @@ class TestLoopMathFunctions(unittest.TestCase):
                 expected_values[i], predicted_values[i], 3
             )
 
+    def test_predict_glucose_on_grid(self):
+        glucose = self.load_glucose_history_fixture(
+            "glucose_from_effects_glucose_input"
+        )
+        momentum = self.load_glucose_effect_fixture_iso_time(
+            "glucose_from_effects_momentum_up_input"
+        )
+        (expected_dates,
+         expected_values
+         ) = self.load_glucose_value_fixture(
+             "glucose_from_effects_momentum_up_output"
+             )
+
+        (predicted_dates,
+         predicted_values
+         ) = predict_glucose_on_grid(
+             glucose[0][0], glucose[1][0],
+             *momentum,
+             *self.carb_effect(),
+             *self.insulin_effect(),
+             [], []
+             )
+        self.assertEqual(
+            len(expected_dates), len(predicted_dates)
+        )
+
+        for i in range(0, len(expected_dates)):
+            self.assertEqual(
+                expected_dates[i], predicted_dates[i]
+            )
+            self.assertAlmostEqual(
+                expected_values[i], predicted_values[i], 3
+            )
+
+    def test_predict_glucose_off_grid(self):
+        glucose = self.load_glucose_history_fixture(
+            "glucose_from_effects_glucose_input"
+        )
+        (carb_dates, carb_values) = self.carb_effect()
+        (insulin_dates, insulin_values) = self.insulin_effect()
+        # move the insulin effects off of the carb effects' grid
+        insulin_dates = [
+            date + timedelta(seconds=30) for date in insulin_dates
+        ]
+
+        self.assertIsNone(
+            predict_glucose_on_grid(
+                glucose[0][0], glucose[1][0],
+                [], [],
+                carb_dates, carb_values,
+                insulin_dates, insulin_values,
+                [], []
+            )
+        )
+
+        (predicted_dates,
+         predicted_values
+         ) = predict_glucose(
+             glucose[0][0], glucose[1][0],
+             [], [],
+             carb_dates, carb_values,
+             insulin_dates, insulin_values
+             )
+
+        later_dates = sorted(
+            date for date in set(carb_dates + insulin_dates)
+            if date > glucose[0][0]
+        )
+        self.assertEqual([glucose[0][0]] + later_dates, predicted_dates)
+
+        # the prediction adds up every change in effect after the start
+        expected_value = glucose[1][0]
+        for (dates, values) in [(carb_dates, carb_values),
+                                (insulin_dates, insulin_values)]:
+            for i in range(1, len(dates)):
+                if dates[i] > glucose[0][0]:
+                    expected_value += values[i] - values[i - 1]
+        self.assertAlmostEqual(expected_value, predicted_values[-1], 3)
+
     """ Decay_effects tests """
     def test_decay_effect(self):
         glucose_date = datetime(2016, 2, 1, 10, 13, 20)
@@ -587,6 +668,54 @@ class TestLoopMathFunctions(unittest.TestCase):
                 expected_values[i], values[i], 2
             )
 
+    def test_windowed_sums(self):
+        start = datetime(2019, 7, 1, 12)
+        dates = [start + timedelta(minutes=5 * i) for i in range(0, 20)]
+        # window start, settled date (or None), and slope of each entry
+        entries = [
+            (start - timedelta(hours=1), start + timedelta(minutes=12), 1),
+            (start + timedelta(minutes=30), None, 2),
+            (start + timedelta(minutes=41), start + timedelta(minutes=60), 3),
+            (start + timedelta(hours=3), None, 4)
+        ]
+        evaluated = []
+
+        def contribution(i, date):
+            evaluated.append(i)
+            (window_start, settled_date, slope) = entries[i]
+            if date < window_start:
+                return 0
+            end = min(date, settled_date or date)
+            return slope * time_interval_since(end, window_start) / 60
+
+        sums = windowed_sums(
+            dates,
+            [entry[0] for entry in entries],
+            [entry[1] for entry in entries],
+            contribution
+        )
+
+        for i in range(0, len(dates)):
+            self.assertAlmostEqual(
+                sum(contribution(j, dates[i]) for j in range(0, 4)),
+                sums[i],
+                10
+            )
+        # entries are only evaluated inside their windows, plus once to find
+        # the value they settle at
+        self.assertEqual(22, len(evaluated) - 4 * len(dates))
+
+        # the sums don't depend on the date the timeline starts at
+        self.assertEqual(
+            sums[13:],
+            windowed_sums(
+                dates[13:],
+                [entry[0] for entry in entries],
+                [entry[1] for entry in entries],
+                contribution
+            )
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -7,11 +7,13 @@ Created on Sun Jun 16 15:41:18 2019
 """
 # pylint: disable=C0111, C0411, W0105
 import unittest
-from datetime import datetime, timedelta
+from datetime import datetime, timedelta, timezone
 
 #from . import path_grabber  # pylint: disable=unused-import
 from pyloopkit.date import (date_floored_to_time_interval, date_ceiled_to_time_interval,
-                  time_interval_since_reference_date, time_interval_since)
+                  time_interval_since_reference_date, time_interval_since,
+                  timestamp_since_reference_date, timestamps_since_reference_date,
+                  timeline_dates, MICROSECONDS_PER_SECOND)
 
 REF_DATE = datetime(2001, 1, 1, 0, 0, 0)
 
@@ -95,6 +97,47 @@ class TestDateFunctions(unittest.TestCase):
                          time_interval_since(date, date +
                                              timedelta(seconds=86400)))
 
+    """ Tests for timestamp_since_reference_date """
+    def test_timestamp_since_reference_date(self):
+        self.assertEqual(0, timestamp_since_reference_date(REF_DATE))
+        self.assertEqual(-200000000, timestamp_since_reference_date(
+            REF_DATE + timedelta(seconds=-200)))
+        self.assertEqual(86400000007, timestamp_since_reference_date(
+            REF_DATE + timedelta(days=1, microseconds=7)))
+
+        # dates with timezones are measured in UTC
+        pacific = timezone(timedelta(hours=-7))
+        self.assertEqual(
+            7 * 3600 * MICROSECONDS_PER_SECOND,
+            timestamp_since_reference_date(REF_DATE.replace(tzinfo=pacific))
+        )
+
+        date = datetime(2019, 7, 20, 0, 22, 19, 123456, tzinfo=pacific)
+        other_date = datetime(2019, 7, 19, 18, 50, 50, tzinfo=timezone.utc)
+        self.assertEqual(
+            time_interval_since(date, other_date),
+            (timestamp_since_reference_date(date)
+             - timestamp_since_reference_date(other_date))
+            / MICROSECONDS_PER_SECOND
+        )
+        self.assertEqual(
+            [timestamp_since_reference_date(date),
+             timestamp_since_reference_date(other_date)],
+            timestamps_since_reference_date([date, other_date]).tolist()
+        )
+
+    def test_timeline_dates(self):
+        start = datetime(2019, 7, 20, 0, 20)
+        self.assertEqual(
+            [start, start + timedelta(minutes=5),
+             start + timedelta(minutes=10)],
+            timeline_dates(start, start + timedelta(minutes=14), 5)
+        )
+        self.assertEqual([start], timeline_dates(start, start, 5))
+        self.assertEqual(
+            [], timeline_dates(start, start - timedelta(minutes=1), 5)
+        )
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for running many issue reports with pyloop_parser.py
+"""
+# pylint: disable=C0111, R0201, R0904, W0105
+from datetime import datetime, timedelta
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from pyloopkit import pyloop_parser
+from pyloopkit.pyloop_parser import (
+    parse_report_and_run, parse_reports_and_run, find_report_paths,
+    parse_dates, parse_date, parse_report, load_report, REPORT_KEYS)
+from .loop_kit_tests import find_full_path, load_fixture
+
+
+class TestPyloopParserFunctions(unittest.TestCase):
+    """ unittest class to run the issue report runner tests. """
+    REPORT_NAMES = ["utc_issue_report", "timezoned_issue_report"]
+
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        for name in self.REPORT_NAMES:
+            shutil.copy(
+                find_full_path(name, ".json"),
+                os.path.join(self.directory, name + ".json")
+            )
+
+        # a report without glucose information can't be run
+        report = load_fixture("utc_issue_report", ".json")
+        del report["cached_glucose_samples"]
+        with open(os.path.join(self.directory, "no_glucose.json"), "w") as file:
+            json.dump(report, file)
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_parse_dates(self):
+        date_strings = [
+            "2019-07-25 23:12:46 +0000",
+            " 2019-11-03 01:59:59 -0700",
+            "2019-11-03 01:00:00 -0800",
+            "2020-02-29 23:59:59 +0530"
+        ]
+        for offset in [0, -25200, 19800, 0.5]:
+            expected = [
+                datetime.strptime(
+                    date_string.strip(), "%Y-%m-%d %H:%M:%S %z"
+                ) + timedelta(seconds=offset)
+                for date_string in date_strings
+            ]
+            dates = parse_dates(date_strings, offset)
+            self.assertEqual(expected, dates)
+            self.assertEqual(
+                [date.utcoffset() for date in expected],
+                [date.utcoffset() for date in dates]
+            )
+            self.assertEqual(expected[1], parse_date(date_strings[1], offset))
+
+        self.assertEqual([], parse_dates([]))
+        with self.assertRaises(ValueError):
+            parse_date("2019-07-25 23:12:46")
+
+    def test_load_report(self):
+        path = find_full_path("utc_issue_report", ".json")
+        full_report = load_fixture("utc_issue_report", ".json")
+
+        report = load_report(path)
+        self.assertTrue(set(report.keys()) <= set(REPORT_KEYS))
+        self.assertNotIn("insulin_counteraction_effects", report)
+        for key in report:
+            self.assertEqual(full_report.get(key), report.get(key))
+        self.assertEqual(full_report, load_report(path, keys=None))
+
+        # the json module gives the same report as orjson
+        expected_input = parse_report(path)
+        backend = pyloop_parser.orjson
+        pyloop_parser.orjson = None
+        try:
+            self.assertEqual(report, load_report(path))
+            self.assertEqual(expected_input, parse_report(path))
+        finally:
+            pyloop_parser.orjson = backend
+
+        # reports that only the json module accepts are still loaded
+        path = os.path.join(self.directory, "not_a_number.json")
+        with open(path, "w") as file:
+            file.write('{"suspend_threshold": NaN, "maximum_bolus": 10}')
+        report = load_report(path)
+        self.assertNotEqual(
+            report.get("suspend_threshold"), report.get("suspend_threshold")
+        )
+        self.assertEqual(10, report.get("maximum_bolus"))
+
+    def test_parse_report_with_override_histories(self):
+        report = load_fixture("utc_issue_report", ".json")
+        report["basalProfileApplyingOverrideHistory_items"] = [
+            {"startTime": 0.0, "value": 0.6}
+        ]
+        report["carbRatioScheduleApplyingOverrideHistory_items"] = [
+            {"startTime": 0.0, "value": 16.0}
+        ]
+        report["insulinSensitivityScheduleApplyingOverrideHistory_items"] = [
+            {"startTime": 0.0, "value": 35.0}
+        ]
+        path = os.path.join(self.directory, "overridden.json")
+        with open(path, "w") as file:
+            json.dump(report, file)
+
+        for key in report:
+            if key.endswith("OverrideHistory_items"):
+                self.assertIn(key, REPORT_KEYS)
+
+        # the overrides are used instead of the schedules
+        input_dict = parse_report(path)
+        self.assertEqual([0.6], input_dict.get("basal_rate_values"))
+        self.assertEqual([16.0], input_dict.get("carb_ratio_values"))
+        self.assertEqual([35.0], input_dict.get("sensitivity_ratio_values"))
+
+        # and loading only the report keys gives the same input as loading
+        # the whole report
+        pyloop_parser.load_report = lambda path: load_report(path, keys=None)
+        try:
+            self.assertEqual(input_dict, parse_report(path))
+        finally:
+            pyloop_parser.load_report = load_report
+
+    def test_find_report_paths(self):
+        self.assertEqual(
+            [os.path.join(self.directory, name + ".json")
+             for name in ["no_glucose"] + sorted(self.REPORT_NAMES)],
+            find_report_paths(self.directory)
+        )
+        self.assertEqual(
+            [os.path.join(self.directory, "utc_issue_report.json")],
+            find_report_paths(os.path.join(self.directory, "utc*.json"))
+        )
+
+    def test_parse_reports_and_run(self):
+        for workers in [0, 2]:
+            output_path = os.path.join(self.directory, "output.jsonl")
+            summary = parse_reports_and_run(
+                self.directory, output_path, workers=workers
+            )
+
+            self.assertEqual(3, summary.get("report_count"))
+            self.assertEqual(1, summary.get("error_count"))
+            no_glucose_path = os.path.join(self.directory, "no_glucose.json")
+            self.assertEqual(
+                "RuntimeError: No glucose information found",
+                summary.get("errors").get(no_glucose_path)
+            )
+
+            with open(output_path) as file:
+                lines = [json.loads(line) for line in file]
+            self.assertEqual(
+                find_report_paths(self.directory),
+                [line.get("report") for line in lines]
+            )
+            self.assertNotIn("output", lines[0])
+
+            expected = parse_report_and_run(
+                self.directory, "utc_issue_report.json"
+            )
+            output = lines[2].get("output")
+            self.assertEqual(
+                expected.get("recommended_temp_basal"),
+                output.get("recommended_temp_basal")
+            )
+            self.assertEqual(
+                [date.isoformat()
+                 for date in expected.get("predicted_glucose_dates")],
+                output.get("predicted_glucose_dates")
+            )
+            self.assertEqual(
+                expected.get("predicted_glucose_values"),
+                output.get("predicted_glucose_values")
+            )
+
+
+if __name__ == '__main__':
+    unittest.main()
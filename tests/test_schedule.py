@@ -0,0 +1,123 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the compiled schedules in schedule.py
+"""
+# pylint: disable=C0111, R0201, R0904, W0105
+import unittest
+from datetime import datetime, time, timedelta
+
+from pyloopkit.schedule import Schedule, compiled_schedule
+from pyloopkit.insulin_math import is_time_between
+
+
+def scan_schedule(start_times, end_times, values, time_to_check):
+    """ Finds the schedule value by checking every entry in turn """
+    for i in range(0, len(start_times)):
+        end = (end_times[i] if end_times
+               else start_times[i + 1] if i + 1 < len(start_times)
+               else start_times[0])
+        if is_time_between(start_times[i], end, time_to_check):
+            return values[i]
+    return 0
+
+
+class TestScheduleFunctions(unittest.TestCase):
+    """ unittest class to run Schedule tests. """
+    DAY = datetime(2019, 8, 1)
+
+    SENSITIVITY_STARTS = [time(0, 0), time(19, 0), time(21, 0)]
+    SENSITIVITY_ENDS = [time(19, 0), time(21, 0), time(0, 0)]
+    SENSITIVITY_VALUES = [40, 140, 10]
+
+    def check_matches_scan(self, start_times, end_times, values):
+        schedule = Schedule(start_times, end_times, values)
+
+        moments = []
+        for boundary in start_times + end_times:
+            moment = datetime.combine(self.DAY, boundary)
+            moments += [
+                moment - timedelta(microseconds=1),
+                moment,
+                moment + timedelta(microseconds=1),
+                moment + timedelta(seconds=1)
+            ]
+        moments += [self.DAY + timedelta(minutes=7 * i) for i in range(206)]
+
+        array_values = schedule.values_at(moments)
+        for i in range(0, len(moments)):
+            expected = scan_schedule(
+                start_times, end_times, values, moments[i]
+            )
+            self.assertEqual(expected, schedule.value_at(moments[i]))
+            self.assertEqual(expected, array_values[i])
+
+    def test_schedule_with_end_times(self):
+        # boundaries are inclusive, so the first entry wins at 19:00
+        schedule = Schedule(
+            self.SENSITIVITY_STARTS,
+            self.SENSITIVITY_ENDS,
+            self.SENSITIVITY_VALUES
+        )
+        self.assertEqual(40, schedule.value_at(self.DAY.replace(hour=19)))
+        self.assertEqual(
+            140, schedule.value_at(self.DAY.replace(hour=19, second=1))
+        )
+        self.assertEqual(40, schedule.value_at(time(0, 0)))
+
+        self.check_matches_scan(
+            self.SENSITIVITY_STARTS,
+            self.SENSITIVITY_ENDS,
+            self.SENSITIVITY_VALUES
+        )
+
+    def test_schedule_without_end_times(self):
+        self.check_matches_scan(
+            [time(0, 0), time(6, 30), time(12, 0, 15), time(22, 0)],
+            [],
+            [0.8, 1.1, 0.95, 0.7]
+        )
+
+        # the last entry wraps around to the first start time
+        self.check_matches_scan(
+            [time(3, 0), time(9, 0), time(23, 0)],
+            [],
+            [10, 12, 9]
+        )
+
+    def test_schedule_crossing_midnight_with_gaps(self):
+        self.check_matches_scan(
+            [time(22, 0), time(8, 0), time(8, 0)],
+            [time(6, 0), time(12, 0, 0, 500), time(18, 0)],
+            [100, 110, 120]
+        )
+
+        schedule = Schedule([time(8, 0)], [time(12, 0)], [90])
+        self.assertEqual(0, schedule.value_at(time(13, 0)))
+
+    def test_compiled_schedule_cache(self):
+        schedule = compiled_schedule(
+            self.SENSITIVITY_STARTS,
+            self.SENSITIVITY_ENDS,
+            self.SENSITIVITY_VALUES
+        )
+        self.assertIs(
+            schedule,
+            compiled_schedule(
+                list(self.SENSITIVITY_STARTS),
+                list(self.SENSITIVITY_ENDS),
+                list(self.SENSITIVITY_VALUES)
+            )
+        )
+        self.assertIsNot(
+            schedule,
+            compiled_schedule(
+                self.SENSITIVITY_STARTS,
+                self.SENSITIVITY_ENDS,
+                [40, 140, 20]
+            )
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()
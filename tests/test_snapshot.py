@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+Tests for the binary snapshots in snapshot.py
+"""
+# pylint: disable=C0111, R0201, R0904, W0105
+from datetime import datetime, time, timedelta, timezone
+import os
+import shutil
+import tempfile
+import unittest
+import numpy
+
+from pyloopkit.dose import DoseType
+from pyloopkit.loop_data_manager import update
+from pyloopkit.loop_input import LoopInput
+from pyloopkit.pyloop_parser import (
+    parse_report, load_dictionary_from_previous_run, parse_snapshot_and_run)
+from pyloopkit.snapshot import (
+    save_snapshot, load_snapshot, load_snapshot_columns)
+from .loop_kit_tests import find_full_path
+
+
+class TestSnapshotFunctions(unittest.TestCase):
+    """ unittest class to run snapshot tests. """
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "snapshot.npz")
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def test_snapshot_round_trip(self):
+        dictionary = {
+            "aware_dates": [
+                datetime(2019, 11, 3, 1, 59, tzinfo=timezone(
+                    timedelta(hours=-7))),
+                datetime(2019, 11, 3, 1, 0, 0, 5, tzinfo=timezone(
+                    timedelta(hours=-8))),
+            ],
+            "naive_dates": [datetime(2019, 7, 1, 12), datetime(1999, 1, 1)],
+            "times": [time(0, 0), time(23, 59, 59, 999999)],
+            "dose_types": [DoseType.tempbasal, DoseType.bolus],
+            "ints": [1, -2, 3],
+            "floats": [0.1, 1e-300, float("inf")],
+            "numbers": [0, 1.5, -3],
+            "nested": {"model": [360, 75], "flag": True, "name": None},
+            "tuple": (1.2, 30),
+            "notice": ("glucoseBelowSuspendThreshold", 62.5),
+            "date": datetime(2019, 8, 1, 8, 30),
+            "empty": [],
+            "mixed": [1, "a", None]
+        }
+        for mmap_mode in [None, "r"]:
+            save_snapshot(self.path, dictionary)
+            loaded = load_snapshot(self.path, mmap_mode)
+            self.assertEqual(dictionary, loaded)
+            self.assertEqual(
+                [date.utcoffset() for date in dictionary["aware_dates"]],
+                [date.utcoffset() for date in loaded["aware_dates"]]
+            )
+            self.assertEqual(
+                [type(value) for value in dictionary["numbers"]],
+                [type(value) for value in loaded["numbers"]]
+            )
+            self.assertIsInstance(loaded["tuple"], tuple)
+
+        columns = load_snapshot_columns(self.path)
+        self.assertIsInstance(columns["floats"], numpy.memmap)
+        self.assertEqual(numpy.int8, columns["dose_types"].dtype)
+        self.assertEqual([0.1, 1e-300, float("inf")],
+                         columns["floats"].tolist())
+
+    def test_snapshot_of_report_and_output(self):
+        input_dict = parse_report(
+            find_full_path("timezoned_issue_report", ".json")
+        )
+        output = update(input_dict)
+
+        save_snapshot(self.path, LoopInput(input_dict))
+        self.assertEqual(input_dict, load_snapshot(self.path))
+
+        save_snapshot(self.path, output)
+        self.assertEqual(output, load_snapshot(self.path, "r"))
+
+    def test_snapshot_matches_previous_run_json(self):
+        path = os.path.join(
+            os.path.dirname(__file__), "..", "pyloopkit", "example_files"
+        )
+        input_dict = load_dictionary_from_previous_run(
+            path, "example_from_previous_run.json"
+        )
+        save_snapshot(self.path, input_dict)
+        self.assertEqual(input_dict, load_snapshot(self.path, "r"))
+
+        self.assertEqual(
+            update(input_dict).get("predicted_glucose_values"),
+            parse_snapshot_and_run(self.directory, "snapshot.npz").get(
+                "predicted_glucose_values")
+        )
+
+
+if __name__ == '__main__':
+    unittest.main()